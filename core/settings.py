@@ -4,6 +4,7 @@ Django settings for core project.
 
 import importlib.util
 import os
+from datetime import timedelta
 from pathlib import Path
 from urllib.parse import parse_qs, urlparse
 
@@ -50,6 +51,40 @@ MIDDLEWARE = [
 
 if importlib.util.find_spec('django_otp'):
     MIDDLEWARE.insert(5, 'django_otp.middleware.OTPMiddleware')
+
+# Opt-in request instrumentation (management.instrumentation). Sampled requests get a
+# Server-Timing header, a JSON log line and a slot in the in-process ring buffer
+# summarised at /vendor/ops/request-profile/. Lower the sample rate, turn off query
+# fingerprinting or raise the log threshold to trim its overhead under load.
+REQUEST_INSTRUMENTATION = os.getenv('REQUEST_INSTRUMENTATION', 'false').lower() == 'true'
+REQUEST_INSTRUMENTATION_SAMPLE_RATE = float(os.getenv('REQUEST_INSTRUMENTATION_SAMPLE_RATE', '1.0'))
+REQUEST_INSTRUMENTATION_FINGERPRINTS = os.getenv('REQUEST_INSTRUMENTATION_FINGERPRINTS', 'true').lower() == 'true'
+REQUEST_INSTRUMENTATION_LOG_THRESHOLD_MS = float(os.getenv('REQUEST_INSTRUMENTATION_LOG_THRESHOLD_MS', '0'))
+REQUEST_INSTRUMENTATION_BUFFER_SIZE = int(os.getenv('REQUEST_INSTRUMENTATION_BUFFER_SIZE', '5000'))
+if REQUEST_INSTRUMENTATION:
+    # outermost, so the timing covers every other middleware
+    MIDDLEWARE.insert(0, 'management.instrumentation.RequestInstrumentationMiddleware')
+
+# Every task in management.tasks records a TaskRun: duration, queries and, per phase,
+# time, queries and row/email counters. Prometheus scrapes them from
+# /vendor/ops/task-metrics/ as staff or with 'Authorization: Bearer <METRICS_TOKEN>'.
+# Phase progress is logged at DEBUG on management.instrumentation.
+TASK_INSTRUMENTATION = os.getenv('TASK_INSTRUMENTATION', 'true').lower() == 'true'
+TASK_RUN_RETENTION_DAYS = int(os.getenv('TASK_RUN_RETENTION_DAYS', '90'))
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {'console': {'class': 'logging.StreamHandler'}},
+    'loggers': {
+        'management.instrumentation': {
+            'handlers': ['console'],
+            'level': os.getenv('INSTRUMENTATION_LOG_LEVEL', 'INFO'),
+            'propagate': False,
+        },
+    },
+}
 ROOT_URLCONF = 'core.urls'
 
 TEMPLATES = [
@@ -102,6 +137,26 @@ else:
         }
     }
 
+CACHE_URL = os.getenv('CACHE_URL')
+if CACHE_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': CACHE_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+DASHBOARD_CACHE_TTL = int(os.getenv('DASHBOARD_CACHE_TTL', '300'))
+AUDIT_EXPORT_CHUNK_SIZE = int(os.getenv('AUDIT_EXPORT_CHUNK_SIZE', '2000'))
+API_EXPORT_CHUNK_SIZE = int(os.getenv('API_EXPORT_CHUNK_SIZE', '2000'))
+# ?q= searches return the best matches as a single ranked page of at most this many
+SEARCH_RESULT_LIMIT = int(os.getenv('SEARCH_RESULT_LIMIT', '50'))
+
 AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator'},
     {'NAME': 'django.contrib.auth.password_validation.MinimumLengthValidator'},
@@ -130,25 +185,100 @@ if STORAGE_BACKEND == 's3':
     AWS_S3_FILE_OVERWRITE = False
     AWS_DEFAULT_ACL = None
     AWS_QUERYSTRING_AUTH = True
+    AWS_QUERYSTRING_EXPIRE = int(os.getenv('AWS_QUERYSTRING_EXPIRE', '3600'))
     DEFAULT_FILE_STORAGE = 'storages.backends.s3boto3.S3Boto3Storage'
 elif STORAGE_BACKEND == 'gcs':
     GS_BUCKET_NAME = os.getenv('GS_BUCKET_NAME', '')
     GS_DEFAULT_ACL = None
+    GS_EXPIRATION = timedelta(seconds=int(os.getenv('GS_EXPIRATION', '86400')))
     DEFAULT_FILE_STORAGE = 'storages.backends.gcloud.GoogleCloudStorage'
 
+# Certification uploads are parked here by the web process and moved to storage
+# by a background task, so the directory must be shared with the Celery workers.
+CERT_UPLOAD_SPOOL_DIR = os.getenv('CERT_UPLOAD_SPOOL_DIR', str(BASE_DIR / 'spool' / 'certs'))
+CERT_THUMBNAIL_SIZE = int(os.getenv('CERT_THUMBNAIL_SIZE', '320'))
+CERT_UPLOAD_MAX_BYTES = int(os.getenv('CERT_UPLOAD_MAX_BYTES', str(25 * 1024 * 1024)))
+# Storage errors while processing an upload are retried with exponential backoff (capped
+# at CERT_PROCESSING_RETRY_BACKOFF_MAX seconds); retry_stale_certification_uploads
+# re-queues uploads stuck for CERT_PROCESSING_STALE_AFTER seconds (lost messages, dead
+# workers) and fails them once CERT_PROCESSING_MAX_ATTEMPTS attempts have been made.
+CERT_PROCESSING_MAX_ATTEMPTS = int(os.getenv('CERT_PROCESSING_MAX_ATTEMPTS', '5'))
+CERT_PROCESSING_RETRY_BACKOFF_MAX = int(os.getenv('CERT_PROCESSING_RETRY_BACKOFF_MAX', '600'))
+CERT_PROCESSING_STALE_AFTER = int(os.getenv('CERT_PROCESSING_STALE_AFTER', '1800'))
+# With a bucket backend the vendor portal uploads straight to it through a
+# presigned URL; the local backend stands in with a token-authorised PUT view.
+CERT_DIRECT_UPLOADS = os.getenv('CERT_DIRECT_UPLOADS', str(STORAGE_BACKEND in {'s3', 'gcs'})).lower() == 'true'
+CERT_DIRECT_UPLOAD_EXPIRY = int(os.getenv('CERT_DIRECT_UPLOAD_EXPIRY', '900'))
+# Signed bucket URLs for cert documents are cached and reused until this many
+# seconds before they expire.
+CERT_SIGNED_URL_REFRESH_MARGIN = int(os.getenv('CERT_SIGNED_URL_REFRESH_MARGIN', '300'))
+# With the local backend, 'x-accel-redirect' (nginx, with an internal location
+# at CERT_DOCUMENT_ACCEL_PREFIX aliased to MEDIA_ROOT) or 'x-sendfile' (Apache,
+# lighttpd) hands the file transfer to the web server; empty streams it from Django.
+CERT_DOCUMENT_OFFLOAD = os.getenv('CERT_DOCUMENT_OFFLOAD', '').lower()
+CERT_DOCUMENT_ACCEL_PREFIX = os.getenv('CERT_DOCUMENT_ACCEL_PREFIX', '/protected-media/')
+
 CELERY_BROKER_URL = os.getenv('CELERY_BROKER_URL', 'redis://localhost:6379/0')
 CELERY_RESULT_BACKEND = os.getenv('CELERY_RESULT_BACKEND', CELERY_BROKER_URL)
+# Expiry work is driven by CertificationExpiryEvent rows scheduled on save, so the
+# periodic job only touches events that are due. run_daily_certification_checks
+# remains available as a full-table reconciliation.
+if importlib.util.find_spec('celery'):
+    from celery.schedules import crontab
+else:
+    crontab = None
 CELERY_BEAT_SCHEDULE = {
-    'run-certification-expiry-checks-daily': {
-        'task': 'management.tasks.run_daily_certification_checks',
+    'process-certification-expiry-events-hourly': {
+        'task': 'management.tasks.process_due_certification_events',
+        'schedule': 60 * 60,
+    },
+    'refresh-stale-vendor-rollups-daily': {
+        'task': 'management.tasks.refresh_stale_vendor_rollups',
+        # contracts start and end and certs lapse at midnight, so run just after it
+        'schedule': crontab(minute=5, hour=0) if crontab else 60 * 60 * 24,
+    },
+    'prune-change-log-daily': {
+        'task': 'management.tasks.prune_change_log',
         'schedule': 60 * 60 * 24,
-    }
+    },
+    'collect-orphan-certificate-blobs-daily': {
+        'task': 'management.tasks.collect_orphan_certificate_blobs',
+        'schedule': 60 * 60 * 24,
+    },
+    'retry-stale-certification-uploads': {
+        'task': 'management.tasks.retry_stale_certification_uploads',
+        'schedule': 60 * 15,
+    },
+    'prune-task-runs-daily': {
+        'task': 'management.tasks.prune_task_runs',
+        'schedule': 60 * 60 * 24,
+    },
 }
 
 if importlib.util.find_spec('rest_framework'):
     REST_FRAMEWORK = {
         'DEFAULT_PERMISSION_CLASSES': ['rest_framework.permissions.IsAuthenticated'],
+        'PAGE_SIZE': int(os.getenv('API_PAGE_SIZE', '50')),
     }
+    # pagination_class is set on ScopedModelViewSet rather than globally
+    SILENCED_SYSTEM_CHECKS = ['rest_framework.W001']
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 EMAIL_BACKEND = os.getenv('EMAIL_BACKEND', 'django.core.mail.backends.console.EmailBackend')
+
+# Expiry notices are grouped per recipient and sent in batches sharing one
+# connection; set EXPIRY_NOTICE_FANOUT=celery to send batches as subtasks.
+EXPIRY_NOTICE_BATCH_SIZE = int(os.getenv('EXPIRY_NOTICE_BATCH_SIZE', '100'))
+EXPIRY_NOTICE_CONCURRENCY = int(os.getenv('EXPIRY_NOTICE_CONCURRENCY', '4'))
+EXPIRY_NOTICE_FANOUT = os.getenv('EXPIRY_NOTICE_FANOUT', 'threads').lower()
+
+# /api/changes/ only serves entries older than the settle window, so a change
+# committed late by a slower transaction is not skipped by a consumer that has
+# already moved past its sequence number.
+CHANGE_FEED_SETTLE_SECONDS = float(os.getenv('CHANGE_FEED_SETTLE_SECONDS', '2'))
+# ?wait= long polls occupy a worker for up to CHANGE_FEED_MAX_WAIT seconds;
+# keep it short on sync (prefork) workers, or set it to 0 to disable
+# long-polling there and raise it only behind threaded/async workers.
+CHANGE_FEED_MAX_WAIT = float(os.getenv('CHANGE_FEED_MAX_WAIT', '5'))
+CHANGE_FEED_POLL_INTERVAL = float(os.getenv('CHANGE_FEED_POLL_INTERVAL', '1'))
+CHANGE_LOG_RETENTION_DAYS = int(os.getenv('CHANGE_LOG_RETENTION_DAYS', '30'))
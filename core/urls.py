@@ -18,11 +18,18 @@ if importlib.util.find_spec('two_factor'):
 if importlib.util.find_spec('rest_framework'):
     from rest_framework.routers import DefaultRouter
 
-    from management.api import CertificationViewSet, ContractViewSet, ProductViewSet, VendorViewSet
+    from management.api import (
+        CertificationViewSet,
+        ChangeFeedViewSet,
+        ContractViewSet,
+        ProductViewSet,
+        VendorViewSet,
+    )
 
     router = DefaultRouter()
     router.register('vendors', VendorViewSet, basename='api-vendors')
     router.register('products', ProductViewSet, basename='api-products')
     router.register('certifications', CertificationViewSet, basename='api-certifications')
     router.register('contracts', ContractViewSet, basename='api-contracts')
+    router.register('changes', ChangeFeedViewSet, basename='api-changes')
     urlpatterns.insert(3, path('api/', include(router.urls)))
@@ -1,7 +1,10 @@
 from django.contrib import admin
 from django.utils.html import format_html
 
-from .models import Certification, Contract, Product, Vendor, VendorHistory
+from .models import CertificateBlob, Certification, Contract, Product, TaskRun, Vendor, VendorHistory
+from .search import search_vendors
+
+ADMIN_SEARCH_LIMIT = 500
 
 
 @admin.register(Vendor)
@@ -20,6 +23,12 @@ class VendorAdmin(admin.ModelAdmin):
 
     status_tag.short_description = 'Status'
 
+    def get_search_results(self, request, queryset, search_term):
+        # the indexed search document rather than a LIKE '%term%' scan over name
+        if not search_term.strip():
+            return queryset, False
+        return search_vendors(queryset, search_term, limit=ADMIN_SEARCH_LIMIT), False
+
     def save_model(self, request, obj, form, change):
         obj._current_user = request.user
         super().save_model(request, obj, form, change)
@@ -27,8 +36,8 @@ class VendorAdmin(admin.ModelAdmin):
 
 @admin.register(Certification)
 class CertificationAdmin(admin.ModelAdmin):
-    list_display = ('vendor', 'cert_type', 'approval_status', 'expiry_date', 'is_current', 'is_valid_display')
-    list_filter = ('cert_type', 'is_current', 'approval_status')
+    list_display = ('vendor', 'cert_type', 'approval_status', 'processing_status', 'expiry_date', 'is_current', 'is_valid_display')
+    list_filter = ('cert_type', 'is_current', 'approval_status', 'processing_status')
 
     def is_valid_display(self, obj):
         return obj.is_valid
@@ -49,6 +58,22 @@ class ProductAdmin(admin.ModelAdmin):
     is_active_display.short_description = 'Is Active in System'
 
 
+@admin.register(CertificateBlob)
+class CertificateBlobAdmin(admin.ModelAdmin):
+    list_display = ('sha256', 'name', 'size', 'ref_count', 'created_at')
+    search_fields = ('sha256', 'name')
+    readonly_fields = ('sha256', 'name', 'size', 'created_at')
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_ref_count()
+
+    def ref_count(self, obj):
+        return obj.ref_count
+
+    ref_count.admin_order_field = 'ref_count'
+    ref_count.short_description = 'Certifications'
+
+
 @admin.register(VendorHistory)
 class VendorHistoryAdmin(admin.ModelAdmin):
     list_display = ('vendor', 'status', 'changed_by', 'timestamp')
@@ -72,3 +97,19 @@ class ContractAdmin(admin.ModelAdmin):
 
     is_active_display.boolean = True
     is_active_display.short_description = 'Is Active'
+
+
+@admin.register(TaskRun)
+class TaskRunAdmin(admin.ModelAdmin):
+    list_display = ('task', 'status', 'started_at', 'duration_ms', 'queries', 'db_ms', 'inline')
+    list_filter = ('task', 'status', 'inline')
+    date_hierarchy = 'started_at'
+    readonly_fields = (
+        'task', 'status', 'inline', 'started_at', 'duration_ms', 'queries', 'db_ms', 'phases', 'counters', 'error',
+    )
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
@@ -1,29 +1,424 @@
-from rest_framework import viewsets
+from datetime import timedelta
+import json
+import re
+import time
+import uuid
+import zlib
 
+from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from django.db.models import Count, Max
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.cache import patch_vary_headers
+from django.utils.dateparse import parse_datetime
+from rest_framework import serializers, viewsets
+from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound, ParseError
+from rest_framework.pagination import BasePagination
+from rest_framework.parsers import BaseParser, JSONParser
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from .changes import record_changes, settled_changes
+from .conditional import conditional_response, latest, set_validators, version_etag
 from .models import Certification, Contract, Product, Vendor
-from .serializers import CertificationSerializer, ContractSerializer, ProductSerializer, VendorSerializer
+from .pagination import InvalidCursor, KeysetPage, KeysetPaginator
+from .search import search_vendors
+from .serializers import (
+    CertificationSerializer,
+    ChangeLogEntrySerializer,
+    ContractBulkSerializer,
+    ContractSerializer,
+    ProductBulkSerializer,
+    ProductSerializer,
+    VendorSerializer,
+)
+from .signals import coalesce_vendor_refreshes, queue_vendor_refresh
+
+ACCEPTS_GZIP = re.compile(r'\bgzip\b')
+
+
+class NDJSONParser(BaseParser):
+    media_type = 'application/x-ndjson'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        rows = []
+        for number, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                rows.append(json.loads(line))
+            except ValueError as exc:
+                raise ParseError(f'NDJSON parse error on line {number}: {exc}') from exc
+        return rows
+
+
+class NDJSONRenderer(BaseRenderer):
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return json.dumps(data, cls=DjangoJSONEncoder).encode() + b'\n'
+
+
+def _ndjson_chunks(rows, chunk_size):
+    encoder = DjangoJSONEncoder()
+    lines = []
+    for row in rows:
+        lines.append(encoder.encode(row))
+        if len(lines) >= chunk_size:
+            yield ('\n'.join(lines) + '\n').encode()
+            lines = []
+    if lines:
+        yield ('\n'.join(lines) + '\n').encode()
+
+
+def _gzip_chunks(chunks):
+    compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+class KeysetPagination(BasePagination):
+    cursor_query_param = 'cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        if getattr(view, 'search_query', None):
+            # ranked search results are already capped, so they come back as one page in rank order
+            self.page = KeysetPage(list(queryset), None)
+            return self.page.object_list
+        paginator = KeysetPaginator(getattr(view, 'keyset_ordering', ('id',)), api_settings.PAGE_SIZE or 50)
+        try:
+            self.page = paginator.paginate(queryset, request.query_params.get(self.cursor_query_param))
+        except InvalidCursor as exc:
+            raise NotFound(str(exc)) from exc
+        return self.page.object_list
+
+    def get_next_link(self):
+        if not self.page.has_next():
+            return None
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, self.page.next_cursor)
+
+    def get_first_link(self):
+        return remove_query_param(self.request.build_absolute_uri(), self.cursor_query_param)
+
+    def get_paginated_response(self, data):
+        return Response({'next': self.get_next_link(), 'first': self.get_first_link(), 'results': data})
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'first': {'type': 'string', 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+class BulkUpsertMixin:
+    """``POST <resource>/bulk/`` upserting a JSON array or NDJSON stream on a natural key.
+
+    Rows are validated and written in batches: one query checks the batch's
+    vendors against the user's scope, one finds the rows that already exist and
+    one ``INSERT ... ON CONFLICT DO UPDATE`` writes them. Model signals do not
+    fire for bulk writes, so vendor rollups and dashboards are refreshed once
+    per affected vendor instead.
+    """
+
+    bulk_serializer_class = None
+    bulk_natural_key = ()
+    bulk_update_fields = ()
+    bulk_batch_size = 500
+
+    @action(detail=False, methods=['post'], url_path='bulk', parser_classes=[JSONParser, NDJSONParser])
+    def bulk(self, request):
+        rows = request.data
+        if not isinstance(rows, list):
+            raise ParseError('Expected a JSON array or an NDJSON stream of objects.')
+
+        results = []
+        with coalesce_vendor_refreshes():
+            for start in range(0, len(rows), self.bulk_batch_size):
+                with transaction.atomic():
+                    results.extend(self._upsert_batch(rows[start:start + self.bulk_batch_size], start))
+
+        counts = {status: sum(1 for result in results if result['status'] == status) for status in ('created', 'updated', 'error')}
+        return Response({**counts, 'results': results})
+
+    def prepare_bulk_row(self, attrs):
+        return attrs
+
+    def _natural_key(self, attrs):
+        return tuple(attrs.get(name) for name in self.bulk_natural_key)
+
+    @staticmethod
+    def _field_name(model, attname):
+        return next(field.name for field in model._meta.concrete_fields if field.attname == attname)
 
+    def _upsert_batch(self, rows, offset):
+        model = self.queryset.model
+        serializer = self.bulk_serializer_class()
+        results = {}
+        valid = {}
+        for index, row in enumerate(rows, start=offset):
+            try:
+                attrs = serializer.run_validation(row)
+                model(**attrs).clean()
+            except serializers.ValidationError as exc:
+                results[index] = {'index': index, 'status': 'error', 'errors': exc.detail}
+                continue
+            except DjangoValidationError as exc:
+                results[index] = {'index': index, 'status': 'error', 'errors': exc.messages}
+                continue
+            valid[index] = self.prepare_bulk_row(attrs)
+
+        # optional columns a row leaves out keep their stored value instead of falling back to the model default
+        stored_columns = [model._meta.get_field(name).attname for name in self.bulk_update_fields if name != 'updated_at']
+        existing = {}
+        if valid:
+            lookups = {f'{name}__in': {attrs.get(name) for attrs in valid.values()} for name in self.bulk_natural_key}
+            for row in model.objects.filter(**lookups).values('pk', 'vendor_id', *self.bulk_natural_key, *stored_columns):
+                existing[tuple(row[name] for name in self.bulk_natural_key)] = row
+        # rows moving between vendors need both the current and the new vendor in scope
+        scoped_vendors = set(
+            self._bulk_vendors()
+            .filter(pk__in={attrs['vendor_id'] for attrs in valid.values()} | {row['vendor_id'] for row in existing.values()})
+            .values_list('pk', flat=True)
+        )
+
+        latest_by_key = {}
+        for index, attrs in valid.items():
+            key = self._natural_key(attrs)
+            current = existing.get(key)
+            if attrs['vendor_id'] not in scoped_vendors or (current and current['vendor_id'] not in scoped_vendors):
+                results[index] = {'index': index, 'status': 'error', 'errors': {'vendor': ['Vendor not found.']}}
+                continue
+            if key in latest_by_key:
+                superseded = latest_by_key[key]
+                results[superseded] = {'index': superseded, 'status': 'error', 'errors': ['Superseded by a later row with the same key.']}
+            latest_by_key[key] = index
+
+        objs = []
+        for key, index in latest_by_key.items():
+            attrs = valid[index]
+            current = existing.get(key)
+            if current:
+                obj = model(**{**{column: current[column] for column in stored_columns}, **attrs})
+                obj.pk = current['pk']
+            else:
+                obj = model(**attrs)
+            objs.append(obj)
+            results[index] = {'index': index, 'status': 'updated' if current else 'created', 'id': str(obj.pk)}
+            if current:
+                # a row moved to another vendor leaves the previous vendor's rollup and dashboard stale too
+                queue_vendor_refresh(current['vendor_id'], status=False, search=True)
+            queue_vendor_refresh(obj.vendor_id, status=False, search=True)
+
+        if objs:
+            model.objects.bulk_create(
+                objs,
+                update_conflicts=True,
+                unique_fields=[self._field_name(model, name) for name in self.bulk_natural_key],
+                update_fields=list(self.bulk_update_fields),
+            )
+            record_changes(objs)
+        return [results[index] for index in sorted(results)]
+
+    def _bulk_vendors(self):
+        # the child resources are scoped to the vendor's own user, so internal reps may not write them
+        user = self.request.user
+        if user.is_superuser or user.is_staff:
+            return Vendor.objects.all()
+        return Vendor.objects.filter(user=user)
+
+
+class ExportMixin:
+    """``GET <resource>/export/`` streaming every row in the user's scope as NDJSON.
+
+    Rows are read with ``.values().iterator()`` and written a chunk at a time
+    without going through the serializer, so memory stays flat however large
+    the table is. ``?since=<ISO 8601 timestamp>`` limits the export to rows
+    updated at or after that time; the ``X-Export-Since`` header carries the
+    value to send on the next incremental pull. It trails the export by
+    ``CHANGE_FEED_SETTLE_SECONDS``, since ``updated_at`` is stamped before a
+    write commits, so consecutive pulls overlap slightly and consumers should
+    upsert on ``id``. Deletes are not exported; take them from /api/changes/.
+    The stream is gzipped when the client accepts it.
+    """
+
+    @action(detail=False, methods=['get'], url_path='export', renderer_classes=[JSONRenderer, NDJSONRenderer])
+    def export(self, request):
+        started_at = timezone.now()
+        queryset = self.queryset.for_user(request.user)
+        since = request.query_params.get('since')
+        if since:
+            queryset = queryset.filter(updated_at__gte=self._parse_since(since))
+
+        fields = [*self.get_serializer_class().Meta.fields, 'updated_at']
+        chunk_size = settings.API_EXPORT_CHUNK_SIZE
+        rows = queryset.order_by('updated_at', 'pk').values(*fields).iterator(chunk_size=chunk_size)
+        chunks = _ndjson_chunks(rows, chunk_size)
+
+        compress = bool(ACCEPTS_GZIP.search(request.META.get('HTTP_ACCEPT_ENCODING', '')))
+        response = StreamingHttpResponse(_gzip_chunks(chunks) if compress else chunks, content_type=NDJSONRenderer.media_type)
+        if compress:
+            response['Content-Encoding'] = 'gzip'
+        patch_vary_headers(response, ['Accept-Encoding'])
+        # rows saved just before the export by transactions that commit after it are picked up next time
+        response['X-Export-Since'] = (started_at - timedelta(seconds=settings.CHANGE_FEED_SETTLE_SECONDS)).isoformat()
+        return response
+
+    @staticmethod
+    def _parse_since(value):
+        try:
+            since = parse_datetime(value)
+        except ValueError:
+            since = None
+        if since is None:
+            raise serializers.ValidationError({'since': ['Expected an ISO 8601 timestamp.']})
+        if timezone.is_naive(since):
+            since = timezone.make_aware(since)
+        return since
+
+
+class ScopedModelViewSet(ExportMixin, viewsets.ModelViewSet):
+    pagination_class = KeysetPagination
+    keyset_ordering = ('id',)
+    # related timestamps that move whenever an expandable relation changes
+    version_watermarks = ('vendor__updated_at',)
+
+    def list(self, request, *args, **kwargs):
+        # deletions only show in the row count, so lists are validated by ETag alone
+        return self._conditional(self.queryset.for_user(request.user), False, super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        try:
+            queryset = self.queryset.for_user(request.user).filter(pk=kwargs[self.lookup_field])
+        except (DjangoValidationError, ValueError):
+            return super().retrieve(request, *args, **kwargs)
+        return self._conditional(queryset, True, super().retrieve, request, *args, **kwargs)
+
+    def _conditional(self, queryset, dated, handler, request, *args, **kwargs):
+        """Answer from a one-query version stamp when the client's validators still match."""
+        stamp = queryset.order_by().aggregate(
+            count=Count('pk'),
+            updated=Max('updated_at'),
+            **{f'watermark_{index}': Max(name) for index, name in enumerate(self.version_watermarks)},
+        )
+        if not stamp['count']:
+            return handler(request, *args, **kwargs)
+        etag = version_etag(*stamp.values(), request.user.pk, request.query_params.urlencode())
+        last_modified = latest(*(value for key, value in stamp.items() if key != 'count')) if dated else None
+
+        response = conditional_response(request, etag, last_modified)
+        if response is None:
+            response = handler(request, *args, **kwargs)
+        return set_validators(response, etag, last_modified)
 
-class ScopedModelViewSet(viewsets.ModelViewSet):
     def get_queryset(self):
-        return self.queryset.for_user(self.request.user)
+        queryset = self.queryset.for_user(self.request.user)
+        if self.request.method in SAFE_METHODS:
+            ordering_columns = [name.lstrip('-') for name in self.keyset_ordering]
+            queryset = self.get_serializer_class().optimize_queryset(queryset, self.request, ordering_columns)
+        return queryset
 
 
 class VendorViewSet(ScopedModelViewSet):
     queryset = Vendor.objects.all()
     serializer_class = VendorSerializer
+    keyset_ordering = ('-created_at', '-id')
+    # every cert, contract and product write refreshes the vendor's rollup
+    version_watermarks = ('rollup__updated_at',)
 
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        self.search_query = self.request.query_params.get('q', '').strip()
+        if self.search_query and self.action == 'list':
+            queryset = search_vendors(queryset, self.search_query)
+        return queryset
 
-class ProductViewSet(ScopedModelViewSet):
+
+class ProductViewSet(BulkUpsertMixin, ScopedModelViewSet):
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
+    bulk_serializer_class = ProductBulkSerializer
+    bulk_natural_key = ('id',)
+    bulk_update_fields = ('vendor', 'name', 'status', 'updated_at')
+
+    def prepare_bulk_row(self, attrs):
+        # products have no natural key besides their id; rows without one are new products
+        attrs.setdefault('id', uuid.uuid4())
+        return attrs
 
 
 class CertificationViewSet(ScopedModelViewSet):
     queryset = Certification.objects.all()
     serializer_class = CertificationSerializer
+    keyset_ordering = ('-id',)
 
 
-class ContractViewSet(ScopedModelViewSet):
+class ContractViewSet(BulkUpsertMixin, ScopedModelViewSet):
     queryset = Contract.objects.all()
     serializer_class = ContractSerializer
+    bulk_serializer_class = ContractBulkSerializer
+    bulk_natural_key = ('vendor_id', 'contract_id')
+    bulk_update_fields = ('total_value', 'start_date', 'end_date', 'updated_at')
+
+
+class ChangeFeedViewSet(viewsets.ViewSet):
+    """``GET /api/changes/?after=<seq>`` returning change-log entries in sequence order.
+
+    Clients pass the ``next`` value of each response as ``after`` on the next
+    call. With ``?wait=<seconds>`` an empty feed is polled until entries appear
+    or the wait (capped at ``CHANGE_FEED_MAX_WAIT``) runs out.
+
+    A long poll holds its worker for the whole wait, so only enable it on
+    servers running threaded or async workers; the database connection is
+    released between polls so idle waiters don't pin connections.
+    """
+
+    def list(self, request):
+        after = self._non_negative(request, 'after', int, 0)
+        wait = min(self._non_negative(request, 'wait', float, 0), settings.CHANGE_FEED_MAX_WAIT)
+        limit = api_settings.PAGE_SIZE or 50
+
+        deadline = time.monotonic() + wait
+        while True:
+            entries = list(settled_changes(after).for_user(request.user)[:limit + 1])
+            if entries or time.monotonic() >= deadline:
+                break
+            if not connection.in_atomic_block:
+                # reopened lazily by the next poll
+                connection.close()
+            time.sleep(settings.CHANGE_FEED_POLL_INTERVAL)
+
+        has_more = len(entries) > limit
+        entries = entries[:limit]
+        return Response({
+            'next': entries[-1].pk if entries else after,
+            'has_more': has_more,
+            'results': ChangeLogEntrySerializer(entries, many=True).data,
+        })
+
+    @staticmethod
+    def _non_negative(request, name, cast, default):
+        try:
+            value = cast(request.query_params.get(name, default))
+        except ValueError:
+            value = -1
+        # also rejects nan, which would never compare past the long-poll deadline
+        if not value >= 0:
+            raise serializers.ValidationError({name: ['Expected a non-negative number.']})
+        return value
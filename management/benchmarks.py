@@ -0,0 +1,293 @@
+from datetime import date, timedelta
+from decimal import Decimal
+import random
+import statistics
+import time
+import uuid
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from .changes import change_entries
+from .models import (
+    Certification,
+    CertificationExpiryEvent,
+    ChangeLogEntry,
+    Contract,
+    Product,
+    Vendor,
+    VendorHistory,
+    VendorRollup,
+)
+from .rollups import refresh_vendor_rollups
+from .search import refresh_search_documents
+from .tasks import process_due_certification_events, run_daily_certification_checks
+
+BENCHMARK_BATCH_SIZE = 1000
+# rows per bulk-upsert scenario, half updating existing rows and half creating new ones
+BENCHMARK_BULK_ROWS = 100
+BENCHMARK_USERNAMES = {'staff': 'bench-staff', 'owner': 'bench-owner', 'rep': 'bench-rep'}
+# days to expiry chosen so every expiry notice window and the lapse check have work
+EXPIRY_OFFSETS = (-10, 1, 15, 30, 90, 365, 730)
+# every tenth vendor is verified with no approved certification, so the lapse sweep has work
+LAPSED_VENDOR_SLOT = 3
+
+
+def _user(role, **fields):
+    user, _created = User.objects.get_or_create(username=BENCHMARK_USERNAMES[role], defaults=fields)
+    return user
+
+
+def generate_benchmark_data(vendors, seed=0, certs=3, contracts=2, products=5, history=4):
+    """Bulk-insert ``vendors`` vendors with their certifications, contracts, products and history.
+
+    The same ``seed`` always produces the same rows. Signals do not fire for
+    bulk inserts, so expiry events, rollups, search documents and change-log
+    entries are built here in bulk too.
+    """
+    rng = random.Random(seed)
+    today = date.today()
+    staff = _user('staff', is_staff=True)
+    owner = _user('owner')
+    rep = _user('rep')
+
+    statuses = ['pending', 'under_review', 'verified', 'inactive']
+    vendor_rows = [
+        Vendor(
+            id=uuid.UUID(int=rng.getrandbits(128), version=4),
+            name=f'Benchmark Vendor {index:06d}',
+            status='verified' if index % 10 == LAPSED_VENDOR_SLOT else rng.choice(statuses),
+            risk_tier=rng.choice(['Low', 'Medium', 'High']),
+            country=rng.choice(['United States', 'Germany', 'Japan', 'India']),
+            registration_number=f'BV{index:08d}',
+            contact_name=f'Contact {index}',
+            contact_email=f'contact{index}@vendor{index}.example',
+            internal_rep=rep if index % 10 == 0 else None,
+        )
+        for index in range(vendors)
+    ]
+    if vendor_rows and not Vendor.objects.filter(user=owner).exists():
+        vendor_rows[0].user = owner
+    Vendor.objects.bulk_create(vendor_rows, batch_size=BENCHMARK_BATCH_SIZE)
+
+    cert_rows = []
+    contract_rows = []
+    product_rows = []
+    history_rows = []
+    for index, vendor in enumerate(vendor_rows):
+        lapsed = index % 10 == LAPSED_VENDOR_SLOT
+        for _ in range(certs):
+            # cycled rather than drawn, so even a small dataset covers every window
+            expiry_date = today + timedelta(days=EXPIRY_OFFSETS[len(cert_rows) % len(EXPIRY_OFFSETS)])
+            approval_status = 'rejected' if lapsed else rng.choice(['pending', 'approved', 'approved', 'rejected'])
+            cert_rows.append(Certification(
+                vendor=vendor,
+                cert_type=rng.choice(['ISO', 'FDA', 'CE']),
+                file='certs/benchmark.pdf',
+                issue_date=expiry_date - timedelta(days=730),
+                expiry_date=expiry_date,
+                approval_status=approval_status,
+                reviewed_by=None if approval_status == 'pending' else staff,
+            ))
+        for number in range(contracts):
+            start_date = today - timedelta(days=rng.randint(0, 700))
+            contract_rows.append(Contract(
+                vendor=vendor,
+                contract_id=f'{vendor.registration_number}-C{number}',
+                total_value=Decimal(rng.randint(1_000, 500_000)),
+                start_date=start_date,
+                end_date=start_date + timedelta(days=rng.randint(30, 1000)),
+            ))
+        product_rows += [
+            Product(vendor=vendor, name=f'Product {number} of {vendor.name}', status=rng.choice(['active', 'inactive']))
+            for number in range(products)
+        ]
+        history_rows += [
+            VendorHistory(vendor=vendor, status=rng.choice(['pending', 'under_review', 'verified']), changed_by=staff)
+            for _ in range(history)
+        ]
+
+    Certification.objects.bulk_create(cert_rows, batch_size=BENCHMARK_BATCH_SIZE)
+    CertificationExpiryEvent.objects.bulk_create(
+        [
+            CertificationExpiryEvent(certification=cert, kind=kind, due_date=due_date)
+            for cert in cert_rows
+            for kind, due_date in cert.expiry_schedule(today)
+        ],
+        batch_size=BENCHMARK_BATCH_SIZE,
+    )
+    Contract.objects.bulk_create(contract_rows, batch_size=BENCHMARK_BATCH_SIZE)
+    Product.objects.bulk_create(product_rows, batch_size=BENCHMARK_BATCH_SIZE)
+    VendorHistory.objects.bulk_create(history_rows, batch_size=BENCHMARK_BATCH_SIZE)
+    ChangeLogEntry.objects.bulk_create(change_entries(vendor_rows), batch_size=BENCHMARK_BATCH_SIZE)
+
+    vendor_ids = [vendor.pk for vendor in vendor_rows]
+    VendorRollup.objects.bulk_create([VendorRollup(vendor_id=pk) for pk in vendor_ids], batch_size=BENCHMARK_BATCH_SIZE)
+    refresh_vendor_rollups(vendor_ids)
+    refresh_search_documents(vendor_ids)
+    return {
+        'vendors': len(vendor_rows),
+        'certifications': len(cert_rows),
+        'contracts': len(contract_rows),
+        'products': len(product_rows),
+        'history': len(history_rows),
+    }
+
+
+def _get(path, role='staff', **params):
+    def scenario(clients):
+        response = clients[role].get(path, params)
+        if response.status_code != 200:
+            raise AssertionError(f'GET {path} returned {response.status_code}')
+        # streaming responses do their work while being consumed
+        if response.streaming:
+            for _chunk in response.streaming_content:
+                pass
+    return scenario
+
+
+def _post(path, payload, role='staff'):
+    def scenario(clients):
+        start = len(connection.run_on_commit)
+        response = clients[role].post(path, payload, content_type='application/json')
+        if response.status_code != 200:
+            raise AssertionError(f'POST {path} returned {response.status_code}')
+        # measure() rolls every run back, so the vendor refreshes queued for commit are run here to be counted too
+        while len(connection.run_on_commit) > start:
+            _savepoints, callback, _robust = connection.run_on_commit.pop(start)
+            callback()
+    return scenario
+
+
+def _bulk_payloads():
+    """Product and contract bulk-upsert bodies, each updating existing rows and adding as many new ones."""
+    half = BENCHMARK_BULK_ROWS // 2
+    today = date.today().isoformat()
+    contracts = Contract.objects.order_by('pk').values_list('vendor_id', 'contract_id', 'start_date', 'end_date')[:half]
+    contract_rows = [
+        {
+            'vendor': str(vendor_id),
+            'contract_id': contract_id,
+            'total_value': '1000.00',
+            'start_date': start_date.isoformat(),
+            'end_date': end_date.isoformat(),
+        }
+        for vendor_id, contract_id, start_date, end_date in contracts
+    ]
+    products = Product.objects.order_by('pk').values_list('pk', 'vendor_id', 'name')[:half]
+    product_rows = [{'id': str(pk), 'vendor': str(vendor_id), 'name': f'{name} (updated)'} for pk, vendor_id, name in products]
+
+    for index, row in enumerate(contract_rows[:]):
+        contract_rows.append({**row, 'contract_id': f'BULK-{index}', 'start_date': today, 'end_date': today})
+        product_rows.append({'vendor': row['vendor'], 'name': f'Bulk Product {index}'})
+    return product_rows, contract_rows
+
+
+def _daily_checks(clients):
+    run_daily_certification_checks()
+
+
+def _due_events(clients):
+    process_due_certification_events()
+
+
+def scenarios():
+    """Benchmark name -> callable taking ``{role: logged-in Client}``."""
+    detail_pk = Vendor.objects.order_by('name').values_list('pk', flat=True).first()
+    product_rows, contract_rows = _bulk_payloads()
+    api = {}
+    for name, model in (('vendor', Vendor), ('product', Product), ('certification', Certification), ('contract', Contract)):
+        pk = model.objects.order_by('pk').values_list('pk', flat=True).first()
+        api[f'api_{name}s'] = _get(f'/api/{name}s/')
+        api[f'api_{name}_detail'] = _get(f'/api/{name}s/{pk}/')
+        api[f'api_{name}_export'] = _get(f'/api/{name}s/export/')
+    return {
+        'dashboard_staff': _get(reverse('dashboard')),
+        'dashboard_owner': _get(reverse('dashboard'), role='owner'),
+        'vendor_list': _get(reverse('vendor_list')),
+        'vendor_list_rep': _get(reverse('vendor_list'), role='rep'),
+        'vendor_search': _get(reverse('vendor_list'), q='Vendor 0001'),
+        'vendor_detail': _get(reverse('vendor_detail', args=[detail_pk])),
+        'approval_queue': _get(reverse('approval_queue')),
+        'audit_export': _get(reverse('audit_export')),
+        'vendor_audit_export': _get(reverse('vendor_audit_export', args=[detail_pk])),
+        **api,
+        'api_product_bulk': _post('/api/products/bulk/', product_rows),
+        'api_contract_bulk': _post('/api/contracts/bulk/', contract_rows),
+        'api_changes': _get('/api/changes/'),
+        'daily_certification_checks': _daily_checks,
+        'due_certification_events': _due_events,
+    }
+
+
+def _clients():
+    clients = {}
+    for role, username in BENCHMARK_USERNAMES.items():
+        client = Client()
+        client.force_login(User.objects.get(username=username))
+        clients[role] = client
+    return clients
+
+
+def measure(scenario, clients, repeat):
+    """Median wall time in milliseconds and the highest query count over ``repeat`` runs, each rolled back."""
+    timings = []
+    queries = 0
+    for _ in range(repeat):
+        cache.clear()
+        with transaction.atomic():
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                scenario(clients)
+                timings.append((time.perf_counter() - started) * 1000)
+            queries = max(queries, len(captured))
+            # writes made by a scenario (e.g. notice flags) must not change the next run
+            transaction.set_rollback(True)
+    return {'median_ms': round(statistics.median(timings), 2), 'queries': queries}
+
+
+def run_benchmarks(repeat=5, only=None):
+    """Measure every scenario (or those named in ``only``) against the data currently in the database."""
+    clients = _clients()
+    return {
+        name: measure(scenario, clients, repeat)
+        for name, scenario in scenarios().items()
+        if not only or name in only
+    }
+
+
+def merge_results(baseline, results):
+    """``baseline`` with the scenarios measured in ``results`` replaced and every other one kept."""
+    merged = {scale: dict(measurements) for scale, measurements in baseline.items()}
+    for scale, measurements in results.items():
+        merged.setdefault(scale, {}).update(measurements)
+    return merged
+
+
+def compare_results(results, baseline, latency_threshold=0.25, latency_floor_ms=5.0, query_slack=0):
+    """Regressions of ``results`` against ``baseline``, both ``{scale: {scenario: measurement}}``.
+
+    A scenario regresses when it runs more than ``query_slack`` extra queries,
+    or when it is both ``latency_threshold`` slower (as a fraction) and more
+    than ``latency_floor_ms`` slower, so timer noise on fast pages is ignored.
+    """
+    regressions = []
+    for scale, measurements in results.items():
+        for name, current in measurements.items():
+            previous = baseline.get(scale, {}).get(name)
+            if previous is None:
+                continue
+            if current['queries'] > previous['queries'] + query_slack:
+                regressions.append(
+                    f'{name} at {scale} vendors: {current["queries"]} queries (baseline {previous["queries"]})'
+                )
+            slower = current['median_ms'] - previous['median_ms']
+            if slower > latency_floor_ms and current['median_ms'] > previous['median_ms'] * (1 + latency_threshold):
+                regressions.append(
+                    f'{name} at {scale} vendors: {current["median_ms"]}ms (baseline {previous["median_ms"]}ms)'
+                )
+    return regressions
@@ -0,0 +1,135 @@
+import hashlib
+import os
+import uuid
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+
+from .models import CertificateBlob, Certification
+
+HASH_CHUNK_SIZE = 1024 * 1024
+# server-only copies of direct uploads; the staged key stays client-writable until its presigned target expires
+CLAIMED_UPLOAD_PREFIX = 'certs/incoming/'
+
+
+def file_digest(handle):
+    """SHA-256 hex digest and size of an open binary file, read in chunks."""
+    digest = hashlib.sha256()
+    size = 0
+    while chunk := handle.read(HASH_CHUNK_SIZE):
+        digest.update(chunk)
+        size += len(chunk)
+    handle.seek(0)
+    return digest.hexdigest(), size
+
+
+def blob_name(digest, ext):
+    return f'certs/sha256/{digest[:2]}/{digest}{ext.lower()}'
+
+
+def _attach(blob, cert_id):
+    # under the blob's row lock, so release_blobs never sees it unreferenced between storing and attaching;
+    # the content is the certification's own, so updated_at is left to the caller's final save
+    if cert_id is not None:
+        Certification.objects.filter(pk=cert_id).update(blob=blob, file=blob.name)
+
+
+def store_blob(handle, filename, cert_id=None):
+    """Write ``handle`` under its content address, skipping the write when the blob is already stored.
+
+    With ``cert_id`` the certification is pointed at the blob in the same transaction.
+    """
+    digest, size = file_digest(handle)
+    _name, ext = os.path.splitext(filename)
+    with transaction.atomic():
+        blob, _created = CertificateBlob.objects.select_for_update().get_or_create(
+            sha256=digest, defaults={'name': blob_name(digest, ext), 'size': size}
+        )
+        # also repairs a row whose object went missing
+        if not default_storage.exists(blob.name):
+            default_storage.save(blob.name, File(handle))
+        _attach(blob, cert_id)
+    return blob
+
+
+def copy_object(source, target):
+    """Copy ``source`` to ``target`` inside the bucket (S3 CopyObject, GCS rewrite), or through Django locally."""
+    if settings.STORAGE_BACKEND == 's3':
+        client = default_storage.connection.meta.client
+        bucket = default_storage.bucket_name
+        client.copy(
+            {'Bucket': bucket, 'Key': default_storage._normalize_name(source)}, bucket, default_storage._normalize_name(target)
+        )
+    elif settings.STORAGE_BACKEND == 'gcs':
+        bucket = default_storage.bucket
+        source_blob = bucket.blob(default_storage._normalize_name(source))
+        target_blob = bucket.blob(default_storage._normalize_name(target))
+        token, _copied, _total = target_blob.rewrite(source_blob)
+        # large or cross-class objects take several rewrite calls
+        while token is not None:
+            token, _copied, _total = target_blob.rewrite(source_blob, token=token)
+    else:
+        with default_storage.open(source, 'rb') as handle:
+            default_storage.save(target, File(handle))
+
+
+def claim_direct_upload(name):
+    """Copy a direct upload to a key only the server writes and delete the staged object.
+
+    The presigned POST/PUT for ``name`` keeps working until it expires, so the
+    staged object is never hashed, inspected or kept; the claimed copy is.
+    """
+    _root, ext = os.path.splitext(name)
+    claimed = f'{CLAIMED_UPLOAD_PREFIX}{uuid.uuid4().hex}{ext.lower()}'
+    copy_object(name, claimed)
+    default_storage.delete(name)
+    return claimed
+
+
+def adopt_blob(handle, name, cert_id=None):
+    """Register an object already in storage (a claimed direct upload or a legacy file) as a blob.
+
+    The content is copied under its content address unless a blob already
+    holds it. Returns ``(blob, redundant_name)``; ``redundant_name`` is ``name``
+    when it differs from the blob's, and the caller should delete it once
+    nothing points at it any more. ``cert_id`` is attached as in ``store_blob``.
+    """
+    digest, size = file_digest(handle)
+    _root, ext = os.path.splitext(name)
+    with transaction.atomic():
+        blob, _created = CertificateBlob.objects.select_for_update().get_or_create(
+            sha256=digest, defaults={'name': blob_name(digest, ext), 'size': size}
+        )
+        # also repairs a row whose object went missing
+        if blob.name != name and not default_storage.exists(blob.name):
+            copy_object(name, blob.name)
+        _attach(blob, cert_id)
+    return blob, None if blob.name == name else name
+
+
+def delete_unreferenced_file(name):
+    if not Certification.objects.filter(file=name).exists():
+        default_storage.delete(name)
+
+
+def release_blobs(blob_ids):
+    """Delete the blobs in ``blob_ids`` that no certification references any more, objects first."""
+    released = 0
+    for blob_id in blob_ids:
+        with transaction.atomic():
+            blob = CertificateBlob.objects.select_for_update().filter(pk=blob_id).first()
+            if blob is None or blob.certifications.exists():
+                continue
+            default_storage.delete(blob.name)
+            blob.delete()
+            released += 1
+    return released
+
+
+def orphan_blob_ids():
+    return CertificateBlob.objects.filter(
+        ~Exists(Certification.objects.filter(blob=OuterRef('pk')))
+    ).values_list('pk', flat=True)
@@ -0,0 +1,88 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import Certification, ChangeLogEntry, Contract, Product, Vendor
+
+# fields carried in each entry's data, matching what the API serializers expose
+CHANGE_FEED_FIELDS = {
+    Vendor: ('vendor', ['id', 'name', 'status', 'contact_name', 'contact_email', 'contact_phone', 'website', 'updated_at']),
+    Certification: (
+        'certification',
+        ['id', 'vendor', 'cert_type', 'issue_date', 'expiry_date', 'is_current', 'approval_status', 'updated_at'],
+    ),
+    Contract: ('contract', ['id', 'vendor', 'contract_id', 'total_value', 'start_date', 'end_date', 'updated_at']),
+    Product: ('product', ['id', 'vendor', 'name', 'status', 'updated_at']),
+}
+
+
+def _vendor_owners(instances):
+    owners = {}
+    missing = set()
+    for instance in instances:
+        if isinstance(instance, Vendor):
+            owners[instance.pk] = (instance.user_id, instance.internal_rep_id)
+        elif type(instance).vendor.is_cached(instance):
+            owners[instance.vendor_id] = (instance.vendor.user_id, instance.vendor.internal_rep_id)
+        else:
+            missing.add(instance.vendor_id)
+    missing -= owners.keys()
+    if missing:
+        for pk, user_id, rep_id in Vendor.objects.filter(pk__in=missing).values_list('pk', 'user_id', 'internal_rep_id'):
+            owners[pk] = (user_id, rep_id)
+    return owners
+
+
+def change_entries(instances, action='upsert', owners=None):
+    """Unsaved change-log entries snapshotting each instance as it is now.
+
+    ``owners`` maps vendor ids to ``(user_id, internal_rep_id)`` when the
+    caller already knows them; otherwise they are looked up.
+    """
+    instances = list(instances)
+    if not instances:
+        return []
+    if owners is None:
+        owners = _vendor_owners(instances)
+    now = timezone.now()
+
+    entries = []
+    for instance in instances:
+        resource, fields = CHANGE_FEED_FIELDS[type(instance)]
+        vendor_id = instance.pk if isinstance(instance, Vendor) else instance.vendor_id
+        user_id, rep_id = owners.get(vendor_id, (None, None))
+        data = None
+        if action == 'upsert':
+            opts = instance._meta
+            data = {name: opts.get_field(name).value_from_object(instance) for name in fields}
+        entries.append(ChangeLogEntry(
+            resource=resource,
+            object_id=str(instance.pk),
+            vendor_id=vendor_id,
+            action=action,
+            data=data,
+            user_id=user_id,
+            internal_rep_id=rep_id,
+            changed_at=now,
+        ))
+    return entries
+
+
+def record_changes(instances, action='upsert'):
+    """Append a change-log entry for each saved (or deleted) instance, in one INSERT."""
+    entries = change_entries(instances, action)
+    if entries:
+        ChangeLogEntry.objects.bulk_create(entries, batch_size=1000)
+
+
+def settled_changes(after=0):
+    """Entries past ``after`` that are old enough for every earlier sequence number to have committed."""
+    cutoff = timezone.now() - timedelta(seconds=settings.CHANGE_FEED_SETTLE_SECONDS)
+    return ChangeLogEntry.objects.filter(pk__gt=after, changed_at__lte=cutoff).order_by('pk')
+
+
+def delete_expired_changes():
+    cutoff = timezone.now() - timedelta(days=settings.CHANGE_LOG_RETENTION_DAYS)
+    deleted, _by_model = ChangeLogEntry.objects.filter(changed_at__lt=cutoff).delete()
+    return deleted
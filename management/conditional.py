@@ -0,0 +1,70 @@
+import calendar
+from datetime import datetime, time
+import hashlib
+
+from django.conf import settings
+from django.contrib import messages
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, quote_etag
+from django.utils.http import http_date
+
+
+def version_etag(*parts):
+    return quote_etag(hashlib.md5(repr(parts).encode(), usedforsecurity=False).hexdigest())
+
+
+def latest(*timestamps):
+    return max((timestamp for timestamp in timestamps if timestamp is not None), default=None)
+
+
+def _epoch(value):
+    return calendar.timegm(value.utctimetuple()) if value is not None else None
+
+
+def conditional_response(request, etag, last_modified=None):
+    """A 304 (or 412) response when the request's validators match, else ``None``."""
+    return get_conditional_response(request, etag=etag, last_modified=_epoch(last_modified))
+
+
+def set_validators(response, etag, last_modified=None):
+    if response.status_code != 200:
+        return response
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(_epoch(last_modified))
+    return response
+
+
+class ConditionalGetMixin:
+    """Answer ``If-None-Match``/``If-Modified-Since`` from a version stamp before building the page.
+
+    ``get_version_stamp()`` returns ``(parts, last_modified)`` from a cheap
+    query, or ``None`` to render normally. The ETag also covers the user,
+    the query string, today's date (validity and active flags depend on it)
+    and the CSRF cookie the rendered forms were built with.
+    """
+
+    def get_version_stamp(self):
+        raise NotImplementedError
+
+    def get(self, request, *args, **kwargs):
+        stamp = self.get_version_stamp()
+        # rendering consumes pending flash messages, so a 304 would hold them back
+        if stamp is None or len(messages.get_messages(request)):
+            return super().get(request, *args, **kwargs)
+
+        parts, last_modified = stamp
+        today = timezone.localdate()
+        if last_modified is not None:
+            last_modified = latest(last_modified, timezone.make_aware(datetime.combine(today, time.min)))
+        etag = version_etag(
+            *parts,
+            request.user.pk,
+            request.GET.urlencode(),
+            today,
+            request.COOKIES.get(settings.CSRF_COOKIE_NAME),
+        )
+        response = conditional_response(request, etag, last_modified)
+        if response is None:
+            response = super().get(request, *args, **kwargs)
+        return set_validators(response, etag, last_modified)
@@ -0,0 +1,137 @@
+from datetime import timedelta
+from functools import partial
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, IntegerField, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Certification, Vendor, VendorRollup
+
+RISK_TIERS = ['Low', 'Medium', 'High']
+STATUS_CHART = [
+    ('verified', 'Verified'),
+    ('pending', 'Pending'),
+    ('under_review', 'Under Review'),
+    ('inactive', 'Inactive'),
+]
+
+CACHE_EVENTS = ('hits', 'misses', 'invalidations')
+CACHE_METRIC_NAME = 'management_dashboard_cache_events_total'
+
+
+def _count_per_vendor(queryset):
+    return Subquery(
+        queryset.filter(vendor=OuterRef('pk')).order_by().values('vendor').annotate(count=Count('pk')).values('count'),
+        output_field=IntegerField(),
+    )
+
+
+def dashboard_metrics(user, today=None):
+    """Compute every dashboard tile for ``user`` in two queries.
+
+    Certification and product scopes only cover vendors the user owns, which is
+    a subset of the vendor scope, so their counts are summed per vendor with
+    ``owned`` restricting the rows for non-staff users. Product counts and spend
+    are read from the precomputed ``VendorRollup`` rows.
+    """
+    today = today or timezone.now().date()
+    owned = None if user.is_superuser or user.is_staff else Q(user=user)
+    expiring_certs = Certification.objects.filter(expiry_date__gte=today, expiry_date__lte=today + timedelta(days=30))
+
+    vendor_counts = Vendor.objects.for_user(user).aggregate(
+        total_vendors=Count('pk'),
+        expiring_certs=Coalesce(Sum(_count_per_vendor(expiring_certs), filter=owned), 0),
+        total_products=Coalesce(Sum('rollup__product_count', filter=owned), 0),
+        **{status: Count('pk', filter=Q(status=status)) for status, _label in STATUS_CHART},
+    )
+
+    spend_by_risk = (
+        VendorRollup.objects.for_user(user)
+        .order_by()
+        .values('vendor__risk_tier')
+        .annotate(total=Sum('active_contract_value'))
+    )
+    spend_map = {row['vendor__risk_tier']: row['total'] or 0 for row in spend_by_risk}
+
+    return {
+        'total_vendors': vendor_counts['total_vendors'],
+        'verified_vendors': vendor_counts['verified'],
+        'expiring_certs': vendor_counts['expiring_certs'],
+        'total_products': vendor_counts['total_products'],
+        'total_spend': sum(spend_map.values()),
+        'risk_labels': RISK_TIERS,
+        'risk_spend_data': [float(spend_map.get(tier, 0)) for tier in RISK_TIERS],
+        'chart_labels': [label for _status, label in STATUS_CHART],
+        'chart_data': [vendor_counts[status] for status, _label in STATUS_CHART],
+    }
+
+
+def _cache_scope(user):
+    # staff share one unscoped result; everyone else is keyed by their own scope
+    return 'staff' if user.is_superuser or user.is_staff else f'user:{user.pk}'
+
+
+def _cache_key(scope, today=None):
+    today = today or timezone.now().date()
+    return f'dashboard-metrics:{today.isoformat()}:{scope}'
+
+
+def _cache_event_key(event):
+    return f'dashboard-cache-events:{event}'
+
+
+def _record_cache_event(event):
+    # kept in the shared cache so every worker process counts into the same totals
+    key = _cache_event_key(event)
+    cache.add(key, 0, timeout=None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # evicted in between; scrapers see a counter reset
+        cache.set(key, 1, timeout=None)
+
+
+def cached_dashboard_metrics(user):
+    key = _cache_key(_cache_scope(user))
+    metrics = cache.get(key)
+    if metrics is not None:
+        _record_cache_event('hits')
+        return metrics
+
+    _record_cache_event('misses')
+    metrics = dashboard_metrics(user)
+    cache.set(key, metrics, settings.DASHBOARD_CACHE_TTL)
+    return metrics
+
+
+def invalidate_dashboard_metrics(user_ids=()):
+    """Drop the staff dashboard and those of ``user_ids`` once the current transaction commits.
+
+    Dropping them earlier would let a request in between cache the pre-commit
+    numbers again for ``DASHBOARD_CACHE_TTL``.
+    """
+    keys = [_cache_key(scope) for scope in ['staff'] + [f'user:{user_id}' for user_id in user_ids if user_id]]
+    transaction.on_commit(partial(_delete_dashboard_keys, keys))
+
+
+def _delete_dashboard_keys(keys):
+    cache.delete_many(keys)
+    _record_cache_event('invalidations')
+
+
+def dashboard_cache_stats():
+    counts = cache.get_many([_cache_event_key(event) for event in CACHE_EVENTS])
+    return {event: counts.get(_cache_event_key(event), 0) for event in CACHE_EVENTS}
+
+
+def dashboard_cache_metrics():
+    """The dashboard cache counters in the Prometheus text exposition format."""
+    lines = [
+        f'# HELP {CACHE_METRIC_NAME} Dashboard cache hits, misses and invalidations across all workers.',
+        f'# TYPE {CACHE_METRIC_NAME} counter',
+    ]
+    lines += [f'{CACHE_METRIC_NAME}{{event="{event}"}} {count}' for event, count in dashboard_cache_stats().items()]
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,88 @@
+from datetime import timedelta
+import os
+import uuid
+
+from django.conf import settings
+from django.core import signing
+from django.core.files.storage import default_storage
+from django.urls import reverse
+
+TOKEN_SALT = 'management.direct-cert-upload'
+ALLOWED_EXTENSIONS = {'.pdf', '.png', '.jpg', '.jpeg', '.tif', '.tiff'}
+
+
+class InvalidUploadToken(ValueError):
+    pass
+
+
+def upload_extension(filename):
+    _name, ext = os.path.splitext(filename or '')
+    return ext.lower()
+
+
+def new_upload_key(filename):
+    # same shape as hashed_upload_path, so finalized rows look like proxied uploads
+    return f'certs/{uuid.uuid4().hex}{upload_extension(filename)}'
+
+
+def sign_upload(vendor, key):
+    return signing.dumps({'key': key, 'vendor': str(vendor.pk)}, salt=TOKEN_SALT)
+
+
+def read_upload_token(token, vendor=None):
+    try:
+        payload = signing.loads(token, salt=TOKEN_SALT, max_age=settings.CERT_DIRECT_UPLOAD_EXPIRY)
+    except signing.BadSignature as exc:
+        raise InvalidUploadToken('Upload token is invalid or has expired.') from exc
+    if vendor is not None and payload['vendor'] != str(vendor.pk):
+        raise InvalidUploadToken('Upload token was issued to another vendor.')
+    return payload['key']
+
+
+def _s3_target(key, content_type):
+    client = default_storage.connection.meta.client
+    post = client.generate_presigned_post(
+        Bucket=default_storage.bucket_name,
+        Key=key,
+        Fields={'Content-Type': content_type},
+        Conditions=[
+            {'Content-Type': content_type},
+            ['content-length-range', 1, settings.CERT_UPLOAD_MAX_BYTES],
+        ],
+        ExpiresIn=settings.CERT_DIRECT_UPLOAD_EXPIRY,
+    )
+    return {'method': 'POST', 'url': post['url'], 'fields': post['fields'], 'headers': {}}
+
+
+def _gcs_target(key, content_type):
+    headers = {
+        'Content-Type': content_type,
+        'x-goog-content-length-range': f'1,{settings.CERT_UPLOAD_MAX_BYTES}',
+    }
+    url = default_storage.bucket.blob(key).generate_signed_url(
+        version='v4',
+        expiration=timedelta(seconds=settings.CERT_DIRECT_UPLOAD_EXPIRY),
+        method='PUT',
+        content_type=content_type,
+        headers=headers,
+    )
+    return {'method': 'PUT', 'url': url, 'fields': {}, 'headers': headers}
+
+
+def _local_target(key, content_type, token):
+    # filesystem stand-in for development and tests: a token-authorised PUT handled by Django
+    url = reverse('cert_direct_upload_put', args=[token])
+    return {'method': 'PUT', 'url': url, 'fields': {}, 'headers': {'Content-Type': content_type}}
+
+
+def presign_upload(vendor, filename, content_type):
+    """Issue an upload target the browser can send the file to without going through Django."""
+    key = new_upload_key(filename)
+    token = sign_upload(vendor, key)
+    if settings.STORAGE_BACKEND == 's3':
+        target = _s3_target(key, content_type)
+    elif settings.STORAGE_BACKEND == 'gcs':
+        target = _gcs_target(key, content_type)
+    else:
+        target = _local_target(key, content_type, token)
+    return {'token': token, 'key': key, 'expires_in': settings.CERT_DIRECT_UPLOAD_EXPIRY, **target}
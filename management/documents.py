@@ -0,0 +1,119 @@
+import mimetypes
+import os
+import re
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.http import content_disposition_header
+
+RANGE_HEADER = re.compile(r'^bytes=(\d*)-(\d*)$')
+RANGE_CHUNK_SIZE = 64 * 1024
+
+
+class UnsatisfiableRange(ValueError):
+    pass
+
+
+def signed_url_lifetime():
+    if settings.STORAGE_BACKEND == 's3':
+        return settings.AWS_QUERYSTRING_EXPIRE
+    if settings.STORAGE_BACKEND == 'gcs':
+        return int(settings.GS_EXPIRATION.total_seconds())
+    return None
+
+
+def cached_file_url(name):
+    """``default_storage.url(name)``, reusing a signed URL until shortly before it expires."""
+    lifetime = signed_url_lifetime()
+    if lifetime is None:
+        return default_storage.url(name)
+
+    key = f'cert-document-url:{name}'
+    url = cache.get(key)
+    if url is None:
+        url = default_storage.url(name)
+        # the URL is still valid for at least the margin whenever it is handed out
+        cache.set(key, url, max(lifetime - settings.CERT_SIGNED_URL_REFRESH_MARGIN, 0))
+    return url
+
+
+def parse_range(header, size):
+    """Inclusive ``(start, end)`` for a single byte range, or ``None`` to send the whole file.
+
+    Multiple ranges and malformed headers fall back to the whole file, which
+    RFC 9110 allows; a range starting past the end raises ``UnsatisfiableRange``.
+    """
+    match = RANGE_HEADER.match(header.strip())
+    if not match or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if not first:
+        suffix = int(last)
+        if suffix == 0:
+            raise UnsatisfiableRange(header)
+        return max(size - suffix, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if last and int(last) < start:
+        return None
+    if start >= size:
+        raise UnsatisfiableRange(header)
+    return start, end
+
+
+def _read_range(handle, start, length):
+    try:
+        handle.seek(start)
+        remaining = length
+        while remaining > 0:
+            chunk = handle.read(min(RANGE_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        handle.close()
+
+
+def _offload_response(name, content_type):
+    response = HttpResponse(content_type=content_type)
+    if settings.CERT_DOCUMENT_OFFLOAD == 'x-accel-redirect':
+        response['X-Accel-Redirect'] = settings.CERT_DOCUMENT_ACCEL_PREFIX + name
+    else:
+        response['X-Sendfile'] = default_storage.path(name)
+    return response
+
+
+def file_response(request, name, content_type='', filename=None, etag=None):
+    """Serve a locally stored file: offloaded to the web server when configured, else with Range support."""
+    content_type = content_type or mimetypes.guess_type(name)[0] or 'application/octet-stream'
+    if settings.CERT_DOCUMENT_OFFLOAD:
+        response = _offload_response(name, content_type)
+    else:
+        size = default_storage.size(name)
+        try:
+            # a stale If-Range validator means the client's partial copy is of other content
+            if_range = request.headers.get('If-Range')
+            stale = if_range is not None and if_range != etag
+            byte_range = None if stale else parse_range(request.headers.get('Range', ''), size)
+        except UnsatisfiableRange:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+
+        handle = default_storage.open(name, 'rb')
+        if byte_range is None:
+            response = FileResponse(handle, content_type=content_type)
+        else:
+            start, end = byte_range
+            response = StreamingHttpResponse(_read_range(handle, start, end - start + 1), status=206, content_type=content_type)
+            response['Content-Range'] = f'bytes {start}-{end}/{size}'
+            response['Content-Length'] = str(end - start + 1)
+        response['Accept-Ranges'] = 'bytes'
+
+    if etag is not None:
+        response['ETag'] = etag
+    response['Content-Disposition'] = content_disposition_header(False, filename or os.path.basename(name))
+    return response
@@ -1,6 +1,8 @@
 from django import forms
 
+from .direct_uploads import ALLOWED_EXTENSIONS, upload_extension
 from .models import Certification, Vendor
+from .uploads import CONTENT_SIGNATURES
 
 
 TAILWIND_INPUT = 'mt-1 block w-full rounded-md border-gray-300 shadow-sm focus:border-blue-500 focus:ring-blue-500 sm:text-sm'
@@ -64,3 +66,55 @@ class CertificationForm(forms.ModelForm):
             'expiry_date': forms.DateInput(attrs={'class': TAILWIND_INPUT, 'type': 'date'}),
             'is_current': forms.CheckboxInput(attrs={'class': 'h-4 w-4 text-blue-600 focus:ring-blue-500 border-gray-300 rounded'}),
         }
+
+
+class DirectUploadRequestForm(forms.Form):
+    filename = forms.CharField(max_length=255)
+    content_type = forms.ChoiceField(choices=sorted({(content_type, content_type) for _signature, content_type in CONTENT_SIGNATURES}))
+
+    def clean_filename(self):
+        filename = self.cleaned_data['filename']
+        if upload_extension(filename) not in ALLOWED_EXTENSIONS:
+            raise forms.ValidationError('Upload a PDF or a scanned image.')
+        return filename
+
+
+class CertificationFinalizeForm(CertificationForm):
+    token = forms.CharField()
+
+    class Meta(CertificationForm.Meta):
+        fields = ['cert_type', 'issue_date', 'expiry_date', 'is_current']
+
+
+class ApprovalQueueFilterForm(forms.Form):
+    cert_type = forms.ChoiceField(
+        choices=[('', 'All types')] + Certification.CERT_TYPES, required=False, widget=forms.Select(attrs={'class': TAILWIND_INPUT})
+    )
+    expires_after = forms.DateField(required=False, widget=forms.DateInput(attrs={'class': TAILWIND_INPUT, 'type': 'date'}))
+    expires_before = forms.DateField(required=False, widget=forms.DateInput(attrs={'class': TAILWIND_INPUT, 'type': 'date'}))
+
+    def filter(self, queryset):
+        if not self.is_valid():
+            return queryset
+        if self.cleaned_data['cert_type']:
+            queryset = queryset.filter(cert_type=self.cleaned_data['cert_type'])
+        if self.cleaned_data['expires_after']:
+            queryset = queryset.filter(expiry_date__gte=self.cleaned_data['expires_after'])
+        if self.cleaned_data['expires_before']:
+            queryset = queryset.filter(expiry_date__lte=self.cleaned_data['expires_before'])
+        return queryset
+
+
+class IdListField(forms.TypedMultipleChoiceField):
+    """Integer primary keys, checked by the caller's query rather than by loading every row here."""
+
+    def __init__(self, **kwargs):
+        super().__init__(coerce=int, **kwargs)
+
+    def valid_value(self, value):
+        return str(value).isdigit()
+
+
+class CertificationReviewForm(forms.Form):
+    decision = forms.ChoiceField(choices=[('approve', 'Approve'), ('reject', 'Reject')])
+    certifications = IdListField()
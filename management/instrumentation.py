@@ -0,0 +1,370 @@
+from collections import Counter, defaultdict, deque
+from contextlib import ExitStack, contextmanager, nullcontext
+from datetime import timedelta
+import functools
+import json
+import logging
+import math
+from operator import or_
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.db import DatabaseError, connections
+from django.db.models import Count, Q, Subquery
+from django.utils import timezone
+
+from .models import TaskRun
+
+logger = logging.getLogger(__name__)
+
+DUPLICATE_REPORT_LIMIT = 5
+SQL_PREVIEW_LENGTH = 200
+METRICS_PREFIX = 'management_task'
+# run counts cover this much history, so a scrape reads a day of rows rather than the whole retention
+RECENT_RUNS_WINDOW = timedelta(hours=24)
+# names of every task wrapped by instrumented_task, for index seeks per task
+INSTRUMENTED_TASKS = []
+
+
+class QueryRecorder:
+    """Count and time every query run on this thread's database connections inside the block.
+
+    With ``fingerprints`` it also tallies each SQL statement (placeholders, not
+    values), so the same query repeated in a loop shows up as a duplicate.
+    """
+
+    def __init__(self, fingerprints=False):
+        self.count = 0
+        self.duration = 0.0
+        self.fingerprints = Counter() if fingerprints else None
+        self._stack = ExitStack()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.count += 1
+            if self.fingerprints is not None:
+                self.fingerprints[sql] += 1
+
+    def __enter__(self):
+        for connection in connections.all():
+            self._stack.enter_context(connection.execute_wrapper(self))
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stack.close()
+
+    def duplicates(self):
+        if not self.fingerprints:
+            return []
+        return [
+            {'sql': sql[:SQL_PREVIEW_LENGTH], 'count': count}
+            for sql, count in self.fingerprints.most_common(DUPLICATE_REPORT_LIMIT)
+            if count > 1
+        ]
+
+    def duplicate_count(self):
+        return sum(count - 1 for count in self.fingerprints.values()) if self.fingerprints else 0
+
+
+def percentiles(values, points=(50, 95, 99)):
+    """Nearest-rank percentiles of ``values``, keyed ``p50``, ``p95``..."""
+    ordered = sorted(values)
+    return {f'p{point}': ordered[max(math.ceil(point / 100 * len(ordered)) - 1, 0)] for point in points}
+
+
+class RequestSamples:
+    """Thread-safe ring buffer of the most recent instrumented requests."""
+
+    METRICS = ('wall_ms', 'db_ms', 'template_ms', 'queries')
+
+    def __init__(self, size):
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, record):
+        with self._lock:
+            self._samples.append((record['view'], *(record[metric] for metric in self.METRICS)))
+
+    def clear(self):
+        with self._lock:
+            self._samples.clear()
+
+    def summary(self):
+        with self._lock:
+            samples = list(self._samples)
+        by_view = defaultdict(list)
+        for view, *metrics in samples:
+            by_view[view].append(metrics)
+        return {
+            view: {
+                'count': len(rows),
+                **{metric: percentiles(column) for metric, column in zip(self.METRICS, zip(*rows))},
+            }
+            for view, rows in sorted(by_view.items())
+        }
+
+
+request_samples = RequestSamples(settings.REQUEST_INSTRUMENTATION_BUFFER_SIZE)
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 2)
+
+
+class RequestInstrumentationMiddleware:
+    """Time sampled requests: wall clock, SQL (count, time, repeats) and template rendering.
+
+    Results go to a ``Server-Timing`` header, a JSON line on the
+    ``management.instrumentation`` logger and ``request_samples``. Streaming
+    bodies are produced after the response leaves the middleware, so their
+    queries are not counted.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if random.random() >= settings.REQUEST_INSTRUMENTATION_SAMPLE_RATE:
+            return self.get_response(request)
+
+        request._template_seconds = 0.0
+        started = time.perf_counter()
+        with QueryRecorder(fingerprints=settings.REQUEST_INSTRUMENTATION_FINGERPRINTS) as queries:
+            request._query_recorder = queries
+            response = self.get_response(request)
+        wall = time.perf_counter() - started
+
+        match = request.resolver_match
+        record = {
+            'view': match.view_name if match else 'unresolved',
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'wall_ms': _ms(wall),
+            'db_ms': _ms(queries.duration),
+            'template_ms': _ms(request._template_seconds),
+            'queries': queries.count,
+            'duplicate_queries': queries.duplicate_count(),
+            'streaming': response.streaming,
+        }
+        request_samples.add(record)
+        if record['wall_ms'] >= settings.REQUEST_INSTRUMENTATION_LOG_THRESHOLD_MS:
+            logger.info(json.dumps({**record, 'duplicates': queries.duplicates()}, sort_keys=True))
+
+        timings = [
+            f'app;dur={record["wall_ms"]}',
+            f'db;dur={record["db_ms"]};desc="{record["queries"]} queries"',
+            f'tpl;dur={record["template_ms"]}',
+        ]
+        if response.has_header('Server-Timing'):
+            timings.insert(0, response['Server-Timing'])
+        response['Server-Timing'] = ', '.join(timings)
+        return response
+
+    def process_template_response(self, request, response):
+        queries = getattr(request, '_query_recorder', None)
+        if queries is None:
+            return response
+        started = time.perf_counter()
+        db_before = queries.duration
+
+        def rendered(response):
+            # querysets evaluated lazily by the template count as database time, not template time
+            request._template_seconds += (time.perf_counter() - started) - (queries.duration - db_before)
+
+        response.add_post_render_callback(rendered)
+        return response
+
+
+class TaskRecorder:
+    """Per-phase wall time, queries and counters of one task run."""
+
+    def __init__(self, task):
+        self.task = task
+        self.phases = {}
+        self.counters = Counter()
+        self._open = []
+
+    @contextmanager
+    def phase(self, name):
+        # a phase entered more than once (e.g. in a loop) accumulates
+        metrics = self.phases.setdefault(name, {'duration_ms': 0.0, 'queries': 0, 'db_ms': 0.0})
+        self._open.append(metrics)
+        queries = QueryRecorder()
+        started = time.perf_counter()
+        try:
+            with queries:
+                yield
+        finally:
+            self._open.pop()
+            metrics['duration_ms'] = round(metrics['duration_ms'] + (time.perf_counter() - started) * 1000, 2)
+            metrics['db_ms'] = round(metrics['db_ms'] + queries.duration * 1000, 2)
+            metrics['queries'] += queries.count
+            logger.debug(json.dumps({'task': self.task, 'phase': name, **metrics}, sort_keys=True))
+
+    def count(self, name, value=1):
+        self.counters[name] += value
+        if self._open:
+            self._open[-1][name] = self._open[-1].get(name, 0) + value
+
+
+_task_runs = threading.local()
+
+
+def current_task_run():
+    stack = getattr(_task_runs, 'stack', None)
+    return stack[-1] if stack else None
+
+
+def task_phase(name):
+    """Time ``name`` as a phase of the running task; a no-op outside ``instrumented_task``."""
+    run = current_task_run()
+    return run.phase(name) if run else nullcontext()
+
+
+def task_count(name, value=1):
+    """Add ``value`` to counter ``name`` of the running task and its current phase."""
+    run = current_task_run()
+    if run:
+        run.count(name, value)
+
+
+def _on_worker():
+    try:
+        from celery import current_task
+    except ModuleNotFoundError:
+        return False
+    return bool(current_task) and not current_task.request.called_directly
+
+
+def instrumented_task(func):
+    """Record each call of ``func`` as a ``TaskRun``, including calls made inline without Celery.
+
+    Goes under ``@shared_task`` so the Celery task keeps ``func``'s name. A
+    failing task is recorded and its exception re-raised; failing to record a
+    run never fails the task.
+    """
+    name = f'{func.__module__}.{func.__name__}'
+    INSTRUMENTED_TASKS.append(name)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not settings.TASK_INSTRUMENTATION:
+            return func(*args, **kwargs)
+
+        run = TaskRecorder(name)
+        stack = _task_runs.__dict__.setdefault('stack', [])
+        stack.append(run)
+        queries = QueryRecorder()
+        started_at = timezone.now()
+        started = time.perf_counter()
+        error = ''
+        try:
+            with queries:
+                return func(*args, **kwargs)
+        except Exception as exc:
+            error = f'{type(exc).__name__}: {exc}'
+            raise
+        finally:
+            stack.pop()
+            record = {
+                'task': name,
+                'status': 'failed' if error else 'succeeded',
+                'inline': not _on_worker(),
+                'started_at': started_at,
+                'duration_ms': _ms(time.perf_counter() - started),
+                'queries': queries.count,
+                'db_ms': _ms(queries.duration),
+                'phases': run.phases,
+                'counters': dict(run.counters),
+                'error': error,
+            }
+            try:
+                TaskRun.objects.create(**record)
+            except DatabaseError:
+                logger.exception('Could not record a run of %s', name)
+
+    return wrapper
+
+
+# every family is a gauge: run counts cover a sliding window, so they can go down
+TASK_METRIC_FAMILIES = {
+    'recent_runs': 'Runs started in the last 24 hours, by outcome.',
+    'last_run_timestamp_seconds': 'Start time of the latest run.',
+    'last_success_timestamp_seconds': 'Start time of the latest successful run.',
+    'last_failed': 'Whether the latest run failed.',
+    'last_duration_seconds': 'Wall time of the latest run.',
+    'last_db_seconds': 'Time spent in SQL by the latest run.',
+    'last_queries': 'SQL queries run by the latest run.',
+    'last_count': 'Counters of the latest run (rows scanned and updated, emails sent...).',
+    'last_phase_duration_seconds': 'Wall time of each phase of the latest run.',
+    'last_phase_db_seconds': 'Time spent in SQL by each phase of the latest run.',
+    'last_phase_queries': 'SQL queries run by each phase of the latest run.',
+    'last_phase_count': 'Counters of each phase of the latest run.',
+}
+
+
+def _labels(**labels):
+    escaped = (
+        (key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for key, value in labels.items()
+    )
+    return '{' + ','.join(f'{key}="{value}"' for key, value in escaped) + '}'
+
+
+def _latest_runs(**filters):
+    # one uncorrelated seek per task on the (task, started_at) index, however long the history is
+    seeks = [
+        Q(pk=Subquery(TaskRun.objects.filter(task=task, **filters).order_by('-started_at', '-pk').values('pk')[:1]))
+        for task in INSTRUMENTED_TASKS
+    ]
+    if not seeks:
+        return TaskRun.objects.none()
+    return TaskRun.objects.filter(functools.reduce(or_, seeks)).order_by('task')
+
+
+def task_metrics():
+    """``TaskRun`` history in the Prometheus text exposition format.
+
+    Run counts cover ``RECENT_RUNS_WINDOW``; everything else describes the
+    latest run of each task, so scraping it over time shows a job slowing down.
+    """
+    families = defaultdict(list)
+    recent = TaskRun.objects.filter(started_at__gte=timezone.now() - RECENT_RUNS_WINDOW)
+    for row in recent.order_by().values('task', 'status').annotate(runs=Count('pk')):
+        families['recent_runs'].append((_labels(task=row['task'], status=row['status']), row['runs']))
+    for task, started_at in _latest_runs(status='succeeded').values_list('task', 'started_at'):
+        families['last_success_timestamp_seconds'].append((_labels(task=task), started_at.timestamp()))
+
+    for run in _latest_runs():
+        task = _labels(task=run.task)
+        families['last_run_timestamp_seconds'].append((task, run.started_at.timestamp()))
+        families['last_failed'].append((task, int(run.status == 'failed')))
+        families['last_duration_seconds'].append((task, run.duration_ms / 1000))
+        families['last_db_seconds'].append((task, run.db_ms / 1000))
+        families['last_queries'].append((task, run.queries))
+        for counter, value in sorted(run.counters.items()):
+            families['last_count'].append((_labels(task=run.task, counter=counter), value))
+        for phase, metrics in run.phases.items():
+            metrics = dict(metrics)
+            labels = _labels(task=run.task, phase=phase)
+            families['last_phase_duration_seconds'].append((labels, metrics.pop('duration_ms') / 1000))
+            families['last_phase_db_seconds'].append((labels, metrics.pop('db_ms') / 1000))
+            families['last_phase_queries'].append((labels, metrics.pop('queries')))
+            for counter, value in sorted(metrics.items()):
+                families['last_phase_count'].append((_labels(task=run.task, phase=phase, counter=counter), value))
+
+    lines = []
+    for family, description in TASK_METRIC_FAMILIES.items():
+        if not families[family]:
+            continue
+        name = f'{METRICS_PREFIX}_{family}'
+        lines += [f'# HELP {name} {description}', f'# TYPE {name} gauge']
+        lines += [f'{name}{labels} {value}' for labels, value in families[family]]
+    return '\n'.join(lines) + '\n'
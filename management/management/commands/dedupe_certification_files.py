@@ -0,0 +1,33 @@
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+
+from management.blobs import adopt_blob, delete_unreferenced_file
+from management.models import Certification
+
+BATCH_SIZE = 500
+
+
+class Command(BaseCommand):
+    help = 'Attach existing certification files to content-addressed blobs and delete duplicate copies.'
+
+    def handle(self, *args, **options):
+        cert_ids = list(
+            Certification.objects.filter(blob__isnull=True).exclude(file='').order_by('pk').values_list('pk', flat=True)
+        )
+        adopted = removed = missing = 0
+        for start in range(0, len(cert_ids), BATCH_SIZE):
+            for cert in list(Certification.objects.filter(pk__in=cert_ids[start:start + BATCH_SIZE]).only('pk', 'file')):
+                if not default_storage.exists(cert.file.name):
+                    missing += 1
+                    continue
+                with cert.file.open('rb') as handle:
+                    # the file's content is unchanged, so attaching skips the save signals and updated_at
+                    _blob, redundant_name = adopt_blob(handle, cert.file.name, cert_id=cert.pk)
+                adopted += 1
+                if redundant_name:
+                    delete_unreferenced_file(redundant_name)
+                    removed += 1
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Attached {adopted} certification file(s) to blobs, removed {removed} duplicate(s), {missing} missing.'
+        ))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from management.benchmarks import generate_benchmark_data
+
+
+class Command(BaseCommand):
+    help = 'Bulk-insert synthetic vendors with certifications, contracts, products and history into the configured database.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--vendors', type=int, default=1000)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--certs', type=int, default=3, help='Certifications per vendor.')
+        parser.add_argument('--contracts', type=int, default=2, help='Contracts per vendor.')
+        parser.add_argument('--products', type=int, default=5, help='Products per vendor.')
+        parser.add_argument('--history', type=int, default=4, help='VendorHistory rows per vendor.')
+
+    def handle(self, *args, **options):
+        counts = generate_benchmark_data(
+            options['vendors'],
+            seed=options['seed'],
+            certs=options['certs'],
+            contracts=options['contracts'],
+            products=options['products'],
+            history=options['history'],
+        )
+        summary = ', '.join(f'{count} {name}' for name, count in counts.items())
+        self.stdout.write(self.style.SUCCESS(f'Created {summary}.'))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from management.search import refresh_search_documents
+
+
+class Command(BaseCommand):
+    help = 'Rebuild every VendorSearchDocument from vendor, product and contract data.'
+
+    def handle(self, *args, **options):
+        refreshed = refresh_search_documents()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {refreshed} vendor search document(s).'))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from management.rollups import refresh_vendor_rollups, stale_rollup_vendor_ids
+
+
+class Command(BaseCommand):
+    help = 'Recompute VendorRollup rows and Vendor.total_spend from contracts, certifications and products.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--stale-only',
+            action='store_true',
+            help='Only refresh vendors whose contracts or certifications crossed a date boundary since their last rollup.',
+        )
+
+    def handle(self, *args, **options):
+        vendor_ids = list(stale_rollup_vendor_ids()) if options['stale_only'] else None
+        refreshed = refresh_vendor_rollups(vendor_ids)
+        self.stdout.write(self.style.SUCCESS(f'Refreshed {refreshed} vendor rollup(s).'))
@@ -0,0 +1,92 @@
+import json
+import platform
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.runner import DiscoverRunner
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.utils import timezone
+
+from management.benchmarks import compare_results, generate_benchmark_data, merge_results, run_benchmarks
+
+
+class Command(BaseCommand):
+    help = (
+        'Time and query-count the hot pages, API endpoints and daily checks over synthetic data at several scales, '
+        'in a throwaway test database, and compare against a stored baseline.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scales', default='100,1000', help='Comma-separated vendor counts.')
+        parser.add_argument('--repeat', type=int, default=5, help='Runs per scenario; the median time is reported.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--only', action='append', help='Run only this scenario (repeatable).')
+        parser.add_argument('--output', help='Write the results as JSON to this path.')
+        parser.add_argument('--baseline', default=str(settings.BASE_DIR / 'benchmarks' / 'baseline.json'))
+        parser.add_argument(
+            '--update-baseline', action='store_true',
+            help='Store these results in the baseline, keeping scenarios and scales that were not run.',
+        )
+        parser.add_argument('--latency-threshold', type=float, default=0.25, help='Allowed slowdown as a fraction.')
+        parser.add_argument('--latency-floor', type=float, default=5.0, help='Slowdowns under this many ms are noise.')
+        parser.add_argument('--query-slack', type=int, default=0, help='Extra queries allowed per scenario.')
+
+    def handle(self, *args, **options):
+        scales = [int(scale) for scale in options['scales'].split(',') if scale.strip()]
+        setup_test_environment()
+        runner = DiscoverRunner(verbosity=0, interactive=False)
+        old_config = runner.setup_databases()
+        try:
+            results = {}
+            for scale in scales:
+                call_command('flush', interactive=False, verbosity=0)
+                generate_benchmark_data(scale, seed=options['seed'])
+                results[str(scale)] = run_benchmarks(options['repeat'], options['only'])
+                for name, measurement in results[str(scale)].items():
+                    self.stdout.write(f'{scale:>8} {name:<30} {measurement["queries"]:>5} queries {measurement["median_ms"]:>10.2f} ms')
+        finally:
+            runner.teardown_databases(old_config)
+            teardown_test_environment()
+
+        report = {
+            'meta': {
+                'generated_at': timezone.now().isoformat(),
+                'database': connection.vendor,
+                'python': platform.python_version(),
+                'repeat': options['repeat'],
+                'seed': options['seed'],
+            },
+            'results': results,
+        }
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(report, output, indent=2, sort_keys=True)
+        try:
+            with open(options['baseline']) as stored:
+                baseline = json.load(stored)['results']
+        except FileNotFoundError:
+            baseline = None
+
+        if options['update_baseline']:
+            # a partial run (--only, fewer --scales) only replaces what it measured
+            report['results'] = merge_results(baseline or {}, results)
+            with open(options['baseline'], 'w') as output:
+                json.dump(report, output, indent=2, sort_keys=True)
+            self.stdout.write(self.style.SUCCESS(f'Baseline written to {options["baseline"]}.'))
+            return
+        if baseline is None:
+            self.stdout.write(self.style.WARNING('No baseline to compare against; rerun with --update-baseline to store one.'))
+            return
+
+        regressions = compare_results(
+            results,
+            baseline,
+            latency_threshold=options['latency_threshold'],
+            latency_floor_ms=options['latency_floor'],
+            query_slack=options['query_slack'],
+        )
+        if regressions:
+            raise CommandError('Benchmark regressions:\n' + '\n'.join(regressions))
+        self.stdout.write(self.style.SUCCESS('No regressions against the baseline.'))
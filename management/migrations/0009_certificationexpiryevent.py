@@ -0,0 +1,52 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:51
+
+from datetime import date, timedelta
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def schedule_existing_certifications(apps, schema_editor):
+    Certification = apps.get_model('management', 'Certification')
+    CertificationExpiryEvent = apps.get_model('management', 'CertificationExpiryEvent')
+    today = date.today()
+    windows = ((30, 'notified_30_days'), (15, 'notified_15_days'), (1, 'notified_1_day'))
+
+    events = []
+    for cert in Certification.objects.filter(is_current=True, expiry_date__gte=today - timedelta(days=1)).iterator(chunk_size=2000):
+        schedule = [
+            (f'notice_{days}', cert.expiry_date - timedelta(days=days))
+            for days, flag in windows
+            if not getattr(cert, flag)
+        ]
+        schedule.append(('expiry', cert.expiry_date + timedelta(days=1)))
+        events.extend(
+            CertificationExpiryEvent(certification_id=cert.pk, kind=kind, due_date=due_date)
+            for kind, due_date in schedule
+            if due_date >= today
+        )
+    CertificationExpiryEvent.objects.bulk_create(events, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('management', '0008_certification_approval_status_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CertificationExpiryEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('notice_30', '30-day notice'), ('notice_15', '15-day notice'), ('notice_1', '1-day notice'), ('expiry', 'Expiry')], max_length=20)),
+                ('due_date', models.DateField()),
+                ('certification', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='expiry_events', to='management.certification')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['due_date'], name='management__due_dat_420c9f_idx')],
+                'constraints': [models.UniqueConstraint(fields=('certification', 'kind'), name='uniq_expiry_event_per_cert')],
+            },
+        ),
+        migrations.RunPython(schedule_existing_certifications, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,73 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:56
+
+import datetime
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Min, Q, Sum
+
+
+def backfill_vendor_rollups(apps, schema_editor):
+    Vendor = apps.get_model('management', 'Vendor')
+    Contract = apps.get_model('management', 'Contract')
+    Certification = apps.get_model('management', 'Certification')
+    Product = apps.get_model('management', 'Product')
+    VendorRollup = apps.get_model('management', 'VendorRollup')
+    today = datetime.date.today()
+
+    def per_vendor(queryset, **aggregates):
+        return {row.pop('vendor'): row for row in queryset.order_by().values('vendor').annotate(**aggregates)}
+
+    contracts = per_vendor(
+        Contract.objects.all(),
+        active=Sum('total_value', filter=Q(start_date__lte=today, end_date__gte=today)),
+        total=Sum('total_value'),
+    )
+    certs = per_vendor(
+        Certification.objects.filter(expiry_date__gte=today, is_current=True, approval_status='approved'),
+        valid=Count('pk'),
+        next_expiry=Min('expiry_date'),
+    )
+    products = per_vendor(Product.objects.all(), total=Count('pk'), active=Count('pk', filter=Q(status='active')))
+
+    rollups = []
+    for vendor in Vendor.objects.only('pk', 'total_spend').iterator(chunk_size=2000):
+        contract_row = contracts.get(vendor.pk, {})
+        cert_row = certs.get(vendor.pk, {})
+        product_row = products.get(vendor.pk, {})
+        rollups.append(VendorRollup(
+            vendor_id=vendor.pk,
+            active_contract_value=contract_row.get('active') or 0,
+            valid_cert_count=cert_row.get('valid', 0),
+            next_cert_expiry=cert_row.get('next_expiry'),
+            product_count=product_row.get('total', 0),
+            active_product_count=product_row.get('active', 0),
+            computed_on=today,
+        ))
+        total_spend = contract_row.get('total') or 0
+        if vendor.total_spend != total_spend:
+            Vendor.objects.filter(pk=vendor.pk).update(total_spend=total_spend)
+    VendorRollup.objects.bulk_create(rollups, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('management', '0009_certificationexpiryevent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VendorRollup',
+            fields=[
+                ('vendor', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='rollup', serialize=False, to='management.vendor')),
+                ('active_contract_value', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('valid_cert_count', models.PositiveIntegerField(default=0)),
+                ('next_cert_expiry', models.DateField(blank=True, null=True)),
+                ('product_count', models.PositiveIntegerField(default=0)),
+                ('active_product_count', models.PositiveIntegerField(default=0)),
+                ('computed_on', models.DateField(default=datetime.date.today)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(backfill_vendor_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:57
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('management', '0010_vendorrollup'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='vendor',
+            index=models.Index(fields=['created_at', 'id'], name='management__created_131877_idx'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-17 04:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('management', '0013_changelogentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='certification',
+            name='content_type',
+            field=models.CharField(blank=True, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='certification',
+            name='page_count',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='certification',
+            name='processing_error',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='certification',
+            name='processing_status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('ready', 'Ready'), ('failed', 'Failed')], default='ready', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='certification',
+            name='thumbnail',
+            field=models.FileField(blank=True, upload_to='cert-thumbnails/'),
+        ),
+        migrations.AddField(
+            model_name='certification',
+            name='upload_spool_path',
+            field=models.CharField(blank=True, max_length=500),
+        ),
+    ]
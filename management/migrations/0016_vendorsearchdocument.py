@@ -0,0 +1,74 @@
+# Generated by Django 5.2.18 on 2026-10-17 04:30
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+FTS_TABLE = 'management_vendorsearch_fts'
+DOCUMENT_TABLE = 'management_vendorsearchdocument'
+
+POSTGRESQL_INDEXES = [
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    f'CREATE INDEX vendor_search_trgm_idx ON {DOCUMENT_TABLE} USING gin (document gin_trgm_ops)',
+    f"CREATE INDEX vendor_search_tsv_idx ON {DOCUMENT_TABLE} USING gin (to_tsvector('simple', document))",
+]
+SQLITE_INDEXES = [
+    f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(vendor_id UNINDEXED, document, tokenize='trigram')",
+    f"""CREATE TRIGGER {FTS_TABLE}_insert AFTER INSERT ON {DOCUMENT_TABLE} BEGIN
+        INSERT INTO {FTS_TABLE} (vendor_id, document) VALUES (new.vendor_id, new.document);
+    END""",
+    f"""CREATE TRIGGER {FTS_TABLE}_update AFTER UPDATE ON {DOCUMENT_TABLE} BEGIN
+        DELETE FROM {FTS_TABLE} WHERE vendor_id = old.vendor_id;
+        INSERT INTO {FTS_TABLE} (vendor_id, document) VALUES (new.vendor_id, new.document);
+    END""",
+    f"""CREATE TRIGGER {FTS_TABLE}_delete AFTER DELETE ON {DOCUMENT_TABLE} BEGIN
+        DELETE FROM {FTS_TABLE} WHERE vendor_id = old.vendor_id;
+    END""",
+]
+
+
+def create_search_indexes(apps, schema_editor):
+    statements = {'postgresql': POSTGRESQL_INDEXES, 'sqlite': SQLITE_INDEXES}.get(schema_editor.connection.vendor, [])
+    for statement in statements:
+        schema_editor.execute(statement)
+
+
+def drop_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS vendor_search_tsv_idx')
+        schema_editor.execute('DROP INDEX IF EXISTS vendor_search_trgm_idx')
+    elif schema_editor.connection.vendor == 'sqlite':
+        for trigger in ('insert', 'update', 'delete'):
+            schema_editor.execute(f'DROP TRIGGER IF EXISTS {FTS_TABLE}_{trigger}')
+        schema_editor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+
+
+def build_search_documents(apps, schema_editor):
+    Vendor = apps.get_model('management', 'Vendor')
+    VendorSearchDocument = apps.get_model('management', 'VendorSearchDocument')
+    documents = []
+    for vendor in Vendor.objects.prefetch_related('products', 'contracts').iterator(chunk_size=500):
+        parts = [vendor.name, vendor.registration_number, vendor.contact_name, vendor.contact_email, vendor.country]
+        parts += [product.name for product in vendor.products.all()]
+        parts += [contract.contract_id for contract in vendor.contracts.all()]
+        documents.append(VendorSearchDocument(vendor_id=vendor.pk, document='\n'.join(part for part in parts if part)))
+    VendorSearchDocument.objects.bulk_create(documents, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('management', '0015_certificateblob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VendorSearchDocument',
+            fields=[
+                ('vendor', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='search_document', serialize=False, to='management.vendor')),
+                ('document', models.TextField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+        migrations.RunPython(build_search_documents, migrations.RunPython.noop),
+    ]
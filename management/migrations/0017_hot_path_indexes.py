@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-17 04:36
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('management', '0016_vendorsearchdocument'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='certification',
+            index=models.Index(fields=['vendor', 'approval_status', 'is_current', 'expiry_date'], name='management__vendor__cc076d_idx'),
+        ),
+        # the composite index leads with vendor_id, so the foreign key's own index goes once it exists
+        migrations.AlterField(
+            model_name='certification',
+            name='vendor',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='certs', to='management.vendor'),
+        ),
+        migrations.AddIndex(
+            model_name='certification',
+            index=models.Index(fields=['expiry_date'], name='management__expiry__6d019c_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='certification',
+            index=models.Index(condition=models.Q(('approval_status', 'pending')), fields=['expiry_date', 'id'], name='cert_pending_queue_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='vendor',
+            index=models.Index(fields=['status'], name='management__status_124d42_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 05:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('management', '0018_taskrun'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='certification',
+            name='processing_attempts',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+    ]
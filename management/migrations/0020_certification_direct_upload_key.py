@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 05:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('management', '0019_certification_processing_attempts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='certification',
+            name='direct_upload_key',
+            field=models.CharField(blank=True, editable=False, max_length=255, null=True, unique=True),
+        ),
+    ]
@@ -1,14 +1,22 @@
-from datetime import date
+from datetime import date, timedelta
 import os
 import uuid
 
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
 from django.db.models import BooleanField, Case, Q, Value, When
 from django.utils import timezone
 
 
+EXPIRY_NOTICE_WINDOWS = (
+    (30, 'notified_30_days'),
+    (15, 'notified_15_days'),
+    (1, 'notified_1_day'),
+)
+
+
 def hashed_upload_path(instance, filename):
     _name, ext = os.path.splitext(filename)
     new_filename = uuid.uuid4().hex
@@ -42,6 +50,9 @@ class Vendor(models.Model):
         ('High', 'High'),
     ]
 
+    # copied into VendorSearchDocument.document
+    SEARCH_FIELDS = ('name', 'registration_number', 'contact_name', 'contact_email', 'country')
+
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     name = models.CharField(max_length=255)
 
@@ -77,30 +88,78 @@ class Vendor(models.Model):
     total_spend = models.DecimalField(max_digits=12, decimal_places=2, default=0.00)
 
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     objects = VendorQuerySet.as_manager()
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at', 'id']),
+            # dashboard status counts and the verified-vendor lapse sweep
+            models.Index(fields=['status']),
+        ]
+
     def clean(self):
         if self.status == 'verified':
             if not self.pk:
                 raise ValidationError('Cannot verify a new vendor. Create, add certs, then verify.')
-            approved_valid_certs = self.certs.filter(
-                expiry_date__gte=date.today(),
-                is_current=True,
-                approval_status='approved',
-            )
-            if not approved_valid_certs.exists():
+            if not self.certs.valid().exists():
                 raise ValidationError('Cannot verify vendor without at least one approved valid certification.')
 
-    def save(self, *args, **kwargs):
-        self.clean()
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # remembered so status and search text changes can be detected without re-reading the row
+        instance._loaded_status = instance.__dict__.get('status')
+        instance._loaded_search_values = instance.search_values()
+        return instance
+
+    def refresh_from_db(self, *args, **kwargs):
+        super().refresh_from_db(*args, **kwargs)
+        if 'status' in self.__dict__:
+            self._loaded_status = self.status
+        self._loaded_search_values = self.search_values()
+
+    def save(self, *args, validate=True, **kwargs):
+        if validate:
+            self.clean()
         super().save(*args, **kwargs)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or 'status' in update_fields:
+            self._loaded_status = self.status
+        self._loaded_search_values = self.search_values()
+
+    def search_values(self):
+        return tuple(self.__dict__.get(name) for name in self.SEARCH_FIELDS)
+
+    def __str__(self):
+        return self.name
+
+
+class CertificateBlobQuerySet(models.QuerySet):
+    def with_ref_count(self):
+        return self.annotate(ref_count=models.Count('certifications'))
+
+
+class CertificateBlob(models.Model):
+    """A stored certification file, shared by every Certification with the same SHA-256."""
+
+    sha256 = models.CharField(max_length=64, unique=True)
+    name = models.CharField(max_length=255)
+    size = models.PositiveBigIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = CertificateBlobQuerySet.as_manager()
 
     def __str__(self):
         return self.name
 
 
 class CertificationQuerySet(models.QuerySet):
+    def valid(self, on_date=None):
+        valid_date = on_date or date.today()
+        return self.filter(expiry_date__gte=valid_date, is_current=True, approval_status='approved')
+
     def for_user(self, user):
         if user.is_superuser or user.is_staff:
             return self
@@ -118,10 +177,23 @@ class Certification(models.Model):
         ('approved', 'Approved'),
         ('rejected', 'Rejected'),
     ]
+    PROCESSING_CHOICES = [
+        ('pending', 'Pending'),
+        ('processing', 'Processing'),
+        ('ready', 'Ready'),
+        ('failed', 'Failed'),
+    ]
 
-    vendor = models.ForeignKey(Vendor, on_delete=models.CASCADE, related_name='certs')
+    vendor = models.ForeignKey(Vendor, on_delete=models.CASCADE, related_name='certs', db_index=False)
     cert_type = models.CharField(max_length=50, choices=CERT_TYPES)
     file = models.FileField(upload_to=hashed_upload_path)
+    blob = models.ForeignKey(
+        CertificateBlob,
+        on_delete=models.PROTECT,
+        null=True,
+        blank=True,
+        related_name='certifications',
+    )
     issue_date = models.DateField()
     expiry_date = models.DateField()
     is_current = models.BooleanField(default=True)
@@ -131,9 +203,30 @@ class Certification(models.Model):
     notified_30_days = models.BooleanField(default=False)
     notified_15_days = models.BooleanField(default=False)
     notified_1_day = models.BooleanField(default=False)
+    # uploads are stored, sniffed and thumbnailed by process_certification_upload
+    processing_status = models.CharField(max_length=20, choices=PROCESSING_CHOICES, default='ready')
+    processing_error = models.CharField(max_length=255, blank=True)
+    upload_spool_path = models.CharField(max_length=500, blank=True)
+    processing_attempts = models.PositiveSmallIntegerField(default=0)
+    # staged key of a direct upload, kept after the file moves so its token cannot be finalized twice
+    direct_upload_key = models.CharField(max_length=255, unique=True, null=True, blank=True, editable=False)
+    content_type = models.CharField(max_length=100, blank=True)
+    page_count = models.PositiveIntegerField(null=True, blank=True)
+    thumbnail = models.FileField(upload_to='cert-thumbnails/', blank=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     objects = CertificationQuerySet.as_manager()
 
+    class Meta:
+        indexes = [
+            # per-vendor validity checks (vendor status refresh, rollups); also serves the vendor foreign key
+            models.Index(fields=['vendor', 'approval_status', 'is_current', 'expiry_date']),
+            # expiry notices and the dashboard's expiring window, which filter on the date first
+            models.Index(fields=['expiry_date']),
+            # the approval queue's keyset order, over the small pending slice only
+            models.Index(fields=['expiry_date', 'id'], condition=Q(approval_status='pending'), name='cert_pending_queue_idx'),
+        ]
+
     def clean(self):
         if self.issue_date and self.expiry_date and self.expiry_date <= self.issue_date:
             raise ValidationError('Expiry date must be in the future relative to issue date.')
@@ -146,10 +239,57 @@ class Certification(models.Model):
     def is_valid(self):
         return self.expiry_date >= date.today() and self.is_current and self.approval_status == 'approved'
 
+    def expiry_schedule(self, today=None):
+        today = today or date.today()
+        if not self.is_current:
+            return []
+        schedule = [
+            (f'notice_{days_remaining}', self.expiry_date - timedelta(days=days_remaining))
+            for days_remaining, flag in EXPIRY_NOTICE_WINDOWS
+            if not getattr(self, flag)
+        ]
+        # certs stay valid through expiry_date, so the lapse is checked the day after
+        schedule.append(('expiry', self.expiry_date + timedelta(days=1)))
+        return [(kind, due_date) for kind, due_date in schedule if due_date >= today]
+
     def __str__(self):
         return f'{self.vendor.name} - {self.cert_type}'
 
 
+class CertificationExpiryEventQuerySet(models.QuerySet):
+    def due(self, on_date=None):
+        due_date = on_date or date.today()
+        return self.filter(due_date__lte=due_date)
+
+
+class CertificationExpiryEvent(models.Model):
+    KIND_CHOICES = [
+        ('notice_30', '30-day notice'),
+        ('notice_15', '15-day notice'),
+        ('notice_1', '1-day notice'),
+        ('expiry', 'Expiry'),
+    ]
+
+    certification = models.ForeignKey(Certification, on_delete=models.CASCADE, related_name='expiry_events')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    due_date = models.DateField()
+
+    objects = CertificationExpiryEventQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['certification', 'kind'], name='uniq_expiry_event_per_cert'),
+        ]
+        indexes = [models.Index(fields=['due_date'])]
+
+    @property
+    def days_before_expiry(self):
+        return int(self.kind.split('_')[1]) if self.kind.startswith('notice_') else None
+
+    def __str__(self):
+        return f'{self.certification_id} {self.kind} on {self.due_date}'
+
+
 class ContractQuerySet(models.QuerySet):
     def active(self, on_date=None):
         active_date = on_date or timezone.now().date()
@@ -178,6 +318,7 @@ class Contract(models.Model):
     total_value = models.DecimalField(max_digits=12, decimal_places=2)
     start_date = models.DateField()
     end_date = models.DateField()
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     objects = ContractQuerySet.as_manager()
 
@@ -227,6 +368,7 @@ class Product(models.Model):
     vendor = models.ForeignKey(Vendor, on_delete=models.CASCADE, related_name='products')
     name = models.CharField(max_length=255)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='active')
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     objects = ProductQuerySet.as_manager()
     active_objects = ActiveProductManager()
@@ -239,6 +381,44 @@ class Product(models.Model):
         return self.name
 
 
+class VendorRollupQuerySet(models.QuerySet):
+    def for_user(self, user):
+        if user.is_superuser or user.is_staff:
+            return self
+        return self.filter(vendor__user=user)
+
+
+class VendorRollup(models.Model):
+    vendor = models.OneToOneField(Vendor, on_delete=models.CASCADE, primary_key=True, related_name='rollup')
+    active_contract_value = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    valid_cert_count = models.PositiveIntegerField(default=0)
+    next_cert_expiry = models.DateField(null=True, blank=True)
+    product_count = models.PositiveIntegerField(default=0)
+    active_product_count = models.PositiveIntegerField(default=0)
+    computed_on = models.DateField(default=date.today)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = VendorRollupQuerySet.as_manager()
+
+    def __str__(self):
+        return f'Rollup for {self.vendor_id} on {self.computed_on}'
+
+
+class VendorSearchDocument(models.Model):
+    """Vendor, product and contract text searched by ``?q=``.
+
+    Indexed outside the ORM (pg_trgm and tsvector GIN indexes on PostgreSQL, an
+    FTS5 table kept in step by triggers on SQLite); see ``management.search``.
+    """
+
+    vendor = models.OneToOneField(Vendor, on_delete=models.CASCADE, primary_key=True, related_name='search_document')
+    document = models.TextField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'Search document for {self.vendor_id}'
+
+
 class VendorHistory(models.Model):
     vendor = models.ForeignKey(Vendor, on_delete=models.CASCADE, related_name='history')
     status = models.CharField(max_length=20)
@@ -247,3 +427,79 @@ class VendorHistory(models.Model):
 
     def __str__(self):
         return f'{self.vendor.name} changed to {self.status} at {self.timestamp}'
+
+
+class ChangeLogEntryQuerySet(models.QuerySet):
+    def for_user(self, user):
+        if user.is_superuser or user.is_staff:
+            return self
+        # mirrors the resources' own scopes: internal reps only see the vendor rows themselves
+        return self.filter(Q(user=user) | Q(resource='vendor', internal_rep=user))
+
+
+class ChangeLogEntry(models.Model):
+    """One row per write to a vendor, certification, contract or product, in commit order by ``id``.
+
+    Owner ids are copied onto the entry so deletes stay visible to the right
+    users after the vendor itself is gone.
+    """
+
+    RESOURCE_CHOICES = [
+        ('vendor', 'Vendor'),
+        ('certification', 'Certification'),
+        ('contract', 'Contract'),
+        ('product', 'Product'),
+    ]
+    ACTION_CHOICES = [
+        ('upsert', 'Upsert'),
+        ('delete', 'Delete'),
+    ]
+
+    resource = models.CharField(max_length=20, choices=RESOURCE_CHOICES)
+    object_id = models.CharField(max_length=36)
+    vendor_id = models.UUIDField()
+    action = models.CharField(max_length=10, choices=ACTION_CHOICES)
+    data = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    internal_rep = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    changed_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    objects = ChangeLogEntryQuerySet.as_manager()
+
+    def __str__(self):
+        return f'#{self.pk} {self.action} {self.resource} {self.object_id}'
+
+
+class TaskRun(models.Model):
+    """One execution of a task in ``management.tasks``, recorded by ``instrumented_task``.
+
+    ``phases`` maps each phase to its ``duration_ms``, ``queries``, ``db_ms`` and
+    counters (``rows_scanned``, ``rows_updated``, ``emails_sent``...); ``counters``
+    holds the totals over the whole run.
+    """
+
+    STATUS_CHOICES = [
+        ('succeeded', 'Succeeded'),
+        ('failed', 'Failed'),
+    ]
+
+    task = models.CharField(max_length=100)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES)
+    # called in-process (no Celery, or called directly) rather than on a worker
+    inline = models.BooleanField(default=False)
+    started_at = models.DateTimeField(default=timezone.now)
+    duration_ms = models.FloatField()
+    queries = models.PositiveIntegerField(default=0)
+    db_ms = models.FloatField(default=0)
+    phases = models.JSONField(default=dict)
+    counters = models.JSONField(default=dict)
+    error = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['task', 'started_at']),
+            models.Index(fields=['started_at']),
+        ]
+
+    def __str__(self):
+        return f'{self.task} {self.status} at {self.started_at}'
@@ -0,0 +1,53 @@
+from collections import defaultdict
+
+from django.core.mail import EmailMessage, get_connection
+
+
+def expiry_notice_recipients(cert):
+    return [email for email in [cert.vendor.contact_email, getattr(cert.vendor.internal_rep, 'email', None)] if email]
+
+
+def build_expiry_digests(notices):
+    """Group (cert, days_remaining) notices into one message payload per recipient.
+
+    Payloads are plain dicts so they can be handed to a Celery worker as-is.
+    """
+    lines_by_recipient = defaultdict(list)
+    for cert, days_remaining in notices:
+        line = (
+            f'Certification {cert.cert_type} for vendor {cert.vendor.name} '
+            f'expires on {cert.expiry_date} ({days_remaining} day(s) remaining).'
+        )
+        for email in expiry_notice_recipients(cert):
+            lines_by_recipient[email].append((days_remaining, line))
+
+    digests = []
+    for email, entries in lines_by_recipient.items():
+        entries.sort(key=lambda entry: entry[0])
+        if len(entries) == 1:
+            subject = f'Certification expiry alert: {entries[0][0]} day(s) remaining'
+        else:
+            subject = f'Certification expiry alert: {len(entries)} certifications expiring soon'
+        body = '\n'.join(line for _days, line in entries)
+        digests.append({
+            'subject': subject,
+            'body': f'{body}\n\nPlease upload and review renewal documents.',
+            'to': [email],
+        })
+    # most urgent digests go out in the first batches
+    digests.sort(key=lambda digest: lines_by_recipient[digest['to'][0]][0][0])
+    return digests
+
+
+def chunked(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def send_message_batch(payloads):
+    connection = get_connection(fail_silently=True)
+    messages = [
+        EmailMessage(subject=payload['subject'], body=payload['body'], to=payload['to'], connection=connection)
+        for payload in payloads
+    ]
+    return connection.send_messages(messages) or 0
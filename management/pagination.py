@@ -0,0 +1,88 @@
+import base64
+import binascii
+import json
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+class KeysetPage:
+    def __init__(self, object_list, next_cursor, cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.cursor = cursor
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+class KeysetPaginator:
+    """Seek-based pagination over a unique ordering such as ``('-created_at', '-id')``.
+
+    Each page is a range scan starting after the last row of the previous page,
+    so its cost does not depend on how deep the client has paged. Cursors are
+    opaque URL-safe tokens holding the ordering values of that last row.
+    """
+
+    def __init__(self, ordering, page_size):
+        self.ordering = tuple(ordering)
+        self.page_size = page_size
+
+    def _fields(self):
+        return [(name.lstrip('-'), name.startswith('-')) for name in self.ordering]
+
+    def encode_cursor(self, obj):
+        values = [str(getattr(obj, name)) for name, _descending in self._fields()]
+        return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip('=')
+
+    def decode_cursor(self, model, cursor):
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            raw_values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+            fields = self._fields()
+            if not isinstance(raw_values, list) or len(raw_values) != len(fields):
+                raise InvalidCursor('Cursor does not match the ordering.')
+            # encode_cursor only writes strings; anything else would reach to_python unchecked
+            if not all(isinstance(value, str) for value in raw_values):
+                raise InvalidCursor('Invalid cursor.')
+            return [
+                model._meta.get_field(name).to_python(value)
+                for (name, _descending), value in zip(fields, raw_values)
+            ]
+        except (binascii.Error, UnicodeDecodeError, json.JSONDecodeError, FieldDoesNotExist, ValidationError) as exc:
+            raise InvalidCursor('Invalid cursor.') from exc
+
+    def _seek(self, values):
+        # (a, b) after (x, y) in ordering terms: a > x OR (a = x AND b > y)
+        condition = Q()
+        equal_prefix = {}
+        for (name, descending), value in zip(self._fields(), values):
+            lookup = 'lt' if descending else 'gt'
+            condition |= Q(**equal_prefix, **{f'{name}__{lookup}': value})
+            equal_prefix[name] = value
+        return condition
+
+    def paginate(self, queryset, cursor=None):
+        queryset = queryset.order_by(*self.ordering)
+        if cursor:
+            queryset = queryset.filter(self._seek(self.decode_cursor(queryset.model, cursor)))
+
+        rows = list(queryset[:self.page_size + 1])
+        next_cursor = self.encode_cursor(rows[self.page_size - 1]) if len(rows) > self.page_size else None
+        return KeysetPage(rows[:self.page_size], next_cursor, cursor or None)
@@ -0,0 +1,39 @@
+from django.db import transaction
+from django.utils import timezone
+
+from .changes import record_changes
+from .dashboard import invalidate_dashboard_metrics
+from .models import Certification, Vendor
+from .signals import coalesce_vendor_refreshes, queue_vendor_refresh
+
+REVIEW_DECISIONS = {'approve': 'approved', 'reject': 'rejected'}
+
+
+def reviewable_certifications():
+    return Certification.objects.filter(approval_status='pending', processing_status='ready')
+
+
+def review_certifications(cert_ids, decision, user):
+    """Approve or reject the reviewable certifications in ``cert_ids`` with a single UPDATE.
+
+    Returns how many were reviewed. ``.update()`` skips the post_save receivers,
+    so the change log, dashboards and vendor refreshes are handled here, with
+    each affected vendor refreshed once on commit. Expiry events are left alone:
+    the schedule does not depend on the approval status.
+    """
+    now = timezone.now()
+    with transaction.atomic(), coalesce_vendor_refreshes():
+        rows = list(reviewable_certifications().filter(pk__in=cert_ids).select_for_update().values_list('pk', 'vendor_id'))
+        if not rows:
+            return 0
+        reviewed_ids = [pk for pk, _vendor_id in rows]
+        vendor_ids = {vendor_id for _pk, vendor_id in rows}
+
+        Certification.objects.filter(pk__in=reviewed_ids).update(
+            approval_status=REVIEW_DECISIONS[decision], reviewed_by=user, reviewed_at=now, updated_at=now
+        )
+        record_changes(Certification.objects.filter(pk__in=reviewed_ids))
+        invalidate_dashboard_metrics(Vendor.objects.filter(pk__in=vendor_ids).values_list('user_id', flat=True))
+        for vendor_id in vendor_ids:
+            queue_vendor_refresh(vendor_id)
+    return len(rows)
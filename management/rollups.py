@@ -0,0 +1,122 @@
+from django.db.models import Count, DateField, DecimalField, Exists, IntegerField, Min, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .dashboard import invalidate_dashboard_metrics
+from .models import Certification, Contract, Product, Vendor, VendorRollup
+
+ROLLUP_BATCH_SIZE = 500
+ROLLUP_UPDATE_FIELDS = [
+    'active_contract_value',
+    'valid_cert_count',
+    'next_cert_expiry',
+    'product_count',
+    'active_product_count',
+    'computed_on',
+    'updated_at',
+]
+
+MONEY = DecimalField(max_digits=14, decimal_places=2)
+
+
+def _per_vendor(queryset, aggregate, output_field):
+    return Subquery(
+        queryset.filter(vendor=OuterRef('pk')).order_by().values('vendor').annotate(value=aggregate).values('value'),
+        output_field=output_field,
+    )
+
+
+def _rollup_rows(vendors, today):
+    valid_certs = Certification.objects.valid(on_date=today)
+    return vendors.order_by().annotate(
+        rollup_active_contract_value=Coalesce(
+            _per_vendor(Contract.objects.active(on_date=today), Sum('total_value'), MONEY), 0, output_field=MONEY
+        ),
+        rollup_total_spend=Coalesce(_per_vendor(Contract.objects.all(), Sum('total_value'), MONEY), 0, output_field=MONEY),
+        rollup_valid_cert_count=Coalesce(_per_vendor(valid_certs, Count('pk'), IntegerField()), 0),
+        rollup_next_cert_expiry=_per_vendor(valid_certs, Min('expiry_date'), DateField()),
+        rollup_product_count=Coalesce(_per_vendor(Product.objects.all(), Count('pk'), IntegerField()), 0),
+        rollup_active_product_count=Coalesce(
+            _per_vendor(Product.objects.filter(status='active'), Count('pk'), IntegerField()), 0
+        ),
+    ).values_list(
+        'pk',
+        'total_spend',
+        'rollup_active_contract_value',
+        'rollup_total_spend',
+        'rollup_valid_cert_count',
+        'rollup_next_cert_expiry',
+        'rollup_product_count',
+        'rollup_active_product_count',
+    )
+
+
+def _write_batch(rows, today):
+    now = timezone.now()
+    rollups = []
+    spend_changes = []
+    for pk, stored_spend, active_value, total_spend, valid_certs, next_expiry, products, active_products in rows:
+        rollups.append(VendorRollup(
+            vendor_id=pk,
+            active_contract_value=active_value,
+            valid_cert_count=valid_certs,
+            next_cert_expiry=next_expiry,
+            product_count=products,
+            active_product_count=active_products,
+            computed_on=today,
+            updated_at=now,
+        ))
+        if stored_spend != total_spend:
+            spend_changes.append(Vendor(pk=pk, total_spend=total_spend))
+
+    VendorRollup.objects.bulk_create(
+        rollups,
+        update_conflicts=True,
+        unique_fields=['vendor'],
+        update_fields=ROLLUP_UPDATE_FIELDS,
+    )
+    if spend_changes:
+        # Vendor.total_spend is the lifetime contract value, kept in step with the rollup
+        Vendor.objects.bulk_update(spend_changes, ['total_spend'])
+
+
+def refresh_vendor_rollups(vendor_ids=None, today=None):
+    """Recompute rollups (and ``Vendor.total_spend``) for ``vendor_ids``, or every vendor when omitted.
+
+    The owners' dashboards read product counts and spend from the rollups, so
+    they are invalidated once the new values are written.
+    """
+    today = today or timezone.now().date()
+    if vendor_ids is None:
+        vendor_ids = Vendor.objects.order_by('pk').values_list('pk', flat=True)
+    vendor_ids = list(vendor_ids)
+
+    for start in range(0, len(vendor_ids), ROLLUP_BATCH_SIZE):
+        batch = vendor_ids[start:start + ROLLUP_BATCH_SIZE]
+        _write_batch(list(_rollup_rows(Vendor.objects.filter(pk__in=batch), today)), today)
+        invalidate_dashboard_metrics(Vendor.objects.filter(pk__in=batch).values_list('user_id', flat=True))
+    return len(vendor_ids)
+
+
+def stale_rollup_vendor_ids(today=None):
+    """Vendors whose date-dependent rollup values may have changed since they were computed.
+
+    A rollup goes stale without any write when a contract starts or ends, or a
+    valid cert lapses, between its ``computed_on`` date and today.
+    """
+    today = today or timezone.now().date()
+    computed_on = OuterRef('computed_on')
+    contract_boundary = Contract.objects.filter(vendor=OuterRef('vendor')).filter(
+        Q(start_date__gt=computed_on, start_date__lte=today)
+        | Q(end_date__gte=computed_on, end_date__lt=today)
+    )
+    cert_lapse = Certification.objects.filter(
+        vendor=OuterRef('vendor'),
+        expiry_date__gte=computed_on,
+        expiry_date__lt=today,
+    )
+    return (
+        VendorRollup.objects.filter(computed_on__lt=today)
+        .filter(Exists(contract_boundary) | Exists(cert_lapse))
+        .values_list('vendor_id', flat=True)
+    )
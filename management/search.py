@@ -0,0 +1,123 @@
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Case, IntegerField, Q, Value, When
+
+from .models import Contract, Product, Vendor, VendorSearchDocument
+
+SEARCH_BATCH_SIZE = 500
+# created by migration 0016 on SQLite and synced from VendorSearchDocument by triggers
+FTS_TABLE = 'management_vendorsearch_fts'
+# the FTS5 trigram tokenizer cannot match anything shorter
+MIN_TRIGRAM_TERM = 3
+
+
+def document_text(parts):
+    return '\n'.join(part for part in parts if part)
+
+
+def _document_batch(vendor_ids):
+    products = defaultdict(list)
+    for vendor_id, name in Product.objects.filter(vendor_id__in=vendor_ids).values_list('vendor_id', 'name'):
+        products[vendor_id].append(name)
+    contracts = defaultdict(list)
+    for vendor_id, contract_id in Contract.objects.filter(vendor_id__in=vendor_ids).values_list('vendor_id', 'contract_id'):
+        contracts[vendor_id].append(contract_id)
+
+    return [
+        VendorSearchDocument(vendor_id=pk, document=document_text([*fields, *products[pk], *contracts[pk]]))
+        for pk, *fields in Vendor.objects.filter(pk__in=vendor_ids).values_list('pk', *Vendor.SEARCH_FIELDS)
+    ]
+
+
+def refresh_search_documents(vendor_ids=None):
+    """Rebuild the search documents of ``vendor_ids`` (every vendor when ``None``) in batches."""
+    if vendor_ids is None:
+        vendor_ids = Vendor.objects.order_by('pk').values_list('pk', flat=True)
+    vendor_ids = list(vendor_ids)
+
+    refreshed = 0
+    for start in range(0, len(vendor_ids), SEARCH_BATCH_SIZE):
+        documents = _document_batch(vendor_ids[start:start + SEARCH_BATCH_SIZE])
+        VendorSearchDocument.objects.bulk_create(
+            documents, update_conflicts=True, unique_fields=['vendor'], update_fields=['document', 'updated_at']
+        )
+        refreshed += len(documents)
+    return refreshed
+
+
+def _like_pattern(term):
+    escaped = term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f'%{escaped}%'
+
+
+def _postgresql_match(query):
+    # tsvector for whole words, trigram word similarity for typos, ILIKE (trigram-indexed) for fragments of IDs
+    vector = "to_tsvector('simple', d.document)"
+    tsquery = "plainto_tsquery('simple', %s)"
+    where = f"({vector} @@ {tsquery} OR %s <%% d.document OR d.document ILIKE %s)"
+    rank = f"ts_rank({vector}, {tsquery}) + word_similarity(%s, d.document)"
+    return (
+        f'SELECT d.vendor_id FROM {VendorSearchDocument._meta.db_table} d WHERE {where}',
+        [query, query, _like_pattern(query)],
+        rank,
+        [query, query],
+    )
+
+
+def _sqlite_match(query):
+    terms = [term for term in query.split() if len(term) >= MIN_TRIGRAM_TERM]
+    if not terms:
+        return (
+            f"SELECT d.vendor_id FROM {FTS_TABLE} d WHERE d.document LIKE %s ESCAPE '\\'",
+            [_like_pattern(query)],
+            'd.vendor_id',
+            [],
+        )
+    # every term as a quoted substring phrase, so user input is never parsed as FTS5 syntax
+    expression = ' '.join('"{}"'.format(term.replace('"', '""')) for term in terms)
+    # terms too short for the trigram index still have to match, checked on the FTS hits
+    short_terms = [term for term in query.split() if len(term) < MIN_TRIGRAM_TERM]
+    where = " AND d.document LIKE %s ESCAPE '\\'" * len(short_terms)
+    return (
+        f'SELECT d.vendor_id FROM {FTS_TABLE} d WHERE {FTS_TABLE} MATCH %s{where}',
+        [expression, *map(_like_pattern, short_terms)],
+        'd.rank',
+        [],
+    )
+
+
+def ranked_vendor_ids(queryset, query, limit):
+    """Primary keys of the best ``limit`` vendors in ``queryset`` matching ``query``, best first."""
+    if connection.vendor == 'postgresql':
+        match_sql, match_params, rank_sql, rank_params = _postgresql_match(query)
+        descending = True
+    elif connection.vendor == 'sqlite':
+        match_sql, match_params, rank_sql, rank_params = _sqlite_match(query)
+        descending = False
+    else:
+        terms = Q(*[Q(search_document__document__icontains=term) for term in query.split()])
+        return list(queryset.filter(terms).order_by('name', 'pk').values_list('pk', flat=True)[:limit])
+
+    # the scope goes into the same statement so the limit applies after it
+    scope_sql, scope_params = queryset.order_by().values('pk').query.sql_with_params()
+    sql = (
+        f'{match_sql} AND d.vendor_id IN ({scope_sql}) '
+        f'ORDER BY {rank_sql} {"DESC" if descending else "ASC"}, d.vendor_id LIMIT %s'
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [*match_params, *scope_params, *rank_params, limit])
+        rows = cursor.fetchall()
+    pk_field = Vendor._meta.pk
+    return [pk_field.to_python(vendor_id) for vendor_id, in rows]
+
+
+def search_vendors(queryset, query, limit=None):
+    """``queryset`` narrowed to the best matches for ``query``, annotated with ``search_rank`` and ordered by it."""
+    limit = limit or settings.SEARCH_RESULT_LIMIT
+    vendor_ids = ranked_vendor_ids(queryset, query.strip(), limit)
+    if not vendor_ids:
+        return queryset.none()
+    position = Case(*[When(pk=pk, then=Value(index)) for index, pk in enumerate(vendor_ids)], output_field=IntegerField())
+    return queryset.filter(pk__in=vendor_ids).annotate(search_rank=position).order_by('search_rank')
@@ -1,27 +1,129 @@
+from django.db.models import Prefetch
 from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
 
-from .models import Certification, Contract, Product, Vendor
+from .models import Certification, ChangeLogEntry, Contract, Product, Vendor
 
 
-class VendorSerializer(serializers.ModelSerializer):
+def _query_param_set(request, name):
+    raw = request.query_params.get(name, '') if request is not None else ''
+    return {value.strip() for value in raw.split(',') if value.strip()}
+
+
+class DynamicFieldsModelSerializer(serializers.ModelSerializer):
+    """Model serializer honouring ``?fields=`` sparse fieldsets and ``?expand=`` relations.
+
+    ``expandable_fields`` maps a query-string name to ``(serializer class, relation)``.
+    Only the top-level serializer (the one given the request context) reads the
+    query string; nested serializers render their full field list. Writes ignore
+    both, since an expanded relation is read-only and would drop its key.
+    """
+
+    expandable_fields = {}
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self._context.get('request')
+        if request is None or request.method not in SAFE_METHODS:
+            return
+
+        fields, expand = self.requested(request)
+        for name in expand:
+            serializer_class, relation = self.expandable_fields[name]
+            many = not self.Meta.model._meta.get_field(relation).many_to_one
+            source = {} if relation == name else {'source': relation}
+            self.fields[name] = serializer_class(many=many, read_only=True, **source)
+        if fields:
+            for name in set(self.fields) - fields - expand:
+                self.fields.pop(name)
+
+    @classmethod
+    def requested(cls, request):
+        fields = _query_param_set(request, 'fields') & set(cls.Meta.fields)
+        expand = _query_param_set(request, 'expand') & set(cls.expandable_fields)
+        return fields, expand
+
+    @classmethod
+    def optimize_queryset(cls, queryset, request, extra_columns=()):
+        """Narrow the SELECT to the requested columns and prefetch each expanded relation once."""
+        fields, expand = cls.requested(request)
+        model = cls.Meta.model
+        concrete = {field.name for field in model._meta.concrete_fields}
+        columns = {name for name in (fields or cls.Meta.fields) if name in concrete}
+        columns.update(extra_columns)
+        # forward relations need their key column loaded for the prefetch to match rows up
+        columns.update(cls.expandable_fields[name][1] for name in expand if cls.expandable_fields[name][1] in concrete)
+        queryset = queryset.only(model._meta.pk.name, *sorted(columns))
+
+        for name in sorted(expand):
+            serializer_class, relation = cls.expandable_fields[name]
+            queryset = queryset.prefetch_related(
+                Prefetch(relation, queryset=serializer_class.Meta.model.objects.only(*serializer_class.Meta.fields))
+            )
+        return queryset
+
+
+class VendorSerializer(DynamicFieldsModelSerializer):
     class Meta:
         model = Vendor
         fields = ['id', 'name', 'status', 'contact_name', 'contact_email', 'contact_phone', 'website']
 
 
-class ProductSerializer(serializers.ModelSerializer):
+class ProductSerializer(DynamicFieldsModelSerializer):
+    expandable_fields = {'vendor': (VendorSerializer, 'vendor')}
+
     class Meta:
         model = Product
         fields = ['id', 'vendor', 'name', 'status']
 
 
-class CertificationSerializer(serializers.ModelSerializer):
+class CertificationSerializer(DynamicFieldsModelSerializer):
+    expandable_fields = {'vendor': (VendorSerializer, 'vendor')}
+
     class Meta:
         model = Certification
         fields = ['id', 'vendor', 'cert_type', 'issue_date', 'expiry_date', 'is_current', 'approval_status']
 
 
-class ContractSerializer(serializers.ModelSerializer):
+class ContractSerializer(DynamicFieldsModelSerializer):
+    expandable_fields = {'vendor': (VendorSerializer, 'vendor')}
+
     class Meta:
         model = Contract
         fields = ['id', 'vendor', 'contract_id', 'total_value', 'start_date', 'end_date']
+
+
+VendorSerializer.expandable_fields = {
+    'certs': (CertificationSerializer, 'certs'),
+    'contracts': (ContractSerializer, 'contracts'),
+    'products': (ProductSerializer, 'products'),
+}
+
+
+class ContractBulkSerializer(serializers.ModelSerializer):
+    # vendor ids are checked for the whole batch in one query instead of one lookup per row
+    vendor = serializers.UUIDField(source='vendor_id')
+
+    class Meta:
+        model = Contract
+        fields = ['vendor', 'contract_id', 'total_value', 'start_date', 'end_date']
+        validators = []
+
+
+class ProductBulkSerializer(serializers.ModelSerializer):
+    id = serializers.UUIDField(required=False)
+    vendor = serializers.UUIDField(source='vendor_id')
+
+    class Meta:
+        model = Product
+        fields = ['id', 'vendor', 'name', 'status']
+        validators = []
+
+
+class ChangeLogEntrySerializer(serializers.ModelSerializer):
+    seq = serializers.IntegerField(source='pk')
+    vendor = serializers.UUIDField(source='vendor_id')
+
+    class Meta:
+        model = ChangeLogEntry
+        fields = ['seq', 'resource', 'object_id', 'vendor', 'action', 'data', 'changed_at']
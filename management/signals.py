@@ -1,51 +1,254 @@
-from datetime import date
+from contextlib import contextmanager
+from functools import partial
+import threading
 
-from django.db.models.signals import post_delete, post_save, pre_save
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
 from django.dispatch import receiver
 
-from .models import Certification, Vendor, VendorHistory
+from .blobs import release_blobs
+from .changes import change_entries, record_changes
+from .dashboard import invalidate_dashboard_metrics
+from .models import Certification, CertificationExpiryEvent, ChangeLogEntry, Contract, Product, Vendor, VendorHistory, VendorRollup
+from .rollups import refresh_vendor_rollups
+from .search import refresh_search_documents
 
+SCHEDULE_FIELDS = {'expiry_date', 'is_current', 'approval_status'}
 
-def _refresh_vendor_status(vendor):
-    approved_valid_certs = vendor.certs.filter(
-        expiry_date__gte=date.today(),
-        is_current=True,
-        approval_status='approved',
-    )
-    pending_review = vendor.certs.filter(approval_status='pending').exists()
+_deferred = threading.local()
 
-    if approved_valid_certs.exists() and vendor.status != 'verified':
+
+def _refresh_vendor_status(vendor_id):
+    vendor = Vendor.objects.annotate(
+        has_valid_cert=Exists(Certification.objects.valid().filter(vendor=OuterRef('pk'))),
+        has_pending_cert=Exists(Certification.objects.filter(vendor=OuterRef('pk'), approval_status='pending')),
+    ).filter(pk=vendor_id).first()
+    if vendor is None:
+        return
+
+    # the annotations already answer Vendor.clean()'s question, so skip re-validating
+    if vendor.has_valid_cert and vendor.status != 'verified':
         vendor.status = 'verified'
-        vendor.save()
-    elif vendor.status == 'verified' and not approved_valid_certs.exists():
+        vendor.save(update_fields=['status', 'updated_at'], validate=False)
+    elif vendor.status == 'verified' and not vendor.has_valid_cert:
         vendor.status = 'inactive'
         vendor.risk_tier = 'High'
-        vendor.save()
-    elif not approved_valid_certs.exists() and pending_review and vendor.status not in {'under_review', 'inactive'}:
+        vendor.save(update_fields=['status', 'risk_tier', 'updated_at'], validate=False)
+    elif not vendor.has_valid_cert and vendor.has_pending_cert and vendor.status not in {'under_review', 'inactive'}:
         vendor.status = 'under_review'
-        vendor.save()
+        vendor.save(update_fields=['status', 'updated_at'], validate=False)
+
+
+def refresh_vendors(status_ids=(), rollup_ids=(), search_ids=()):
+    if status_ids:
+        # status flips after bulk writes insert their history and change-log rows together
+        with batch_vendor_history():
+            for vendor_id in status_ids:
+                _refresh_vendor_status(vendor_id)
+    if rollup_ids:
+        refresh_vendor_rollups(rollup_ids)
+    if search_ids:
+        refresh_search_documents(search_ids)
+
+
+def queue_vendor_refresh(vendor_id, status=True, rollup=True, search=False):
+    pending = getattr(_deferred, 'vendors', None)
+    if pending is None:
+        refresh_vendors([vendor_id] if status else (), [vendor_id] if rollup else (), [vendor_id] if search else ())
+        return
+    if status:
+        pending['status'].add(vendor_id)
+    if rollup:
+        pending['rollup'].add(vendor_id)
+    if search:
+        pending['search'].add(vendor_id)
+
+
+@contextmanager
+def coalesce_vendor_refreshes():
+    """Collect vendor status, rollup and search refreshes inside the block and run each vendor's once on commit."""
+    if getattr(_deferred, 'vendors', None) is not None:
+        yield
+        return
+
+    _deferred.vendors = {'status': set(), 'rollup': set(), 'search': set()}
+    try:
+        yield
+    finally:
+        pending, _deferred.vendors = _deferred.vendors, None
+        if any(pending.values()):
+            transaction.on_commit(partial(refresh_vendors, pending['status'], pending['rollup'], pending['search']))
+
+
+def _cascading_from_vendor(kwargs):
+    # children deleted along with their vendor have nothing left to refresh
+    return isinstance(kwargs.get('origin'), Vendor)
 
 
 @receiver(post_save, sender=Certification)
 @receiver(post_delete, sender=Certification)
 def update_vendor_status(sender, instance, **kwargs):
-    _refresh_vendor_status(instance.vendor)
+    if not _cascading_from_vendor(kwargs):
+        queue_vendor_refresh(instance.vendor_id)
+
+
+@receiver(post_save, sender=Contract)
+@receiver(post_delete, sender=Contract)
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def update_vendor_rollup(sender, instance, **kwargs):
+    if not _cascading_from_vendor(kwargs):
+        queue_vendor_refresh(instance.vendor_id, status=False, search=True)
+
+
+@receiver(post_save, sender=Vendor)
+def update_vendor_search_document(sender, instance, created, update_fields=None, **kwargs):
+    if update_fields is not None and not set(Vendor.SEARCH_FIELDS).intersection(update_fields):
+        return
+    # status-only saves are the common case and leave the document as it was
+    if not created and getattr(instance, '_loaded_search_values', None) == instance.search_values():
+        return
+    queue_vendor_refresh(instance.pk, status=False, rollup=False, search=True)
+
+
+@receiver(post_delete, sender=Certification)
+def release_certification_blob(sender, instance, **kwargs):
+    if instance.blob_id:
+        # the blob goes once the deleting transaction commits, if no other certification shares it
+        transaction.on_commit(partial(release_blobs, [instance.blob_id]))
+
+
+@receiver(post_save, sender=Certification)
+def schedule_certification_expiry_events(sender, instance, created, update_fields=None, **kwargs):
+    if update_fields is not None and not SCHEDULE_FIELDS.intersection(update_fields):
+        return
+    if not created:
+        instance.expiry_events.all().delete()
+    CertificationExpiryEvent.objects.bulk_create([
+        CertificationExpiryEvent(certification=instance, kind=kind, due_date=due_date)
+        for kind, due_date in instance.expiry_schedule()
+    ])
+
+
+def _record_vendor_history(vendor, status, user):
+    record = VendorHistory(vendor=vendor, status=status, changed_by=user)
+    pending = getattr(_deferred, 'history', None)
+    if pending is None:
+        record.save()
+    else:
+        pending.append(record)
+
+
+def _record_changes(instance, action):
+    pending = getattr(_deferred, 'changes', None)
+    if pending is None:
+        record_changes([instance], action)
+    else:
+        pending.extend(change_entries([instance], action))
+
+
+@contextmanager
+def batch_vendor_history():
+    """Run the block in a transaction and bulk-create its VendorHistory and change-log rows before commit."""
+    if getattr(_deferred, 'history', None) is not None:
+        yield
+        return
+
+    _deferred.history = []
+    _deferred.changes = []
+    try:
+        with transaction.atomic():
+            yield
+            VendorHistory.objects.bulk_create(_deferred.history, batch_size=1000)
+            ChangeLogEntry.objects.bulk_create(_deferred.changes, batch_size=1000)
+    finally:
+        _deferred.history = None
+        _deferred.changes = None
 
 
 @receiver(pre_save, sender=Vendor)
-def track_vendor_status_change(sender, instance, **kwargs):
-    if instance.pk:
-        try:
-            old_instance = Vendor.objects.get(pk=instance.pk)
-            if old_instance.status != instance.status:
-                user = getattr(instance, '_current_user', None)
-                VendorHistory.objects.create(vendor=instance, status=instance.status, changed_by=user)
-        except Vendor.DoesNotExist:
-            pass
+def track_vendor_status_change(sender, instance, update_fields=None, **kwargs):
+    if instance._state.adding:
+        return
+    if update_fields is not None and 'status' not in update_fields:
+        return
+
+    previous_status = getattr(instance, '_loaded_status', None)
+    if previous_status is None:
+        previous_status = Vendor.objects.filter(pk=instance.pk).values_list('status', flat=True).first()
+    if previous_status is not None and previous_status != instance.status:
+        _record_vendor_history(instance, instance.status, getattr(instance, '_current_user', None))
 
 
 @receiver(post_save, sender=Vendor)
 def track_vendor_creation(sender, instance, created, **kwargs):
     if created:
-        user = getattr(instance, '_current_user', None)
-        VendorHistory.objects.create(vendor=instance, status=instance.status, changed_by=user)
+        _record_vendor_history(instance, instance.status, getattr(instance, '_current_user', None))
+
+
+@receiver(post_save, sender=Vendor)
+def create_vendor_rollup(sender, instance, created, **kwargs):
+    if created:
+        VendorRollup.objects.create(vendor=instance)
+
+
+@receiver(post_save, sender=Vendor)
+@receiver(post_save, sender=Certification)
+@receiver(post_save, sender=Contract)
+@receiver(post_save, sender=Product)
+def record_saved_change(sender, instance, **kwargs):
+    _record_changes(instance, 'upsert')
+
+
+@receiver(pre_delete, sender=Vendor)
+def collect_cascaded_changes(sender, instance, origin=None, **kwargs):
+    if origin is instance:
+        _deferred.cascade = []
+
+
+@receiver(post_delete, sender=Vendor)
+@receiver(post_delete, sender=Certification)
+@receiver(post_delete, sender=Contract)
+@receiver(post_delete, sender=Product)
+def record_deleted_change(sender, instance, **kwargs):
+    cascade = getattr(_deferred, 'cascade', None)
+    if cascade is None or not _cascading_from_vendor(kwargs):
+        _record_changes(instance, 'delete')
+        return
+
+    # children are deleted before their vendor, so the vendor's entry closes the batch
+    vendor = kwargs['origin']
+    cascade.extend(change_entries([instance], 'delete', owners={vendor.pk: (vendor.user_id, vendor.internal_rep_id)}))
+    if instance is not vendor:
+        return
+    _deferred.cascade = None
+    pending = getattr(_deferred, 'changes', None)
+    if pending is None:
+        ChangeLogEntry.objects.bulk_create(cascade, batch_size=1000)
+    else:
+        pending.extend(cascade)
+
+
+@receiver(post_save, sender=Vendor)
+@receiver(post_delete, sender=Vendor)
+def invalidate_vendor_dashboards(sender, instance, **kwargs):
+    invalidate_dashboard_metrics([instance.user_id, instance.internal_rep_id])
+
+
+@receiver(post_save, sender=Certification)
+@receiver(post_delete, sender=Certification)
+@receiver(post_save, sender=Contract)
+@receiver(post_delete, sender=Contract)
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_vendor_owner_dashboards(sender, instance, **kwargs):
+    # the vendor's own delete invalidates the same owner
+    if _cascading_from_vendor(kwargs):
+        return
+    # certs, contracts and products are scoped to the vendor's own user only
+    if sender.vendor.is_cached(instance):
+        owner_id = instance.vendor.user_id
+    else:
+        owner_id = Vendor.objects.filter(pk=instance.vendor_id).values_list('user_id', flat=True).first()
+    invalidate_dashboard_metrics([owner_id])
@@ -1,59 +1,348 @@
-from datetime import date
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, suppress
+from datetime import date, timedelta
+import os
+import time
+import uuid
 
 try:
     from celery import shared_task
 except ModuleNotFoundError:
-    def shared_task(func):
-        return func
-from django.core.mail import send_mail
+    def shared_task(*args, **options):
+        # without Celery a task is a plain function and its retry options do not apply
+        return args[0] if args else (lambda func: func)
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.db.models import Exists, F, OuterRef
+from django.utils import timezone
 
-from .models import Certification, Vendor
+from .blobs import (
+    CLAIMED_UPLOAD_PREFIX,
+    adopt_blob,
+    claim_direct_upload,
+    delete_unreferenced_file,
+    orphan_blob_ids,
+    release_blobs,
+    store_blob,
+)
+from .changes import delete_expired_changes, record_changes
+from .dashboard import invalidate_dashboard_metrics
+from .instrumentation import instrumented_task, task_count, task_phase
+from .models import (
+    EXPIRY_NOTICE_WINDOWS,
+    Certification,
+    CertificationExpiryEvent,
+    TaskRun,
+    Vendor,
+    VendorHistory,
+    VendorRollup,
+)
+from .notifications import build_expiry_digests, chunked, send_message_batch
+from .rollups import refresh_vendor_rollups, stale_rollup_vendor_ids
+from .uploads import UnsupportedUpload, count_pages, render_thumbnail, sniff_content_type
+
+
+@contextmanager
+def _phase(summary, name):
+    started = time.monotonic()
+    with task_phase(name):
+        yield
+    summary['timings'][name] = time.monotonic() - started
 
 
 @shared_task
+@instrumented_task
 def run_daily_certification_checks():
     today = date.today()
+    summary = {'notified': {}, 'emails_sent': 0, 'vendors_inactivated': 0, 'timings': {}}
 
-    for cert in Certification.objects.select_related('vendor', 'vendor__internal_rep').filter(is_current=True):
-        days_until_expiry = (cert.expiry_date - today).days
-        recipients = [email for email in [cert.vendor.contact_email, getattr(cert.vendor.internal_rep, 'email', None)] if email]
-
-        if days_until_expiry == 30 and not cert.notified_30_days:
-            _send_expiry_notice(cert, recipients, 30)
-            cert.notified_30_days = True
-            cert.save(update_fields=['notified_30_days'])
-        elif days_until_expiry == 15 and not cert.notified_15_days:
-            _send_expiry_notice(cert, recipients, 15)
-            cert.notified_15_days = True
-            cert.save(update_fields=['notified_15_days'])
-        elif days_until_expiry == 1 and not cert.notified_1_day:
-            _send_expiry_notice(cert, recipients, 1)
-            cert.notified_1_day = True
-            cert.save(update_fields=['notified_1_day'])
+    notices = []
+    for days_remaining, flag in EXPIRY_NOTICE_WINDOWS:
+        with _phase(summary, flag):
+            due = _collect_expiring_certs(today, days_remaining, flag)
+        notices.extend((cert, days_remaining) for cert in due)
+        summary['notified'][flag] = len(due)
 
-    # auto-inactivate verified vendors with no approved, unexpired certs
-    verified_vendors = Vendor.objects.filter(status='verified')
-    for vendor in verified_vendors:
-        has_approved_valid = vendor.certs.filter(
-            expiry_date__gte=today,
+    with _phase(summary, 'deliver_notices'):
+        summary['emails_sent'] = deliver_expiry_notices(notices)
+
+    with _phase(summary, 'inactivate_vendors'):
+        summary['vendors_inactivated'] = _inactivate_lapsed_vendors(today)
+    return summary
+
+
+@shared_task
+@instrumented_task
+def process_due_certification_events():
+    today = date.today()
+    flags = {f'notice_{days_remaining}': flag for days_remaining, flag in EXPIRY_NOTICE_WINDOWS}
+    summary = {'events': 0, 'notified': {}, 'emails_sent': 0, 'vendors_inactivated': 0, 'timings': {}}
+
+    notices = []
+    notified_ids = {flag: [] for flag in flags.values()}
+    lapsed_vendor_ids = set()
+    with _phase(summary, 'pop_events'), transaction.atomic():
+        events = list(
+            CertificationExpiryEvent.objects.due(on_date=today)
+            .select_for_update()
+            .select_related('certification__vendor__internal_rep')
+        )
+        for event in events:
+            cert = event.certification
+            if event.kind == 'expiry':
+                lapsed_vendor_ids.add(cert.vendor_id)
+                continue
+            flag = flags[event.kind]
+            # late events (e.g. after an outage) still notify as long as the cert has not lapsed
+            if cert.is_current and not getattr(cert, flag) and cert.expiry_date >= today:
+                notices.append((cert, (cert.expiry_date - today).days))
+                notified_ids[flag].append(cert.pk)
+        task_count('rows_scanned', len(events))
+        for flag, cert_ids in notified_ids.items():
+            if cert_ids:
+                task_count('rows_updated', Certification.objects.filter(pk__in=cert_ids).update(**{flag: True}))
+            summary['notified'][flag] = len(cert_ids)
+        deleted, _by_model = CertificationExpiryEvent.objects.filter(pk__in=[event.pk for event in events]).delete()
+        task_count('rows_deleted', deleted)
+    summary['events'] = len(events)
+
+    with _phase(summary, 'deliver_notices'):
+        summary['emails_sent'] = deliver_expiry_notices(notices)
+
+    with _phase(summary, 'inactivate_vendors'):
+        if lapsed_vendor_ids:
+            summary['vendors_inactivated'] = _inactivate_lapsed_vendors(today, vendor_ids=lapsed_vendor_ids)
+    return summary
+
+
+@shared_task
+@instrumented_task
+def refresh_stale_vendor_rollups():
+    today = date.today()
+    with task_phase('find_stale'):
+        vendor_ids = list(stale_rollup_vendor_ids(today))
+        task_count('rows_scanned', len(vendor_ids))
+    with task_phase('refresh'):
+        refreshed = refresh_vendor_rollups(vendor_ids, today=today)
+        task_count('rows_updated', refreshed)
+    return refreshed
+
+
+@shared_task
+@instrumented_task
+def prune_change_log():
+    deleted = delete_expired_changes()
+    task_count('rows_deleted', deleted)
+    return deleted
+
+
+@shared_task
+@instrumented_task
+def prune_task_runs():
+    cutoff = timezone.now() - timedelta(days=settings.TASK_RUN_RETENTION_DAYS)
+    deleted, _by_model = TaskRun.objects.filter(started_at__lt=cutoff).delete()
+    task_count('rows_deleted', deleted)
+    return deleted
+
+
+@shared_task(
+    autoretry_for=(Exception,),
+    max_retries=settings.CERT_PROCESSING_MAX_ATTEMPTS - 1,
+    retry_backoff=True,
+    retry_backoff_max=settings.CERT_PROCESSING_RETRY_BACKOFF_MAX,
+)
+@instrumented_task
+def process_certification_upload(cert_id):
+    """Sniff, page-count and thumbnail an upload, moving it from the spool to storage when it was proxied."""
+    claimed = Certification.objects.filter(pk=cert_id, processing_status='pending').update(
+        processing_status='processing', processing_attempts=F('processing_attempts') + 1, updated_at=timezone.now()
+    )
+    if not claimed:
+        return None
+    _touch_vendor_pages([cert_id])
+
+    cert = Certification.objects.get(pk=cert_id)
+    path = cert.upload_spool_path
+    try:
+        redundant_name = _store_upload(cert)
+        cert.upload_spool_path = ''
+        cert.save(update_fields=[
+            'file', 'blob', 'thumbnail', 'content_type', 'page_count', 'processing_status', 'processing_error',
+            'upload_spool_path', 'updated_at',
+        ])
+    except Exception as exc:
+        _upload_attempt_failed(cert, exc)
+        raise
+
+    if path:
+        with suppress(FileNotFoundError):
+            os.remove(path)
+    if redundant_name:
+        delete_unreferenced_file(redundant_name)
+    return cert.processing_status
+
+
+def _store_upload(cert):
+    """Inspect the upload of ``cert`` and store it as a blob; returns the file name the move left redundant, if any."""
+    redundant_name = None
+    try:
+        if cert.upload_spool_path:
+            with open(cert.upload_spool_path, 'rb') as handle:
+                thumbnail = _inspect_upload(cert, handle)
+                cert.blob = store_blob(handle, cert.upload_spool_path, cert_id=cert.pk)
+        else:
+            # direct uploads are already in the bucket; only a server-side copy is trusted and kept
+            # (an earlier attempt may have claimed it, or even attached the blob already)
+            if not cert.blob_id and not cert.file.name.startswith(CLAIMED_UPLOAD_PREFIX):
+                cert.file.name = claim_direct_upload(cert.file.name)
+                Certification.objects.filter(pk=cert.pk).update(file=cert.file.name, updated_at=timezone.now())
+            with cert.file.open('rb') as handle:
+                thumbnail = _inspect_upload(cert, handle)
+                cert.blob, redundant_name = adopt_blob(handle, cert.file.name, cert_id=cert.pk)
+        cert.file.name = cert.blob.name
+        if thumbnail:
+            cert.thumbnail.save(f'{uuid.uuid4().hex}.png', ContentFile(thumbnail), save=False)
+        cert.processing_status = 'ready'
+    except UnsupportedUpload as exc:
+        cert.processing_status = 'failed'
+        cert.processing_error = str(exc)
+    return redundant_name
+
+
+def _upload_attempt_failed(cert, exc):
+    # storage, I/O or database trouble: the spooled file (or claimed copy) stays in place for the retry
+    if cert.processing_attempts >= settings.CERT_PROCESSING_MAX_ATTEMPTS:
+        status, error = 'failed', f'Could not process the document: {exc}'[:255]
+    else:
+        status, error = 'pending', ''
+    Certification.objects.filter(pk=cert.pk).update(
+        processing_status=status, processing_error=error, updated_at=timezone.now()
+    )
+    _touch_vendor_pages([cert.pk])
+
+
+def _touch_vendor_pages(cert_ids):
+    # .update() skips the post_save rollup refresh, and the vendor pages' ETag and Last-Modified come from the rollup
+    VendorRollup.objects.filter(vendor__certs__pk__in=cert_ids).update(updated_at=timezone.now())
+
+
+def _inspect_upload(cert, handle):
+    cert.content_type = sniff_content_type(handle)
+    cert.page_count = count_pages(handle, cert.content_type)
+    return render_thumbnail(handle, cert.content_type)
+
+
+def enqueue_certification_upload(cert_id):
+    if hasattr(process_certification_upload, 'delay'):
+        process_certification_upload.delay(cert_id)
+    else:
+        process_certification_upload(cert_id)
+
+
+@shared_task
+@instrumented_task
+def retry_stale_certification_uploads():
+    """Re-queue uploads stuck in processing (lost messages, dead workers); fail those out of attempts."""
+    now = timezone.now()
+    stale = Certification.objects.filter(
+        processing_status__in=['pending', 'processing'],
+        updated_at__lt=now - timedelta(seconds=settings.CERT_PROCESSING_STALE_AFTER),
+    )
+    with task_phase('fail_exhausted'):
+        exhausted = stale.filter(processing_attempts__gte=settings.CERT_PROCESSING_MAX_ATTEMPTS)
+        exhausted_ids = list(exhausted.values_list('pk', flat=True))
+        failed = stale.filter(pk__in=exhausted_ids).update(
+            processing_status='failed',
+            processing_error='Processing did not complete; please upload the document again.',
+            updated_at=now,
+        )
+        _touch_vendor_pages(exhausted_ids)
+        task_count('rows_updated', failed)
+    with task_phase('requeue'):
+        with transaction.atomic():
+            cert_ids = list(stale.select_for_update(skip_locked=True).values_list('pk', flat=True))
+            Certification.objects.filter(pk__in=cert_ids).update(processing_status='pending', updated_at=now)
+            _touch_vendor_pages(cert_ids)
+        task_count('rows_updated', len(cert_ids))
+        for cert_id in cert_ids:
+            enqueue_certification_upload(cert_id)
+    return {'requeued': len(cert_ids), 'failed': failed}
+
+
+@shared_task
+@instrumented_task
+def collect_orphan_certificate_blobs():
+    with task_phase('find_orphans'):
+        blob_ids = list(orphan_blob_ids())
+        task_count('rows_scanned', len(blob_ids))
+    with task_phase('release'):
+        released = release_blobs(blob_ids)
+        task_count('rows_deleted', released)
+    return released
+
+
+@shared_task
+@instrumented_task
+def send_expiry_notice_batch(payloads):
+    sent = send_message_batch(payloads)
+    task_count('emails_sent', sent)
+    return sent
+
+
+def deliver_expiry_notices(notices):
+    digests = build_expiry_digests(notices)
+    batches = list(chunked(digests, settings.EXPIRY_NOTICE_BATCH_SIZE))
+    if not batches:
+        return 0
+
+    if settings.EXPIRY_NOTICE_FANOUT == 'celery' and hasattr(send_expiry_notice_batch, 'delay'):
+        for batch in batches:
+            send_expiry_notice_batch.delay(batch)
+        # sent (and counted) by the batch tasks' own runs
+        task_count('emails_queued', len(digests))
+        return len(digests)
+
+    with ThreadPoolExecutor(max_workers=settings.EXPIRY_NOTICE_CONCURRENCY) as executor:
+        sent = sum(executor.map(send_message_batch, batches))
+    task_count('emails_sent', sent)
+    return sent
+
+
+def _collect_expiring_certs(today, days_remaining, flag):
+    due = list(
+        Certification.objects.filter(
             is_current=True,
-            approval_status='approved',
-        ).exists()
-        if not has_approved_valid:
-            vendor.status = 'inactive'
-            vendor.save(update_fields=['status'])
-
-
-def _send_expiry_notice(cert, recipients, days_remaining):
-    if not recipients:
-        return
-    send_mail(
-        subject=f'Certification expiry alert: {days_remaining} day(s) remaining',
-        message=(
-            f'Certification {cert.cert_type} for vendor {cert.vendor.name} '
-            f'expires on {cert.expiry_date}. Please upload and review renewal documents.'
-        ),
-        from_email=None,
-        recipient_list=recipients,
-        fail_silently=True,
+            expiry_date=today + timedelta(days=days_remaining),
+            **{flag: False},
+        ).select_related('vendor', 'vendor__internal_rep')
+    )
+    task_count('rows_scanned', len(due))
+    if due:
+        task_count('rows_updated', Certification.objects.filter(pk__in=[cert.pk for cert in due]).update(**{flag: True}))
+    return due
+
+
+def _inactivate_lapsed_vendors(today, vendor_ids=None):
+    # auto-inactivate verified vendors with no approved, unexpired certs
+    lapsed = Vendor.objects.filter(status='verified').exclude(
+        Exists(Certification.objects.valid(on_date=today).filter(vendor=OuterRef('pk')))
     )
+    if vendor_ids is not None:
+        lapsed = lapsed.filter(pk__in=vendor_ids)
+    with transaction.atomic():
+        rows = list(lapsed.select_for_update().values_list('pk', 'user_id', 'internal_rep_id'))
+        task_count('rows_scanned', len(rows))
+        if not rows:
+            return 0
+        lapsed_ids = [pk for pk, _user_id, _rep_id in rows]
+        updated = lapsed.update(status='inactive', updated_at=timezone.now())
+        task_count('rows_updated', updated)
+        VendorHistory.objects.bulk_create(
+            [VendorHistory(vendor_id=vendor_id, status='inactive') for vendor_id in lapsed_ids],
+            batch_size=1000,
+        )
+        record_changes(Vendor.objects.filter(pk__in=lapsed_ids))
+        # .update() skips the Vendor post_save receiver that normally does this
+        invalidate_dashboard_metrics({user_id for _pk, *user_ids in rows for user_id in user_ids})
+    return updated
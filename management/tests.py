@@ -1,12 +1,69 @@
 from datetime import date, timedelta
+import gzip
+import importlib.util
+import json
+from io import BytesIO, StringIO
+import os
+import tempfile
+import time
+import tracemalloc
+from unittest import mock, skipUnless
 
+from django.conf import settings
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
+from django.core import mail
+from django.core.cache import cache
+from django.core.mail import get_connection
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
 from django.core.files.uploadedfile import SimpleUploadedFile
-from django.test import TestCase
+from django.core.management import call_command
+from django.db import DatabaseError, connection
+from django.test import TestCase, modify_settings, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 
-from .models import Certification, Product, Vendor, VendorHistory
+from .benchmarks import compare_results, generate_benchmark_data, merge_results, run_benchmarks
+from .instrumentation import RECENT_RUNS_WINDOW, QueryRecorder, _latest_runs, percentiles, request_samples, task_count, task_metrics, task_phase
+from .views import VendorListView
+from .dashboard import cached_dashboard_metrics, dashboard_cache_stats, dashboard_metrics
+from .models import (
+    CertificateBlob,
+    Certification,
+    CertificationExpiryEvent,
+    ChangeLogEntry,
+    Contract,
+    Product,
+    TaskRun,
+    Vendor,
+    VendorHistory,
+    VendorRollup,
+    VendorSearchDocument,
+)
+from .rollups import refresh_vendor_rollups, stale_rollup_vendor_ids
+from .signals import batch_vendor_history, coalesce_vendor_refreshes
+from .tasks import (
+    _inactivate_lapsed_vendors,
+    collect_orphan_certificate_blobs,
+    enqueue_certification_upload,
+    process_certification_upload,
+    process_due_certification_events,
+    prune_task_runs,
+    refresh_stale_vendor_rollups,
+    retry_stale_certification_uploads,
+    run_daily_certification_checks,
+)
+from . import blobs, dashboard, direct_uploads, documents, uploads
+
+
+def create_certification(vendor, expires_in=365, **fields):
+    # a bare file name like ApiQueryCountTests uses, so nothing is written into the real MEDIA_ROOT
+    fields.setdefault('cert_type', 'ISO')
+    fields.setdefault('file', 'certs/x.pdf')
+    fields.setdefault('issue_date', date.today() - timedelta(days=365))
+    return Certification.objects.create(vendor=vendor, expiry_date=date.today() + timedelta(days=expires_in), **fields)
 
 
 class VendorLogicTests(TestCase):
@@ -14,7 +71,7 @@ class VendorLogicTests(TestCase):
         self.user = User.objects.create_user(username='vendor_user', password='password')
         self.staff = User.objects.create_user(username='staff', password='password', is_staff=True)
         self.vendor = Vendor.objects.create(name='Test Vendor', user=self.user, contact_email='vendor@example.com')
-        self.file = SimpleUploadedFile('test_cert.pdf', b'file_content', content_type='application/pdf')
+        self.file = 'certs/test_cert.pdf'
 
     def test_vendor_verification_requires_approved_certification(self):
         self.vendor.status = 'verified'
@@ -78,3 +135,1763 @@ class VendorLogicTests(TestCase):
         self.assertEqual(response.status_code, 302)
         cert.refresh_from_db()
         self.assertEqual(cert.approval_status, 'approved')
+
+
+class DailyCertificationCheckTests(TestCase):
+    def setUp(self):
+        self.rep = User.objects.create_user(username='rep', password='password', email='rep@example.com')
+        self.vendor = Vendor.objects.create(name='Checked Vendor', contact_email='vendor@example.com', internal_rep=self.rep)
+
+    def _cert(self, vendor, expires_in, **kwargs):
+        kwargs.setdefault('approval_status', 'approved')
+        return create_certification(vendor, expires_in, **kwargs)
+
+    def test_notifies_each_window_once_and_sets_flags(self):
+        cert_30 = self._cert(self.vendor, 30)
+        cert_15 = self._cert(self.vendor, 15)
+        cert_1 = self._cert(self.vendor, 1)
+        untouched = self._cert(self.vendor, 20)
+
+        summary = run_daily_certification_checks()
+
+        self.assertEqual(summary['notified'], {'notified_30_days': 1, 'notified_15_days': 1, 'notified_1_day': 1})
+        # one digest each for the vendor contact and the internal rep
+        self.assertEqual(summary['emails_sent'], 2)
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox), ['rep@example.com', 'vendor@example.com'])
+        self.assertEqual(mail.outbox[0].body.count('expires on'), 3)
+        for cert, flag in [(cert_30, 'notified_30_days'), (cert_15, 'notified_15_days'), (cert_1, 'notified_1_day')]:
+            cert.refresh_from_db()
+            self.assertTrue(getattr(cert, flag))
+        untouched.refresh_from_db()
+        self.assertFalse(untouched.notified_30_days or untouched.notified_15_days or untouched.notified_1_day)
+
+        mail.outbox.clear()
+        summary = run_daily_certification_checks()
+        self.assertEqual(sum(summary['notified'].values()), 0)
+        self.assertEqual(mail.outbox, [])
+
+    def test_inactivates_verified_vendors_without_valid_certs(self):
+        cert = self._cert(self.vendor, 10)
+        self.vendor.refresh_from_db()
+        self.assertEqual(self.vendor.status, 'verified')
+        Certification.objects.filter(pk=cert.pk).update(expiry_date=date.today() - timedelta(days=1))
+
+        summary = run_daily_certification_checks()
+
+        self.assertEqual(summary['vendors_inactivated'], 1)
+        self.assertIn('inactivate_vendors', summary['timings'])
+        self.vendor.refresh_from_db()
+        self.assertEqual(self.vendor.status, 'inactive')
+        self.assertEqual(VendorHistory.objects.filter(vendor=self.vendor).latest('timestamp').status, 'inactive')
+
+    def test_query_count_does_not_grow_with_vendors(self):
+        for index in range(5):
+            vendor = Vendor.objects.create(name=f'Vendor {index}')
+            self._cert(vendor, 100)
+        # 3 bucket selects, savepoint/select/release for inactivation, and the TaskRun insert
+        with self.assertNumQueries(7):
+            run_daily_certification_checks()
+
+    @override_settings(EXPIRY_NOTICE_BATCH_SIZE=2, EXPIRY_NOTICE_CONCURRENCY=2)
+    def test_notices_share_one_connection_per_batch(self):
+        for index in range(5):
+            vendor = Vendor.objects.create(name=f'Vendor {index}', contact_email=f'v{index}@example.com')
+            self._cert(vendor, 1)
+            self._cert(vendor, 30)
+
+        with mock.patch('management.notifications.get_connection', wraps=get_connection) as connections:
+            started = time.monotonic()
+            summary = run_daily_certification_checks()
+            elapsed = time.monotonic() - started
+
+        self.assertEqual(summary['emails_sent'], 5)
+        self.assertEqual(len(mail.outbox), 5)
+        self.assertEqual(connections.call_count, 3)
+        self.assertTrue(all('1 day(s) remaining' in message.body for message in mail.outbox))
+        self.assertLess(elapsed, 5)
+
+
+class CertificationExpiryEventTests(TestCase):
+    def setUp(self):
+        self.vendor = Vendor.objects.create(name='Scheduled Vendor', contact_email='vendor@example.com')
+
+    def _cert(self, expires_in, **kwargs):
+        kwargs.setdefault('approval_status', 'approved')
+        return create_certification(self.vendor, expires_in, **kwargs)
+
+    def test_events_scheduled_on_save_and_rescheduled_on_change(self):
+        cert = self._cert(60)
+        expiry = cert.expiry_date
+        self.assertEqual(
+            dict(cert.expiry_events.values_list('kind', 'due_date')),
+            {
+                'notice_30': expiry - timedelta(days=30),
+                'notice_15': expiry - timedelta(days=15),
+                'notice_1': expiry - timedelta(days=1),
+                'expiry': expiry + timedelta(days=1),
+            },
+        )
+
+        cert.expiry_date = date.today() + timedelta(days=10)
+        cert.save()
+        self.assertEqual(set(cert.expiry_events.values_list('kind', flat=True)), {'notice_1', 'expiry'})
+
+        cert.is_current = False
+        cert.save(update_fields=['is_current'])
+        self.assertFalse(cert.expiry_events.exists())
+
+    def test_processes_only_due_events(self):
+        due_cert = self._cert(30)
+        self._cert(90)
+
+        summary = process_due_certification_events()
+
+        self.assertEqual(summary['events'], 1)
+        self.assertEqual(summary['notified']['notified_30_days'], 1)
+        self.assertEqual(len(mail.outbox), 1)
+        due_cert.refresh_from_db()
+        self.assertTrue(due_cert.notified_30_days)
+        self.assertFalse(due_cert.expiry_events.filter(kind='notice_30').exists())
+
+        mail.outbox.clear()
+        self.assertEqual(process_due_certification_events()['events'], 0)
+        self.assertEqual(mail.outbox, [])
+
+    def test_expiry_event_inactivates_vendor(self):
+        cert = self._cert(5)
+        self.vendor.refresh_from_db()
+        self.assertEqual(self.vendor.status, 'verified')
+        Certification.objects.filter(pk=cert.pk).update(expiry_date=date.today() - timedelta(days=1))
+        CertificationExpiryEvent.objects.filter(certification=cert, kind='expiry').update(due_date=date.today())
+
+        summary = process_due_certification_events()
+
+        self.assertEqual(summary['vendors_inactivated'], 1)
+        self.vendor.refresh_from_db()
+        self.assertEqual(self.vendor.status, 'inactive')
+
+    def test_query_count_independent_of_pending_events(self):
+        for expires_in in range(40, 60):
+            self._cert(expires_in)
+        # savepoint, select due events, release and the TaskRun insert; nothing else runs when nothing is due
+        with self.assertNumQueries(4):
+            process_due_certification_events()
+
+
+class VendorStatusRefreshTests(TestCase):
+    def setUp(self):
+        self.vendor = Vendor.objects.create(name='Refreshed Vendor')
+
+    def _cert(self, **kwargs):
+        return create_certification(self.vendor, issue_date=date.today(), **kwargs)
+
+    def test_refresh_reads_vendor_state_in_one_query(self):
+        cert = self._cert(approval_status='pending')
+        self.vendor.refresh_from_db()
+        self.assertEqual(self.vendor.status, 'under_review')
+
+        cert.approval_status = 'approved'
+        with CaptureQueriesContext(connection) as queries:
+            cert.save(update_fields=['approval_status'])
+        status_reads = [
+            query for query in queries
+            if query['sql'].startswith('SELECT') and '"management_vendor"."status"' in query['sql']
+        ]
+        self.assertEqual(len(status_reads), 1)
+        self.vendor.refresh_from_db()
+        self.assertEqual(self.vendor.status, 'verified')
+
+    def test_bulk_changes_refresh_each_vendor_once_on_commit(self):
+        with mock.patch('management.signals._refresh_vendor_status') as refresh:
+            with self.captureOnCommitCallbacks(execute=True) as callbacks:
+                with coalesce_vendor_refreshes():
+                    for _index in range(5):
+                        self._cert(approval_status='approved')
+                    self.assertFalse(refresh.called)
+        refreshes = [callback for callback in callbacks if getattr(callback, 'func', None) is not dashboard._delete_dashboard_keys]
+        self.assertEqual(len(refreshes), 1)
+        refresh.assert_called_once_with(self.vendor.pk)
+
+    def test_coalesced_refresh_updates_status(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with coalesce_vendor_refreshes():
+                self._cert(approval_status='approved')
+                self.vendor.refresh_from_db()
+                self.assertEqual(self.vendor.status, 'pending')
+        self.vendor.refresh_from_db()
+        self.assertEqual(self.vendor.status, 'verified')
+
+
+class VendorHistoryTrackingTests(TestCase):
+    def setUp(self):
+        self.vendor = Vendor.objects.create(name='Tracked Vendor')
+
+    def test_status_change_costs_update_plus_history_insert(self):
+        vendor = Vendor.objects.get(pk=self.vendor.pk)
+        vendor.status = 'under_review'
+        # update, history insert, change-log insert
+        with self.assertNumQueries(3):
+            vendor.save()
+        self.assertEqual(list(VendorHistory.objects.filter(vendor=vendor).values_list('status', flat=True).order_by('pk')), ['pending', 'under_review'])
+
+        vendor.contact_name = 'Jordan'
+        # update, change-log insert, then the search document: vendor, products, contracts, upsert
+        with self.assertNumQueries(6):
+            vendor.save()
+        self.assertEqual(VendorHistory.objects.filter(vendor=vendor).count(), 2)
+
+    def test_history_batched_into_one_insert(self):
+        other = Vendor.objects.create(name='Second Vendor')
+        vendors = list(Vendor.objects.filter(pk__in=[self.vendor.pk, other.pk]))
+        # savepoint, two updates, one history and one change-log bulk insert, release
+        with self.assertNumQueries(6):
+            with batch_vendor_history():
+                for vendor in vendors:
+                    vendor.status = 'inactive'
+                    vendor.save()
+        self.assertEqual(VendorHistory.objects.filter(status='inactive').count(), 2)
+
+    def test_unloaded_instance_falls_back_to_database_status(self):
+        vendor = Vendor.objects.get(pk=self.vendor.pk)
+        del vendor._loaded_status
+        vendor.status = 'inactive'
+        vendor.save()
+        self.assertTrue(VendorHistory.objects.filter(vendor=self.vendor, status='inactive').exists())
+
+
+class DashboardMetricsTests(TestCase):
+    def setUp(self):
+        # invalidations only run on commit, which a TestCase never reaches
+        cache.clear()
+        self.staff = User.objects.create_user(username='staff', password='password', is_staff=True)
+        self.owner = User.objects.create_user(username='owner', password='password')
+        self.vendor = Vendor.objects.create(name='Owned Vendor', user=self.owner, risk_tier='Low')
+        other = Vendor.objects.create(name='Other Vendor', status='inactive', risk_tier='High')
+        for vendor, expires_in in [(self.vendor, 10), (self.vendor, 90), (other, 5)]:
+            create_certification(vendor, expires_in, issue_date=date.today() - timedelta(days=1))
+        Product.objects.create(vendor=self.vendor, name='Gloves')
+        Product.objects.create(vendor=other, name='Masks')
+        today = date.today()
+        Contract.objects.create(vendor=self.vendor, contract_id='C-1', total_value=100, start_date=today, end_date=today)
+        Contract.objects.create(vendor=other, contract_id='C-2', total_value=250, start_date=today, end_date=today)
+
+    def test_staff_metrics_in_two_queries(self):
+        with self.assertNumQueries(2):
+            metrics = dashboard_metrics(self.staff)
+        self.assertEqual(metrics['total_vendors'], 2)
+        self.assertEqual(metrics['expiring_certs'], 2)
+        self.assertEqual(metrics['total_products'], 2)
+        self.assertEqual(metrics['total_spend'], 350)
+        self.assertEqual(metrics['risk_spend_data'], [100.0, 0.0, 250.0])
+        self.assertEqual(metrics['chart_data'], [0, 0, 1, 1])
+
+    def test_vendor_user_metrics_are_scoped(self):
+        with self.assertNumQueries(2):
+            metrics = dashboard_metrics(self.owner)
+        self.assertEqual(metrics['total_vendors'], 1)
+        self.assertEqual(metrics['expiring_certs'], 1)
+        self.assertEqual(metrics['total_products'], 1)
+        self.assertEqual(metrics['total_spend'], 100)
+
+    def test_dashboard_view_renders_metrics(self):
+        self.client.login(username='staff', password='password')
+        response = self.client.get(reverse('dashboard'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['total_vendors'], 2)
+
+
+class DashboardCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.staff = User.objects.create_user(username='staff', password='password', is_staff=True)
+        self.owner = User.objects.create_user(username='owner', password='password')
+        self.vendor = Vendor.objects.create(name='Cached Vendor', user=self.owner)
+
+    def test_hits_after_first_computation(self):
+        before = dashboard_cache_stats()
+        cached_dashboard_metrics(self.staff)
+        with self.assertNumQueries(0):
+            metrics = cached_dashboard_metrics(self.staff)
+        self.assertEqual(metrics['total_vendors'], 1)
+        after = dashboard_cache_stats()
+        self.assertEqual(after['misses'] - before['misses'], 1)
+        self.assertEqual(after['hits'] - before['hits'], 1)
+
+    def test_counters_are_exposed_to_the_metrics_scrape(self):
+        cached_dashboard_metrics(self.staff)
+        cached_dashboard_metrics(self.staff)
+        self.client.force_login(self.staff)
+
+        lines = self.client.get(reverse('task_metrics')).content.decode().splitlines()
+
+        self.assertIn('# TYPE management_dashboard_cache_events_total counter', lines)
+        self.assertIn('management_dashboard_cache_events_total{event="hits"} 1', lines)
+        self.assertIn('management_dashboard_cache_events_total{event="misses"} 1', lines)
+
+    def test_writes_invalidate_staff_and_owner_scopes(self):
+        cached_dashboard_metrics(self.staff)
+        cached_dashboard_metrics(self.owner)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.create(vendor=self.vendor, name='Gloves')
+            # until the write commits, a request would only re-cache the old numbers
+            self.assertEqual(cached_dashboard_metrics(self.staff)['total_products'], 0)
+
+        self.assertEqual(cached_dashboard_metrics(self.staff)['total_products'], 1)
+        self.assertEqual(cached_dashboard_metrics(self.owner)['total_products'], 1)
+
+    def test_lapse_sweep_invalidates_staff_owner_and_rep_scopes(self):
+        rep = User.objects.create_user(username='rep', password='password')
+        Vendor.objects.filter(pk=self.vendor.pk).update(status='verified', internal_rep=rep)
+        for user in (self.staff, self.owner, rep):
+            self.assertEqual(cached_dashboard_metrics(user)['verified_vendors'], 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(_inactivate_lapsed_vendors(date.today()), 1)
+
+        for user in (self.staff, self.owner, rep):
+            self.assertEqual(cached_dashboard_metrics(user)['verified_vendors'], 0)
+
+    def test_stale_rollup_refresh_invalidates_owner_scopes(self):
+        today = date.today()
+        Contract.objects.create(
+            vendor=self.vendor, contract_id='C-1', total_value=100, start_date=today, end_date=today + timedelta(days=10)
+        )
+        # as it stood before the contract started
+        VendorRollup.objects.filter(vendor=self.vendor).update(computed_on=today - timedelta(days=1), active_contract_value=0)
+        for user in (self.staff, self.owner):
+            self.assertEqual(cached_dashboard_metrics(user)['total_spend'], 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(refresh_stale_vendor_rollups(), 1)
+
+        for user in (self.staff, self.owner):
+            self.assertEqual(cached_dashboard_metrics(user)['total_spend'], 100)
+
+    def test_other_users_keep_their_entries(self):
+        bystander = User.objects.create_user(username='bystander', password='password')
+        cached_dashboard_metrics(bystander)
+        Product.objects.create(vendor=self.vendor, name='Gloves')
+        with self.assertNumQueries(0):
+            cached_dashboard_metrics(bystander)
+
+
+class VendorRollupTests(TestCase):
+    def setUp(self):
+        self.staff = User.objects.create_user(username='staff', password='password', is_staff=True)
+        self.vendor = Vendor.objects.create(name='Rolled Up Vendor')
+        self.today = date.today()
+
+    def test_rollup_follows_contract_cert_and_product_writes(self):
+        contract = Contract.objects.create(
+            vendor=self.vendor, contract_id='C-1', total_value=100, start_date=self.today, end_date=self.today
+        )
+        Contract.objects.create(
+            vendor=self.vendor,
+            contract_id='C-2',
+            total_value=40,
+            start_date=self.today - timedelta(days=30),
+            end_date=self.today - timedelta(days=1),
+        )
+        Product.objects.create(vendor=self.vendor, name='Gloves')
+        Product.objects.create(vendor=self.vendor, name='Masks', status='inactive')
+        create_certification(self.vendor, 90, issue_date=self.today, approval_status='approved')
+
+        rollup = VendorRollup.objects.get(vendor=self.vendor)
+        self.assertEqual(rollup.active_contract_value, 100)
+        self.assertEqual((rollup.product_count, rollup.active_product_count), (2, 1))
+        self.assertEqual(rollup.valid_cert_count, 1)
+        self.assertEqual(rollup.next_cert_expiry, self.today + timedelta(days=90))
+        self.vendor.refresh_from_db()
+        self.assertEqual(self.vendor.total_spend, 140)
+
+        contract.delete()
+        rollup.refresh_from_db()
+        self.assertEqual(rollup.active_contract_value, 0)
+
+    def test_vendor_deletion_cascades_cleanly(self):
+        Product.objects.create(vendor=self.vendor, name='Gloves')
+        self.vendor.delete()
+        self.assertFalse(VendorRollup.objects.exists())
+
+    def test_stale_rollups_detected_after_contract_boundary(self):
+        Contract.objects.create(
+            vendor=self.vendor,
+            contract_id='C-1',
+            total_value=100,
+            start_date=self.today + timedelta(days=1),
+            end_date=self.today + timedelta(days=10),
+        )
+        self.assertEqual(list(stale_rollup_vendor_ids(self.today)), [])
+
+        tomorrow = self.today + timedelta(days=1)
+        self.assertEqual(list(stale_rollup_vendor_ids(tomorrow)), [self.vendor.pk])
+        refresh_vendor_rollups(stale_rollup_vendor_ids(tomorrow), today=tomorrow)
+        self.assertEqual(VendorRollup.objects.get(vendor=self.vendor).active_contract_value, 100)
+        self.assertEqual(list(stale_rollup_vendor_ids(tomorrow)), [])
+
+    def test_rebuild_command_recreates_missing_rollups(self):
+        VendorRollup.objects.all().delete()
+        call_command('rebuild_vendor_rollups', stdout=StringIO())
+        self.assertTrue(VendorRollup.objects.filter(vendor=self.vendor).exists())
+
+    def test_vendor_list_reads_rollup_values(self):
+        Contract.objects.create(
+            vendor=self.vendor, contract_id='C-1', total_value=75, start_date=self.today, end_date=self.today
+        )
+        self.client.login(username='staff', password='password')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('vendor_list'))
+        self.assertEqual(response.context['vendors'][0].active_contract_value, 75)
+        self.assertFalse(any('management_contract' in query['sql'] for query in queries))
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        self.staff = User.objects.create_user(username='staff', password='password', is_staff=True)
+        self.vendors = [Vendor.objects.create(name=f'Vendor {index}') for index in range(5)]
+        self.client.login(username='staff', password='password')
+
+    def _walk(self, url, results_of, next_of):
+        seen = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            seen.extend(results_of(response))
+            url = next_of(response)
+        return seen
+
+    def test_vendor_list_pages_through_every_vendor_once(self):
+        with mock.patch.object(VendorListView, 'paginate_by', 2):
+            seen = self._walk(
+                reverse('vendor_list'),
+                lambda response: [vendor.pk for vendor in response.context['vendors']],
+                lambda response: (
+                    f"{reverse('vendor_list')}?cursor={response.context['page_obj'].next_cursor}"
+                    if response.context['page_obj'].has_next() else None
+                ),
+            )
+        expected = list(Vendor.objects.order_by('-created_at', '-id').values_list('pk', flat=True))
+        self.assertEqual(seen, expected)
+
+    def test_deep_page_costs_the_same_as_the_first(self):
+        with mock.patch.object(VendorListView, 'paginate_by', 2):
+            with CaptureQueriesContext(connection) as first:
+                response = self.client.get(reverse('vendor_list'))
+            cursor = response.context['page_obj'].next_cursor
+            with CaptureQueriesContext(connection) as deeper:
+                self.client.get(reverse('vendor_list'), {'cursor': cursor})
+        self.assertEqual(len(first), len(deeper))
+
+    def test_invalid_cursor_is_not_found(self):
+        # the second is base64 for [1, 2]: well-formed, but not the strings encode_cursor writes
+        for cursor in ('not-a-cursor', 'WzEsIDJd'):
+            self.assertEqual(self.client.get(reverse('vendor_list'), {'cursor': cursor}).status_code, 404)
+            self.assertEqual(self.client.get('/api/vendors/', {'cursor': cursor}).status_code, 404)
+
+    def test_api_list_is_cursor_paginated(self):
+        rest_settings = dict(settings.REST_FRAMEWORK, PAGE_SIZE=2)
+        with override_settings(REST_FRAMEWORK=rest_settings):
+            seen = self._walk(
+                '/api/vendors/',
+                lambda response: [row['id'] for row in response.json()['results']],
+                lambda response: response.json()['next'],
+            )
+        self.assertEqual(sorted(seen), sorted(str(vendor.pk) for vendor in self.vendors))
+        self.assertEqual(len(seen), len(set(seen)))
+
+
+class AuditExportTests(TestCase):
+    def setUp(self):
+        self.staff = User.objects.create_user(username='staff', password='password', is_staff=True)
+        self.owner = User.objects.create_user(username='owner', password='password')
+        self.vendor = Vendor.objects.create(name='Audited Vendor', user=self.owner)
+        self.other = Vendor.objects.create(name='Other Vendor')
+
+    def _csv_lines(self, response):
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode().splitlines()
+
+    def test_vendor_export_streams_history(self):
+        self.client.login(username='owner', password='password')
+        lines = self._csv_lines(self.client.get(reverse('vendor_audit_export', args=[self.vendor.pk])))
+        self.assertEqual(lines[0], 'vendor,status,changed_by,timestamp')
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[1].startswith('Audited Vendor,pending,,'))
+
+    def test_bulk_export_is_scoped_to_user(self):
+        self.client.login(username='owner', password='password')
+        lines = self._csv_lines(self.client.get(reverse('audit_export')))
+        self.assertEqual([line.split(',')[0] for line in lines[1:]], ['Audited Vendor'])
+
+        self.client.login(username='staff', password='password')
+        lines = self._csv_lines(self.client.get(reverse('audit_export')))
+        self.assertEqual(len(lines), 3)
+
+    def _peak_export_memory(self, rows):
+        VendorHistory.objects.bulk_create(
+            [VendorHistory(vendor=self.vendor, status='under_review') for _index in range(rows)],
+            batch_size=500,
+        )
+        self.client.login(username='staff', password='password')
+        response = self.client.get(reverse('vendor_audit_export', args=[self.vendor.pk]))
+        tracemalloc.start()
+        streamed = sum(len(chunk) for chunk in response.streaming_content)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        self.assertGreater(streamed, rows * 20)
+        return peak
+
+    @override_settings(AUDIT_EXPORT_CHUNK_SIZE=200)
+    def test_export_memory_stays_flat_as_history_grows(self):
+        small = self._peak_export_memory(1000)
+        large = self._peak_export_memory(9000)
+        # ten times the rows must not mean anywhere near ten times the memory
+        self.assertLess(large, small * 2)
+
+
+class ApiQueryCountTests(TestCase):
+    """Query counts per endpoint must not depend on how many rows exist."""
+
+    ENDPOINTS = [
+        ('/api/vendors/', ''),
+        ('/api/vendors/', 'expand=certs,contracts,products'),
+        ('/api/vendors/', 'fields=id,name,status'),
+        ('/api/products/', 'expand=vendor'),
+        ('/api/certifications/', 'expand=vendor'),
+        ('/api/contracts/', 'expand=vendor'),
+    ]
+
+    def setUp(self):
+        self.staff = User.objects.create_user(username='staff', password='password', is_staff=True)
+        self.client.login(username='staff', password='password')
+        self.created = 0
+
+    def _grow_to(self, rows):
+        today = date.today()
+        vendors = Vendor.objects.bulk_create(
+            [Vendor(name=f'Vendor {index}') for index in range(self.created, rows)], batch_size=500
+        )
+        Product.objects.bulk_create([Product(vendor=vendor, name='Gloves') for vendor in vendors], batch_size=500)
+        Contract.objects.bulk_create(
+            [Contract(vendor=vendor, contract_id='C-1', total_value=10, start_date=today, end_date=today) for vendor in vendors],
+            batch_size=500,
+        )
+        Certification.objects.bulk_create(
+            [
+                Certification(vendor=vendor, cert_type='ISO', file='certs/x.pdf', issue_date=today, expiry_date=today + timedelta(days=1))
+                for vendor in vendors
+            ],
+            batch_size=500,
+        )
+        self.created = rows
+
+    def _query_counts(self):
+        counts = {}
+        for url, query in self.ENDPOINTS:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(f'{url}?{query}')
+            self.assertEqual(response.status_code, 200)
+            counts[(url, query)] = len(queries)
+        return counts
+
+    def test_query_counts_constant_at_1_100_and_10k_rows(self):
+        baseline = None
+        for rows in (1, 100, 10_000):
+            self._grow_to(rows)
+            counts = self._query_counts()
+            if baseline is None:
+                baseline = counts
+            self.assertEqual(counts, baseline, f'query counts changed at {rows} rows')
+        # one extra query per expanded relation
+        plain = baseline[('/api/vendors/', '')]
+        self.assertEqual(baseline[('/api/vendors/', 'expand=certs,contracts,products')], plain + 3)
+        self.assertEqual(baseline[('/api/products/', 'expand=vendor')], plain + 1)
+
+    def test_sparse_fieldset_narrows_select(self):
+        self._grow_to(1)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/vendors/?fields=id,name')
+        self.assertEqual(set(response.json()['results'][0]), {'id', 'name'})
+        vendor_select = next(query['sql'] for query in queries if 'FROM "management_vendor"' in query['sql'])
+        self.assertNotIn('contact_email', vendor_select)
+
+    def test_expand_nests_related_objects(self):
+        self._grow_to(1)
+        row = self.client.get('/api/vendors/?expand=certs&fields=id').json()['results'][0]
+        self.assertEqual(set(row), {'id', 'certs'})
+        self.assertEqual(row['certs'][0]['cert_type'], 'ISO')
+
+    def test_writes_ignore_fields_and_expand(self):
+        vendor, other = Vendor.objects.bulk_create([Vendor(name='Vendor A'), Vendor(name='Vendor B')])
+
+        created = self.client.post('/api/products/?expand=vendor', {'vendor': str(vendor.pk), 'name': 'Gloves'})
+        sparse = self.client.post('/api/products/?fields=id', {'vendor': str(vendor.pk), 'name': 'Masks'})
+        self.assertEqual((created.status_code, sparse.status_code), (201, 201))
+        product_id = created.json()['id']
+        moved = self.client.patch(
+            f'/api/products/{product_id}/?expand=vendor', {'vendor': str(other.pk)}, content_type='application/json'
+        )
+
+        self.assertEqual(moved.status_code, 200)
+        self.assertEqual(Product.objects.get(pk=product_id).vendor, other)
+        self.assertEqual(Product.objects.filter(vendor=vendor).count(), 1)
+
+
+class BulkUpsertApiTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(username='owner', password='password')
+        self.vendor = Vendor.objects.create(name='ERP Vendor', user=self.owner)
+        self.other = Vendor.objects.create(name='Someone Else')
+        self.client.login(username='owner', password='password')
+        self.today = date.today()
+
+    def _contract(self, contract_id, value, vendor=None, **overrides):
+        row = {
+            'vendor': str((vendor or self.vendor).pk),
+            'contract_id': contract_id,
+            'total_value': str(value),
+            'start_date': self.today.isoformat(),
+            'end_date': (self.today + timedelta(days=30)).isoformat(),
+        }
+        row.update(overrides)
+        return row
+
+    def _post(self, url, payload, content_type='application/json'):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(url, payload, content_type=content_type)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def test_contracts_upsert_on_vendor_and_contract_id(self):
+        Contract.objects.create(vendor=self.vendor, contract_id='C-1', total_value=10, start_date=self.today, end_date=self.today)
+
+        body = self._post('/api/contracts/bulk/', [
+            self._contract('C-1', 500),
+            self._contract('C-2', 250),
+            self._contract('C-3', 1, end_date=(self.today - timedelta(days=1)).isoformat()),
+            self._contract('C-4', 1, vendor=self.other),
+        ])
+
+        self.assertEqual((body['created'], body['updated'], body['error']), (1, 1, 2))
+        self.assertEqual([result['status'] for result in body['results']], ['updated', 'created', 'error', 'error'])
+        self.assertEqual(Contract.objects.get(contract_id='C-1').total_value, 500)
+        self.assertEqual(str(Contract.objects.get(contract_id='C-1').pk), body['results'][0]['id'])
+        self.assertFalse(Contract.objects.filter(contract_id__in=['C-3', 'C-4']).exists())
+        self.assertEqual(VendorRollup.objects.get(vendor=self.vendor).active_contract_value, 750)
+
+    def test_internal_reps_cannot_write_their_vendors_children(self):
+        rep = User.objects.create_user(username='rep', password='password')
+        Vendor.objects.filter(pk=self.vendor.pk).update(internal_rep=rep)
+        product = Product.objects.create(vendor=self.vendor, name='Gloves')
+        self.client.force_login(rep)
+
+        products = self._post('/api/products/bulk/', [{'id': str(product.pk), 'vendor': str(self.vendor.pk), 'name': 'Overwritten'}])
+        contracts = self._post('/api/contracts/bulk/', [self._contract('C-1', 10)])
+
+        self.assertEqual((products['error'], contracts['error']), (1, 1))
+        self.assertEqual(Product.objects.get(pk=product.pk).name, 'Gloves')
+        self.assertFalse(Contract.objects.exists())
+
+    def test_products_accept_ndjson(self):
+        product = Product.objects.create(vendor=self.vendor, name='Gloves')
+        payload = '\n'.join([
+            json.dumps({'id': str(product.pk), 'vendor': str(self.vendor.pk), 'name': 'Nitrile Gloves', 'status': 'inactive'}),
+            json.dumps({'vendor': str(self.vendor.pk), 'name': 'Masks'}),
+            '',
+        ])
+        body = self._post('/api/products/bulk/', payload, content_type='application/x-ndjson')
+
+        self.assertEqual((body['created'], body['updated']), (1, 1))
+        product.refresh_from_db()
+        self.assertEqual((product.name, product.status), ('Nitrile Gloves', 'inactive'))
+        self.assertEqual(VendorRollup.objects.get(vendor=self.vendor).product_count, 2)
+
+    def test_product_updates_keep_columns_the_row_leaves_out(self):
+        product = Product.objects.create(vendor=self.vendor, name='Gloves', status='inactive')
+
+        self._post('/api/products/bulk/', [{'id': str(product.pk), 'vendor': str(self.vendor.pk), 'name': 'Nitrile Gloves'}])
+
+        product.refresh_from_db()
+        self.assertEqual((product.name, product.status), ('Nitrile Gloves', 'inactive'))
+
+    def test_moving_a_product_invalidates_both_owners_dashboards(self):
+        new_owner = User.objects.create_user(username='new-owner', password='password')
+        target = Vendor.objects.create(name='Acquirer', user=new_owner)
+        product = Product.objects.create(vendor=self.vendor, name='Gloves')
+        staff = User.objects.create_user(username='staff', password='password', is_staff=True)
+        self.client.force_login(staff)
+
+        # the dashboards read the rollups, so they are dropped only once the whole request has refreshed them
+        with mock.patch('management.rollups.invalidate_dashboard_metrics') as invalidate:
+            self._post('/api/products/bulk/', [{'id': str(product.pk), 'vendor': str(target.pk), 'name': 'Gloves'}])
+
+        invalidate.assert_called_once()
+        self.assertEqual(set(invalidate.call_args.args[0]), {self.owner.pk, new_owner.pk})
+        self.assertEqual(Product.objects.get(pk=product.pk).vendor, target)
+
+    def test_query_count_does_not_grow_with_rows(self):
+        def run(count, prefix):
+            rows = [self._contract(f'{prefix}-{index}', index) for index in range(count)]
+            with CaptureQueriesContext(connection) as queries:
+                self._post('/api/contracts/bulk/', rows)
+            return len(queries)
+
+        self.assertEqual(run(5, 'A'), run(60, 'B'))
+
+
+class ApiExportTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(username='owner', password='password')
+        self.vendor = Vendor.objects.create(name='Exported Vendor', user=self.owner)
+        self.other = Vendor.objects.create(name='Hidden Vendor')
+        today = date.today()
+        for vendor in (self.vendor, self.other):
+            Contract.objects.create(vendor=vendor, contract_id='C-1', total_value='12.50', start_date=today, end_date=today)
+        self.client.login(username='owner', password='password')
+
+    def _rows(self, response):
+        body = b''.join(response.streaming_content)
+        if response.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+        return [json.loads(line) for line in body.decode().splitlines()]
+
+    def test_export_streams_scoped_rows_as_ndjson(self):
+        response = self.client.get('/api/contracts/export/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        rows = self._rows(response)
+        self.assertEqual([row['vendor'] for row in rows], [str(self.vendor.pk)])
+        self.assertEqual(rows[0]['total_value'], '12.50')
+        self.assertIn('updated_at', rows[0])
+
+    def test_export_gzips_when_accepted(self):
+        response = self.client.get('/api/vendors/export/', HTTP_ACCEPT_ENCODING='gzip, deflate')
+
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual([row['name'] for row in self._rows(response)], ['Exported Vendor'])
+
+    @override_settings(CHANGE_FEED_SETTLE_SECONDS=0)
+    def test_since_returns_rows_updated_after_the_previous_pull(self):
+        first = self.client.get('/api/contracts/export/')
+        self._rows(first)
+        contract = Contract.objects.create(
+            vendor=self.vendor, contract_id='C-2', total_value=1, start_date=date.today(), end_date=date.today()
+        )
+
+        response = self.client.get('/api/contracts/export/', {'since': first['X-Export-Since']})
+
+        self.assertEqual([row['id'] for row in self._rows(response)], [str(contract.pk)])
+
+    def test_since_trails_the_export_for_late_commits(self):
+        first = self.client.get('/api/contracts/export/')
+        self._rows(first)
+        # stamped before the first export started but committed after its query ran
+        contract = Contract.objects.create(
+            vendor=self.vendor, contract_id='C-2', total_value=1, start_date=date.today(), end_date=date.today()
+        )
+        Contract.objects.filter(pk=contract.pk).update(updated_at=timezone.now() - timedelta(seconds=1))
+
+        response = self.client.get('/api/contracts/export/', {'since': first['X-Export-Since']})
+
+        self.assertIn(str(contract.pk), [row['id'] for row in self._rows(response)])
+
+    def test_invalid_since_is_rejected(self):
+        response = self.client.get('/api/contracts/export/', {'since': 'yesterday'})
+
+        self.assertEqual(response.status_code, 400)
+
+    def test_status_refresh_bumps_updated_at(self):
+        stale = timezone.now() - timedelta(days=1)
+        Vendor.objects.filter(pk=self.vendor.pk).update(updated_at=stale)
+        create_certification(self.vendor, 90, issue_date=date.today() - timedelta(days=1), approval_status='approved')
+
+        self.vendor.refresh_from_db()
+        self.assertEqual(self.vendor.status, 'verified')
+        self.assertGreater(self.vendor.updated_at, stale)
+
+
+@override_settings(CHANGE_FEED_SETTLE_SECONDS=0, CHANGE_FEED_POLL_INTERVAL=0.01)
+class ChangeFeedTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(username='owner', password='password')
+        self.vendor = Vendor.objects.create(name='Synced Vendor', user=self.owner)
+        self.client.login(username='owner', password='password')
+
+    def _feed(self, **params):
+        response = self.client.get('/api/changes/', params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def test_feed_returns_scoped_changes_after_a_sequence(self):
+        start = self._feed()['next']
+        Vendor.objects.create(name='Hidden Vendor')
+        product = Product.objects.create(vendor=self.vendor, name='Gloves')
+        product.name = 'Nitrile Gloves'
+        product.save()
+        product.delete()
+
+        feed = self._feed(after=start)
+
+        self.assertEqual(
+            [(entry['resource'], entry['action']) for entry in feed['results']],
+            [('product', 'upsert'), ('product', 'upsert'), ('product', 'delete')],
+        )
+        self.assertEqual(feed['results'][1]['data']['name'], 'Nitrile Gloves')
+        self.assertIsNone(feed['results'][2]['data'])
+        self.assertEqual(self._feed(after=feed['next'])['results'], [])
+
+    def test_vendor_deletion_stays_visible_to_its_owner(self):
+        vendor_id = str(self.vendor.pk)
+        self.vendor.delete()
+
+        entries = self._feed()['results']
+
+        self.assertEqual(entries[-1]['action'], 'delete')
+        self.assertEqual(entries[-1]['object_id'], vendor_id)
+
+    def test_vendor_deletion_writes_its_children_in_one_insert(self):
+        Product.objects.bulk_create([Product(vendor=self.vendor, name=f'Product {index}') for index in range(20)])
+        Contract.objects.create(vendor=self.vendor, contract_id='C-1', total_value=1, start_date=date.today(), end_date=date.today())
+
+        with CaptureQueriesContext(connection) as queries:
+            self.vendor.delete()
+
+        inserts = [q['sql'] for q in queries if q['sql'].startswith('INSERT INTO "management_changelogentry"')]
+        self.assertEqual(len(inserts), 1)
+        self.assertFalse([q['sql'] for q in queries if q['sql'].startswith('SELECT "management_vendor"."user_id"')])
+        deletes = ChangeLogEntry.objects.filter(action='delete').order_by('pk')
+        self.assertEqual(deletes.filter(resource='product', user=self.owner).count(), 20)
+        self.assertEqual(deletes.filter(resource='contract').count(), 1)
+        self.assertEqual(deletes.last().resource, 'vendor')
+
+    def test_bulk_upsert_and_lapse_paths_record_changes(self):
+        self.client.post('/api/contracts/bulk/', [{
+            'vendor': str(self.vendor.pk),
+            'contract_id': 'C-1',
+            'total_value': '10.00',
+            'start_date': date.today().isoformat(),
+            'end_date': date.today().isoformat(),
+        }], content_type='application/json')
+        Vendor.objects.filter(pk=self.vendor.pk).update(status='verified')
+        _inactivate_lapsed_vendors(date.today())
+
+        entries = ChangeLogEntry.objects.order_by('pk').values_list('resource', 'action', 'data__status')
+        self.assertEqual(list(entries)[-2:], [('contract', 'upsert', None), ('vendor', 'upsert', 'inactive')])
+
+    def test_recent_entries_wait_for_the_settle_window(self):
+        with override_settings(CHANGE_FEED_SETTLE_SECONDS=60):
+            self.assertEqual(self._feed()['results'], [])
+        self.assertNotEqual(self._feed()['results'], [])
+
+    def test_long_poll_returns_empty_once_the_wait_runs_out(self):
+        after = self._feed()['next']
+        started = time.monotonic()
+
+        feed = self._feed(after=after, wait='0.05')
+
+        self.assertEqual((feed['results'], feed['next']), ([], after))
+        self.assertGreaterEqual(time.monotonic() - started, 0.05)
+        self.assertEqual(self.client.get('/api/changes/', {'wait': 'nan'}).status_code, 400)
+
+    def test_long_poll_releases_the_connection_between_polls(self):
+        after = self._feed()['next']
+
+        # the test case's transaction would otherwise keep the connection open
+        with mock.patch.object(connection, 'in_atomic_block', False), mock.patch.object(connection, 'close') as close:
+            self._feed(after=after, wait='0.05')
+
+        self.assertTrue(close.called)
+        with mock.patch.object(connection, 'close') as close:
+            self._feed(after=after, wait='0.05')
+        close.assert_not_called()
+
+
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(username='owner', password='password')
+        self.vendor = Vendor.objects.create(name='Cached Vendor', user=self.owner)
+        self.client.login(username='owner', password='password')
+        self.detail_url = reverse('vendor_detail', args=[self.vendor.pk])
+        # the first page render issues the CSRF cookie that later ETags include
+        self.client.get(reverse('vendor_list'))
+
+    def _revalidate(self, url, first, **headers):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag'], **headers)
+        return response, [query['sql'] for query in queries.captured_queries]
+
+    def test_vendor_detail_answers_304_without_loading_related_rows(self):
+        first = self.client.get(self.detail_url)
+        self.assertEqual(first.status_code, 200)
+        self.assertIn('Last-Modified', first)
+
+        response, queries = self._revalidate(self.detail_url, first)
+
+        self.assertEqual(response.status_code, 304)
+        self.assertFalse(any('management_certification' in sql or 'management_contract' in sql for sql in queries))
+        modified = self.client.get(self.detail_url, HTTP_IF_MODIFIED_SINCE=first['Last-Modified'])
+        self.assertEqual(modified.status_code, 304)
+
+    def test_child_changes_move_the_detail_etag(self):
+        first = self.client.get(self.detail_url)
+        contract = Contract.objects.create(
+            vendor=self.vendor, contract_id='C-1', total_value=5, start_date=date.today(), end_date=date.today()
+        )
+        second = self.client.get(self.detail_url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(second.status_code, 200)
+
+        contract.delete()
+        self.assertEqual(self.client.get(self.detail_url, HTTP_IF_NONE_MATCH=second['ETag']).status_code, 200)
+
+    def test_vendor_list_etag_tracks_scope_changes(self):
+        url = reverse('vendor_list')
+        first = self.client.get(url)
+        self.assertNotIn('Last-Modified', first)
+        self.assertEqual(self._revalidate(url, first)[0].status_code, 304)
+
+        Vendor.objects.create(name='Another Vendor', user=User.objects.create_user(username='other'))
+        self.assertEqual(self._revalidate(url, first)[0].status_code, 304)
+
+        self.vendor.name = 'Renamed Vendor'
+        self.vendor.save()
+        self.assertEqual(self._revalidate(url, first)[0].status_code, 200)
+
+    def test_api_list_and_retrieve_revalidate(self):
+        product = Product.objects.create(vendor=self.vendor, name='Gloves')
+        list_url = '/api/products/?expand=vendor'
+        detail_url = f'/api/products/{product.pk}/'
+        listed = self.client.get(list_url)
+        detail = self.client.get(detail_url)
+
+        self.assertEqual(self._revalidate(list_url, listed)[0].status_code, 304)
+        self.assertEqual(self._revalidate(detail_url, detail)[0].status_code, 304)
+
+        self.vendor.contact_name = 'Jordan'
+        self.vendor.save()
+        self.assertEqual(self._revalidate(list_url, listed)[0].status_code, 200)
+        self.assertEqual(self.client.get('/api/products/not-a-uuid/').status_code, 404)
+
+
+class CertificationUploadPipelineTests(TestCase):
+    PDF = b'%PDF-1.4\n1 0 obj << /Type /Pages /Count 2 >>\n2 0 obj << /Type /Page >>\n3 0 obj << /Type/Page >>\n%%EOF'
+
+    def setUp(self):
+        self.spool_dir = tempfile.TemporaryDirectory()
+        self.media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.spool_dir.cleanup)
+        self.addCleanup(self.media_root.cleanup)
+        settings_override = override_settings(CERT_UPLOAD_SPOOL_DIR=self.spool_dir.name, MEDIA_ROOT=self.media_root.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.user = User.objects.create_user(username='uploader', password='password')
+        self.vendor = Vendor.objects.create(name='Uploading Vendor', user=self.user)
+        self.client.login(username='uploader', password='password')
+
+    def _upload(self, content, name='scan.pdf'):
+        with self.captureOnCommitCallbacks() as all_callbacks:
+            response = self.client.post(reverse('cert_upload'), {
+                'cert_type': 'ISO',
+                'file': SimpleUploadedFile(name, content),
+                'issue_date': date.today() - timedelta(days=1),
+                'expiry_date': date.today() + timedelta(days=365),
+                'is_current': 'on',
+            })
+        self.assertRedirects(response, reverse('vendor_profile'), fetch_redirect_response=False)
+        callbacks = [callback for callback in all_callbacks if getattr(callback, 'func', None) is enqueue_certification_upload]
+        return Certification.objects.get(vendor=self.vendor), callbacks
+
+    def test_upload_is_spooled_and_stored_in_the_background(self):
+        cert, callbacks = self._upload(self.PDF)
+
+        self.assertEqual((cert.processing_status, cert.file.name), ('pending', ''))
+        self.assertTrue(os.path.exists(cert.upload_spool_path))
+        self.assertEqual(len(callbacks), 1)
+
+        spool_path = cert.upload_spool_path
+        callbacks[0]()
+        cert.refresh_from_db()
+
+        self.assertEqual(cert.processing_status, 'ready')
+        self.assertEqual((cert.content_type, cert.page_count), ('application/pdf', 2))
+        self.assertTrue(cert.file.name.startswith('certs/'))
+        self.assertEqual(cert.file.read(), self.PDF)
+        self.assertFalse(os.path.exists(spool_path))
+        self.assertEqual(cert.upload_spool_path, '')
+
+    @override_settings(FILE_UPLOAD_MAX_MEMORY_SIZE=16)
+    def test_large_uploads_are_moved_into_the_spool(self):
+        cert, _callbacks = self._upload(self.PDF)
+
+        with open(cert.upload_spool_path, 'rb') as spooled:
+            self.assertEqual(spooled.read(), self.PDF)
+
+    def test_unrecognised_content_fails_and_blocks_approval(self):
+        cert, callbacks = self._upload(b'MZ\x90\x00 not a certificate', name='cert.pdf')
+        callbacks[0]()
+        cert.refresh_from_db()
+
+        self.assertEqual(cert.processing_status, 'failed')
+        self.assertIn('Unsupported file type', cert.processing_error)
+        self.assertIsNone(process_certification_upload(cert.pk))
+
+        staff = User.objects.create_user(username='reviewer', password='password', is_staff=True)
+        self.client.force_login(staff)
+        self.client.post(reverse('approve_certification', args=[cert.pk]))
+        cert.refresh_from_db()
+        self.assertEqual(cert.approval_status, 'pending')
+        self.assertContains(self.client.get(reverse('approval_queue')), 'Document failed')
+
+    @override_settings(CERT_PROCESSING_MAX_ATTEMPTS=1)
+    def test_failed_processing_refreshes_the_vendor_page_validators(self):
+        cert, _callbacks = self._upload(self.PDF)
+        url = reverse('vendor_detail', args=[self.vendor.pk])
+        # the first render shows the upload's flash message, which pages never answer with a 304
+        self.client.get(url)
+        first = self.client.get(url)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag']).status_code, 304)
+
+        with mock.patch('management.tasks.store_blob', side_effect=OSError('bucket unavailable')):
+            with self.assertRaises(OSError):
+                process_certification_upload(cert.pk)
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Failed')
+
+    @override_settings(CERT_PROCESSING_MAX_ATTEMPTS=2)
+    def test_storage_errors_return_the_upload_to_pending_until_attempts_run_out(self):
+        cert, _callbacks = self._upload(self.PDF)
+
+        with mock.patch('management.tasks.store_blob', side_effect=OSError('bucket unavailable')):
+            with self.assertRaises(OSError):
+                process_certification_upload(cert.pk)
+            cert.refresh_from_db()
+            self.assertEqual((cert.processing_status, cert.processing_attempts), ('pending', 1))
+            self.assertTrue(os.path.exists(cert.upload_spool_path))
+
+            with self.assertRaises(OSError):
+                process_certification_upload(cert.pk)
+        cert.refresh_from_db()
+        self.assertEqual(cert.processing_status, 'failed')
+        self.assertIn('bucket unavailable', cert.processing_error)
+
+    def test_a_failed_final_save_is_retried_rather_than_left_processing(self):
+        cert, _callbacks = self._upload(self.PDF)
+
+        with mock.patch.object(Certification, 'save', side_effect=DatabaseError('connection lost')):
+            with self.assertRaises(DatabaseError):
+                process_certification_upload(cert.pk)
+        cert.refresh_from_db()
+        self.assertEqual(cert.processing_status, 'pending')
+
+        self.assertEqual(process_certification_upload(cert.pk), 'ready')
+        cert.refresh_from_db()
+        self.assertEqual((cert.processing_attempts, cert.file.read()), (2, self.PDF))
+
+    def test_stale_uploads_are_requeued_or_failed(self):
+        stuck, _callbacks = self._upload(self.PDF)
+        exhausted = Certification.objects.create(
+            vendor=self.vendor,
+            cert_type='CE',
+            issue_date=date.today() - timedelta(days=1),
+            expiry_date=date.today() + timedelta(days=365),
+            processing_status='processing',
+            processing_attempts=settings.CERT_PROCESSING_MAX_ATTEMPTS,
+        )
+        long_ago = timezone.now() - timedelta(seconds=settings.CERT_PROCESSING_STALE_AFTER + 60)
+        Certification.objects.filter(pk__in=[stuck.pk, exhausted.pk]).update(processing_status='processing', updated_at=long_ago)
+
+        self.assertEqual(retry_stale_certification_uploads(), {'requeued': 1, 'failed': 1})
+
+        stuck.refresh_from_db()
+        exhausted.refresh_from_db()
+        self.assertEqual(stuck.processing_status, 'ready')
+        self.assertEqual(exhausted.processing_status, 'failed')
+
+    @skipUnless(importlib.util.find_spec('fitz'), 'PyMuPDF is not installed')
+    def test_pdf_first_page_renders_a_thumbnail(self):
+        import fitz
+
+        with fitz.open() as document:
+            document.new_page(width=595, height=842)
+            pdf = document.tobytes()
+
+        thumbnail = uploads.render_thumbnail(BytesIO(pdf), 'application/pdf')
+
+        self.assertTrue(thumbnail.startswith(b'\x89PNG\r\n\x1a\n'))
+        pixmap = fitz.Pixmap(thumbnail)
+        self.assertAlmostEqual(max(pixmap.width, pixmap.height), settings.CERT_THUMBNAIL_SIZE, delta=1)
+
+    def test_page_scan_counts_objects_split_across_chunks(self):
+        with mock.patch.object(uploads, 'SCAN_CHUNK_SIZE', 7):
+            self.assertEqual(uploads.count_pages(BytesIO(self.PDF), 'application/pdf'), 2)
+
+
+class DirectCertificationUploadTests(TestCase):
+    PDF = b'%PDF-1.4\n1 0 obj << /Type /Page >>\n%%EOF'
+
+    def setUp(self):
+        self.media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media_root.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root.name, STORAGE_BACKEND='local')
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.user = User.objects.create_user(username='direct', password='password')
+        self.vendor = Vendor.objects.create(name='Direct Vendor', user=self.user)
+        self.client.login(username='direct', password='password')
+
+    def _presign(self, filename='scan.pdf', content_type='application/pdf'):
+        return self.client.post(reverse('cert_direct_upload'), {'filename': filename, 'content_type': content_type})
+
+    def _finalize(self, token):
+        return self.client.post(reverse('cert_upload_finalize'), {
+            'token': token,
+            'cert_type': 'FDA',
+            'issue_date': date.today() - timedelta(days=1),
+            'expiry_date': date.today() + timedelta(days=365),
+            'is_current': 'on',
+        })
+
+    def test_presign_upload_and_finalize(self):
+        target = self._presign().json()
+        self.assertEqual(target['method'], 'PUT')
+        self.assertTrue(target['key'].startswith('certs/') and target['key'].endswith('.pdf'))
+
+        self.assertEqual(self._finalize(target['token']).status_code, 400)
+        upload = self.client.generic('PUT', target['url'], self.PDF, content_type='application/pdf')
+        self.assertEqual(upload.status_code, 200)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self._finalize(target['token'])
+        self.assertEqual(response.status_code, 201)
+
+        cert = Certification.objects.get(pk=response.json()['id'])
+        self.assertEqual(cert.file.name, cert.blob.name)
+        self.assertFalse(default_storage.exists(target['key']))
+        self.assertEqual((cert.processing_status, cert.content_type, cert.page_count), ('ready', 'application/pdf', 1))
+
+        # the staged key is gone once the file moves to its blob, but the token stays spent
+        replay = self.client.generic('PUT', target['url'], self.PDF, content_type='application/pdf')
+        self.assertEqual(replay.status_code, 409)
+        default_storage.save(target['key'], ContentFile(self.PDF))
+        response = self._finalize(target['token'])
+        self.assertContains(response, 'already been submitted', status_code=400)
+        self.assertEqual(Certification.objects.filter(vendor=self.vendor).count(), 1)
+
+    def test_tokens_are_bound_to_the_vendor_and_the_backend(self):
+        target = self._presign().json()
+        other = User.objects.create_user(username='other', password='password')
+        Vendor.objects.create(name='Other Vendor', user=other)
+
+        self.client.generic('PUT', target['url'], self.PDF, content_type='application/pdf')
+        self.client.force_login(other)
+        self.assertEqual(self._finalize(target['token']).status_code, 400)
+        self.assertEqual(self.client.generic('PUT', target['url'].replace(target['token'], 'forged'), self.PDF).status_code, 403)
+        self.assertEqual(self._presign(filename='payload.exe').status_code, 400)
+        with override_settings(STORAGE_BACKEND='s3'):
+            self.assertEqual(self.client.generic('PUT', target['url'], self.PDF).status_code, 404)
+
+    def test_s3_presigned_post_limits_size_and_type(self):
+        storage = mock.Mock(bucket_name='certs-bucket')
+        storage.connection.meta.client.generate_presigned_post.return_value = {
+            'url': 'https://certs-bucket.s3.amazonaws.com/',
+            'fields': {'key': 'certs/x.pdf'},
+        }
+        with override_settings(STORAGE_BACKEND='s3'), mock.patch.object(direct_uploads, 'default_storage', storage):
+            target = self._presign().json()
+
+        self.assertEqual((target['method'], target['url']), ('POST', 'https://certs-bucket.s3.amazonaws.com/'))
+        call = storage.connection.meta.client.generate_presigned_post.call_args.kwargs
+        self.assertEqual(call['Key'], target['key'])
+        self.assertIn(['content-length-range', 1, settings.CERT_UPLOAD_MAX_BYTES], call['Conditions'])
+
+
+class CertificateBlobTests(TestCase):
+    PDF = b'%PDF-1.4\n1 0 obj << /Type /Page >>\n%%EOF'
+
+    def setUp(self):
+        self.media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media_root.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root.name, CERT_UPLOAD_SPOOL_DIR=self.media_root.name + '/spool')
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.vendor = Vendor.objects.create(name='Renewing Vendor')
+
+    def _cert(self, **fields):
+        fields.setdefault('file', '')
+        return create_certification(self.vendor, issue_date=date.today() - timedelta(days=1), **fields)
+
+    def _proxied_upload(self, content):
+        cert = self._cert(processing_status='pending', upload_spool_path=uploads.spool_upload(SimpleUploadedFile('iso.pdf', content)))
+        process_certification_upload(cert.pk)
+        cert.refresh_from_db()
+        return cert
+
+    def _stored_files(self):
+        certs_dir = os.path.join(self.media_root.name, 'certs')
+        return sorted(os.path.relpath(os.path.join(root, name), certs_dir) for root, _dirs, names in os.walk(certs_dir) for name in names)
+
+    def test_repeat_uploads_share_one_content_addressed_file(self):
+        first = self._proxied_upload(self.PDF)
+        with mock.patch('django.core.files.storage.FileSystemStorage._save') as storage_write:
+            second = self._proxied_upload(self.PDF)
+
+        storage_write.assert_not_called()
+        self.assertEqual(first.blob_id, second.blob_id)
+        self.assertEqual(first.file.name, f'certs/sha256/{first.blob.sha256[:2]}/{first.blob.sha256}.pdf')
+        self.assertEqual(CertificateBlob.objects.with_ref_count().get().ref_count, 2)
+        self.assertEqual(len(self._stored_files()), 1)
+
+    def test_direct_upload_of_known_content_drops_the_staged_copy(self):
+        stored = self._proxied_upload(self.PDF)
+        staged = default_storage.save('certs/staged.pdf', ContentFile(self.PDF))
+        direct = self._cert(processing_status='pending', file=staged)
+
+        process_certification_upload(direct.pk)
+        direct.refresh_from_db()
+
+        self.assertEqual((direct.blob_id, direct.file.name), (stored.blob_id, stored.file.name))
+        self.assertFalse(default_storage.exists(staged))
+        self.assertEqual(self._stored_files(), [os.path.relpath(stored.file.name, 'certs')])
+
+    def test_direct_upload_is_stored_under_its_content_address_not_the_staged_key(self):
+        staged = default_storage.save('certs/staged.pdf', ContentFile(self.PDF))
+        direct = self._cert(processing_status='pending', file=staged)
+
+        process_certification_upload(direct.pk)
+        direct.refresh_from_db()
+
+        self.assertEqual(direct.file.name, f'certs/sha256/{direct.blob.sha256[:2]}/{direct.blob.sha256}.pdf')
+        self.assertEqual(direct.blob.name, direct.file.name)
+        # neither the client-writable key nor the claimed copy survives
+        self.assertEqual(self._stored_files(), [os.path.relpath(direct.file.name, 'certs')])
+
+    def test_bucket_copies_happen_server_side(self):
+        storage = mock.Mock(bucket_name='certs-bucket')
+        storage._normalize_name.side_effect = lambda name: f'media/{name}'
+        with override_settings(STORAGE_BACKEND='s3'), mock.patch.object(blobs, 'default_storage', storage):
+            blobs.copy_object('certs/staged.pdf', 'certs/sha256/ab/abc.pdf')
+        storage.connection.meta.client.copy.assert_called_once_with(
+            {'Bucket': 'certs-bucket', 'Key': 'media/certs/staged.pdf'}, 'certs-bucket', 'media/certs/sha256/ab/abc.pdf'
+        )
+
+        storage = mock.Mock()
+        storage._normalize_name.side_effect = lambda name: name
+        target = storage.bucket.blob.return_value
+        target.rewrite.side_effect = [('more', 1, 2), (None, 2, 2)]
+        with override_settings(STORAGE_BACKEND='gcs'), mock.patch.object(blobs, 'default_storage', storage):
+            blobs.copy_object('certs/staged.pdf', 'certs/sha256/ab/abc.pdf')
+        self.assertEqual(target.rewrite.call_count, 2)
+        self.assertEqual(target.rewrite.call_args.kwargs, {'token': 'more'})
+
+    def test_blob_is_collected_with_its_last_certification(self):
+        first = self._proxied_upload(self.PDF)
+        second = self._proxied_upload(self.PDF)
+        name = first.file.name
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertTrue(default_storage.exists(name))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertFalse(CertificateBlob.objects.exists())
+        self.assertFalse(default_storage.exists(name))
+
+    def test_blob_is_attached_before_its_lock_is_released(self):
+        cert = self._cert(processing_status='processing', upload_spool_path=uploads.spool_upload(SimpleUploadedFile('iso.pdf', self.PDF)))
+        with open(cert.upload_spool_path, 'rb') as handle:
+            blob = blobs.store_blob(handle, cert.upload_spool_path, cert_id=cert.pk)
+
+        # a sweep before the upload task's final save must not take the blob away
+        self.assertEqual(collect_orphan_certificate_blobs(), 0)
+        cert.refresh_from_db()
+        self.assertEqual((cert.blob_id, cert.file.name), (blob.pk, blob.name))
+
+    def test_orphan_collection_sweeps_unreferenced_blobs(self):
+        name = default_storage.save('certs/orphan.pdf', ContentFile(self.PDF))
+        CertificateBlob.objects.create(sha256='0' * 64, name=name, size=len(self.PDF))
+
+        self.assertEqual(collect_orphan_certificate_blobs(), 1)
+        self.assertFalse(default_storage.exists(name))
+
+    def test_dedupe_command_moves_legacy_files_onto_blobs(self):
+        legacy = [self._cert(file=SimpleUploadedFile('renewal.pdf', self.PDF)) for _ in range(3)]
+        self.assertEqual(len(self._stored_files()), 3)
+
+        out = StringIO()
+        call_command('dedupe_certification_files', stdout=out)
+
+        names = {cert.file.name for cert in Certification.objects.filter(pk__in=[cert.pk for cert in legacy])}
+        self.assertEqual(len(names), 1)
+        self.assertEqual(len(self._stored_files()), 1)
+        # every legacy name is replaced by the content address, the first one included
+        self.assertIn('removed 3 duplicate(s)', out.getvalue())
+
+
+class CertificationDocumentTests(TestCase):
+    PDF = b'%PDF-1.4\n1 0 obj << /Type /Page >>\n%%EOF'
+
+    def setUp(self):
+        self.media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media_root.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root.name, CERT_UPLOAD_SPOOL_DIR=self.media_root.name + '/spool')
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.owner = User.objects.create_user(username='doc-owner', password='pass')
+        self.other = User.objects.create_user(username='doc-other', password='pass')
+        vendor = Vendor.objects.create(name='Document Vendor', user=self.owner)
+        self.cert = Certification.objects.create(
+            vendor=vendor,
+            cert_type='ISO',
+            issue_date=date.today() - timedelta(days=1),
+            expiry_date=date.today() + timedelta(days=365),
+            processing_status='pending',
+            upload_spool_path=uploads.spool_upload(SimpleUploadedFile('iso.pdf', self.PDF)),
+        )
+        process_certification_upload(self.cert.pk)
+        self.cert.refresh_from_db()
+        self.url = reverse('cert_document', args=[self.cert.pk])
+        self.client.login(username='doc-owner', password='pass')
+
+    def test_document_is_scoped_to_the_certification_owner(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.PDF)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(response['ETag'], f'"{self.cert.blob.sha256}"')
+
+        self.client.login(username='doc-other', password='pass')
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+    def test_internal_rep_can_open_the_documents_linked_from_the_vendor_page(self):
+        rep = User.objects.create_user(username='doc-rep', password='pass')
+        Vendor.objects.filter(pk=self.cert.vendor_id).update(internal_rep=rep)
+        self.client.force_login(rep)
+
+        detail = self.client.get(reverse('vendor_detail', args=[self.cert.vendor_id]))
+        self.assertContains(detail, self.url)
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+
+    def test_range_requests_return_partial_content(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=5-7')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 5-7/{len(self.PDF)}')
+        self.assertEqual(b''.join(response.streaming_content), self.PDF[5:8])
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=-5')
+        self.assertEqual(b''.join(response.streaming_content), self.PDF[-5:])
+
+        response = self.client.get(self.url, HTTP_RANGE=f'bytes={len(self.PDF)}-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(self.PDF)}')
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=5-7', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+
+    def test_matching_etag_is_not_modified(self):
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=f'"{self.cert.blob.sha256}"')
+        self.assertEqual(response.status_code, 304)
+
+    @override_settings(CERT_DOCUMENT_OFFLOAD='x-accel-redirect', CERT_DOCUMENT_ACCEL_PREFIX='/protected-media/')
+    def test_offload_hands_the_transfer_to_the_web_server(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/' + self.cert.file.name)
+        self.assertEqual(response.content, b'')
+
+    @override_settings(STORAGE_BACKEND='s3', AWS_QUERYSTRING_EXPIRE=3600, CERT_SIGNED_URL_REFRESH_MARGIN=300)
+    def test_signed_urls_are_reused_until_near_expiry(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        signed = iter(['https://bucket/doc?sig=1', 'https://bucket/doc?sig=2'])
+        with mock.patch.object(default_storage, 'url', side_effect=lambda name: next(signed)), \
+                mock.patch.object(documents.cache, 'set', wraps=documents.cache.set) as cache_set:
+            first = self.client.get(self.url)
+            second = self.client.get(self.url)
+
+        self.assertEqual(first['Location'], 'https://bucket/doc?sig=1')
+        self.assertEqual(second['Location'], 'https://bucket/doc?sig=1')
+        self.assertEqual(cache_set.call_count, 1)
+        self.assertEqual(cache_set.call_args.args[2], 3300)
+
+
+class BulkCertificationReviewTests(TestCase):
+    def setUp(self):
+        self.staff = User.objects.create_user(username='reviewer', password='pass', is_staff=True)
+        self.vendors = [Vendor.objects.create(name=f'Queue Vendor {i}') for i in range(3)]
+        self.client.login(username='reviewer', password='pass')
+
+    def _certs(self, count, vendor, **fields):
+        fields.setdefault('cert_type', 'ISO')
+        fields.setdefault('expiry_date', date.today() + timedelta(days=365))
+        certs = [
+            Certification.objects.create(vendor=vendor, issue_date=date.today() - timedelta(days=1), **fields)
+            for _ in range(count)
+        ]
+        return [cert.pk for cert in certs]
+
+    def test_bulk_approval_is_one_update_with_one_refresh_per_vendor(self):
+        small = [pk for vendor in self.vendors for pk in self._certs(2, vendor)]
+        large = [pk for vendor in self.vendors for pk in self._certs(20, vendor)]
+
+        def review(ids):
+            with mock.patch('management.signals.refresh_vendors') as refresh, \
+                    self.captureOnCommitCallbacks(execute=True), CaptureQueriesContext(connection) as queries:
+                self.client.post(reverse('review_certifications'), {'decision': 'approve', 'certifications': ids})
+            return refresh, queries
+
+        refresh, small_queries = review(small)
+        _refresh, large_queries = review(large)
+
+        self.assertEqual(len(large_queries), len(small_queries))
+        vendor_ids = {vendor.pk for vendor in self.vendors}
+        refresh.assert_called_once_with(vendor_ids, vendor_ids, set())
+        updates = [q['sql'] for q in large_queries if q['sql'].startswith('UPDATE "management_certification"')]
+        self.assertEqual(len(updates), 1)
+        self.assertFalse(Certification.objects.exclude(approval_status='approved').exists())
+        self.assertEqual(ChangeLogEntry.objects.filter(resource='certification', data__approval_status='approved').count(), 66)
+
+    def test_vendor_status_flips_are_recorded_in_one_history_insert(self):
+        ids = [pk for vendor in self.vendors for pk in self._certs(1, vendor)]
+
+        # the refresh runs on commit, so the queries are captured around the callbacks too
+        with CaptureQueriesContext(connection) as queries, self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('review_certifications'), {'decision': 'approve', 'certifications': ids})
+
+        inserts = [q['sql'] for q in queries if q['sql'].startswith('INSERT INTO "management_vendorhistory"')]
+        self.assertEqual(len(inserts), 1)
+        self.assertEqual(VendorHistory.objects.filter(status='verified').count(), 3)
+        self.assertEqual(ChangeLogEntry.objects.filter(resource='vendor', data__status='verified').count(), 3)
+
+    def test_vendor_status_follows_bulk_decisions(self):
+        approved = self._certs(1, self.vendors[0])
+        rejected = self._certs(1, self.vendors[1])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('review_certifications'), {'decision': 'approve', 'certifications': approved})
+            self.client.post(reverse('review_certifications'), {'decision': 'reject', 'certifications': rejected})
+
+        self.vendors[0].refresh_from_db()
+        self.assertEqual(self.vendors[0].status, 'verified')
+        cert = Certification.objects.get(pk=rejected[0])
+        self.assertEqual((cert.approval_status, cert.reviewed_by), ('rejected', self.staff))
+
+    def test_unready_and_reviewed_certifications_are_skipped(self):
+        processing = self._certs(1, self.vendors[0], processing_status='processing')
+        done = self._certs(1, self.vendors[0], approval_status='rejected')
+        ready = self._certs(1, self.vendors[0])
+
+        response = self.client.post(
+            reverse('review_certifications'), {'decision': 'approve', 'certifications': processing + done + ready}, follow=True
+        )
+
+        self.assertContains(response, '1 certification approved.')
+        self.assertContains(response, '2 skipped')
+        self.assertEqual(Certification.objects.get(pk=processing[0]).approval_status, 'pending')
+        self.assertEqual(Certification.objects.get(pk=done[0]).approval_status, 'rejected')
+
+    def test_queue_filters_and_paginates_with_constant_queries(self):
+        soon = date.today() + timedelta(days=10)
+        self._certs(3, self.vendors[0], cert_type='FDA', expiry_date=soon)
+        for vendor in self.vendors:
+            self._certs(30, vendor)
+
+        response = self.client.get(reverse('approval_queue'), {'cert_type': 'FDA', 'expires_before': soon + timedelta(days=1)})
+        self.assertEqual(len(response.context['certifications']), 3)
+
+        with CaptureQueriesContext(connection) as queries:
+            first = self.client.get(reverse('approval_queue'))
+        self.assertEqual(len(first.context['certifications']), 50)
+        self.assertLess(len(queries), 10)
+
+        second = self.client.get(reverse('approval_queue'), {'cursor': first.context['page_obj'].next_cursor})
+        self.assertEqual(len(second.context['certifications']), 43)
+        self.assertFalse(set(first.context['certifications']) & set(second.context['certifications']))
+
+
+class VendorSearchTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(username='searcher', password='pass')
+        self.staff = User.objects.create_user(username='search-staff', password='pass', is_staff=True)
+        self.acme = Vendor.objects.create(name='Acme Surgical', registration_number='EL1002022', country='Germany', user=self.owner)
+        self.other = Vendor.objects.create(name='Borealis Medical', contact_name='Dana Acme-Smith')
+        Product.objects.create(vendor=self.other, name='Sterile Gauze Pads')
+        Contract.objects.create(
+            vendor=self.other, contract_id='CTR-77881', total_value=10,
+            start_date=date.today(), end_date=date.today() + timedelta(days=30),
+        )
+
+    def _names(self, query, user):
+        self.client.force_login(user)
+        response = self.client.get(reverse('vendor_list'), {'q': query})
+        return [vendor.name for vendor in response.context['vendors']]
+
+    def test_documents_follow_vendor_product_and_contract_writes(self):
+        self.assertEqual(self._names('gauze', self.staff), ['Borealis Medical'])
+        self.assertEqual(self._names('7788', self.staff), ['Borealis Medical'])
+        self.assertEqual(self._names('1002022', self.staff), ['Acme Surgical'])
+
+        self.acme.name = 'Zenith Surgical'
+        self.acme.save()
+        Product.objects.filter(vendor=self.other).delete()
+        self.assertEqual(self._names('zenith', self.staff), ['Zenith Surgical'])
+        self.assertEqual(self._names('gauze', self.staff), [])
+
+    def test_status_saves_do_not_rebuild_the_document(self):
+        vendor = Vendor.objects.get(pk=self.acme.pk)
+        vendor.status = 'under_review'
+        with mock.patch('management.signals.refresh_search_documents') as refresh:
+            vendor.save()
+        refresh.assert_not_called()
+
+    def test_results_are_scoped_ranked_and_safe_from_fts_syntax(self):
+        self.assertEqual(self._names('acme', self.owner), ['Acme Surgical'])
+        self.assertEqual(self._names('acme', self.staff)[0], 'Acme Surgical')
+        self.assertEqual(len(self._names('acme', self.staff)), 2)
+        self.assertEqual(self._names('"acme" OR NEAR(', self.staff), [])
+        self.assertEqual(self._names('gi', self.staff), ['Acme Surgical'])
+
+    def test_short_terms_still_narrow_longer_ones(self):
+        Vendor.objects.create(name='3M Surgical Tape')
+        Vendor.objects.create(name='Tapeworks Medical')
+
+        self.assertEqual(self._names('3M tape', self.staff), ['3M Surgical Tape'])
+        self.assertEqual(self._names('tape 3m', self.staff), ['3M Surgical Tape'])
+        self.assertEqual(len(self._names('tape', self.staff)), 2)
+        self.assertEqual(self._names('3M gauze', self.staff), [])
+
+    def test_api_search_returns_one_ranked_page(self):
+        self.client.force_login(self.staff)
+        response = self.client.get('/api/vendors/', {'q': 'borealis gauze'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row['name'] for row in response.json()['results']], ['Borealis Medical'])
+        self.assertIsNone(response.json()['next'])
+
+    def test_rebuild_command_restores_missing_documents(self):
+        VendorSearchDocument.objects.all().delete()
+        self.assertEqual(self._names('acme', self.staff), [])
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.assertEqual(len(self._names('acme', self.staff)), 2)
+
+
+class QueryPlanTests(TestCase):
+    """Each hot filter path must be answered from an index, not a full table scan."""
+
+    def assertUsesIndex(self, queryset):
+        table = queryset.model._meta.db_table
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                # tiny test tables are cheaper to scan, so make the planner show its indexed plan
+                cursor.execute('SET LOCAL enable_seqscan = off')
+        plan = queryset.explain()
+        if connection.vendor == 'postgresql':
+            full_scan = f'Seq Scan on {table}' in plan
+        else:
+            full_scan = any(
+                line.split('SCAN ', 1)[1].split()[0] == table and 'USING' not in line
+                for line in plan.splitlines() if 'SCAN ' in line
+            )
+        self.assertFalse(full_scan, f'{table} is fully scanned:\n{plan}')
+
+    def test_expiry_notice_collection(self):
+        today = date.today()
+        self.assertUsesIndex(Certification.objects.filter(is_current=True, expiry_date=today + timedelta(days=30), notified_30_days=False))
+
+    def test_dashboard_expiring_window(self):
+        today = date.today()
+        self.assertUsesIndex(Certification.objects.filter(expiry_date__gte=today, expiry_date__lte=today + timedelta(days=30)))
+
+    def test_approval_queue_pages(self):
+        pending = Certification.objects.filter(approval_status='pending')
+        self.assertUsesIndex(pending.order_by('expiry_date', 'id')[:51])
+        self.assertUsesIndex(pending.filter(cert_type='FDA', expiry_date__gt=date.today()).order_by('expiry_date', 'id')[:51])
+
+    def test_vendor_status_refresh_checks(self):
+        vendor = Vendor.objects.create(name='Planned Vendor')
+        self.assertUsesIndex(Certification.objects.valid().filter(vendor=vendor))
+        self.assertUsesIndex(Certification.objects.filter(vendor=vendor, approval_status='pending'))
+
+    def test_task_metrics_scrape(self):
+        self.assertUsesIndex(_latest_runs())
+        self.assertUsesIndex(_latest_runs(status='succeeded'))
+        self.assertUsesIndex(TaskRun.objects.filter(started_at__gte=timezone.now() - RECENT_RUNS_WINDOW))
+
+    def test_vendor_status_and_list_order(self):
+        self.assertUsesIndex(Vendor.objects.filter(status='verified'))
+        self.assertUsesIndex(Vendor.objects.order_by('-created_at', '-id')[:51])
+
+    def test_due_expiry_events_and_active_contracts(self):
+        self.assertUsesIndex(CertificationExpiryEvent.objects.due())
+        self.assertUsesIndex(Contract.objects.active())
+
+
+class BenchmarkHarnessTests(TestCase):
+    def test_query_counts_do_not_grow_with_the_dataset(self):
+        generate_benchmark_data(5, seed=1)
+        small = run_benchmarks(repeat=1)
+        generate_benchmark_data(20, seed=2)
+        large = run_benchmarks(repeat=1)
+
+        self.assertEqual(Vendor.objects.count(), 25)
+        self.assertEqual(compare_results({'n': large}, {'n': small}, latency_threshold=float('inf')), [])
+        for name in ('product', 'certification', 'contract'):
+            self.assertLessEqual({f'api_{name}_detail', f'api_{name}_export'}, set(large))
+        self.assertLessEqual({'api_product_bulk', 'api_contract_bulk', 'due_certification_events'}, set(large))
+        # every run is rolled back, bulk writes included
+        self.assertFalse(Contract.objects.filter(contract_id__startswith='BULK-').exists())
+
+    def test_partial_runs_merge_into_the_baseline(self):
+        baseline = {
+            '100': {'vendor_list': {'queries': 4, 'median_ms': 20.0}, 'dashboard_staff': {'queries': 4, 'median_ms': 9.0}},
+            '1000': {'vendor_list': {'queries': 4, 'median_ms': 90.0}},
+        }
+
+        merged = merge_results(baseline, {'100': {'vendor_list': {'queries': 3, 'median_ms': 18.0}}})
+
+        self.assertEqual(merged['100']['vendor_list']['queries'], 3)
+        self.assertEqual(merged['100']['dashboard_staff'], baseline['100']['dashboard_staff'])
+        self.assertEqual(merged['1000'], baseline['1000'])
+        self.assertEqual(baseline['100']['vendor_list']['queries'], 4)
+
+    def test_regressions_are_reported_past_the_thresholds(self):
+        baseline = {'100': {'vendor_list': {'queries': 4, 'median_ms': 20.0}}}
+        within = {'100': {'vendor_list': {'queries': 4, 'median_ms': 24.0}}}
+        worse = {'100': {'vendor_list': {'queries': 6, 'median_ms': 40.0}}}
+
+        self.assertEqual(compare_results(within, baseline), [])
+        self.assertEqual(len(compare_results(worse, baseline)), 2)
+
+
+@modify_settings(MIDDLEWARE={'prepend': 'management.instrumentation.RequestInstrumentationMiddleware'})
+@override_settings(REQUEST_INSTRUMENTATION=True, REQUEST_INSTRUMENTATION_SAMPLE_RATE=1.0, REQUEST_INSTRUMENTATION_LOG_THRESHOLD_MS=0)
+class RequestInstrumentationTests(TestCase):
+    def setUp(self):
+        request_samples.clear()
+        self.staff = User.objects.create_user(username='ops', password='pass', is_staff=True)
+        self.client.force_login(self.staff)
+
+    def test_sampled_requests_report_timings_and_repeated_queries(self):
+        with self.assertLogs('management.instrumentation', 'INFO') as logs:
+            response = self.client.get(reverse('vendor_list'))
+
+        self.assertRegex(response['Server-Timing'], r'app;dur=[\d.]+, db;dur=[\d.]+;desc="\d+ queries", tpl;dur=[\d.]+')
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual((record['view'], record['status']), ('vendor_list', 200))
+        self.assertGreater(record['queries'], 0)
+        self.assertGreater(record['template_ms'], 0)
+
+        with QueryRecorder(fingerprints=True) as queries:
+            for _ in range(3):
+                list(Vendor.objects.filter(name='repeated'))
+        self.assertEqual((queries.count, queries.duplicate_count()), (3, 2))
+        self.assertEqual(queries.duplicates()[0]['count'], 3)
+
+    @override_settings(REQUEST_INSTRUMENTATION_SAMPLE_RATE=0.0)
+    def test_unsampled_requests_are_untouched(self):
+        response = self.client.get(reverse('vendor_list'))
+        self.assertFalse(response.has_header('Server-Timing'))
+
+    def test_profile_endpoint_reports_percentiles_per_url_name(self):
+        with self.assertLogs('management.instrumentation', 'INFO'):
+            for _ in range(4):
+                self.client.get(reverse('dashboard'))
+            profile = self.client.get(reverse('request_profile')).json()
+
+        self.assertEqual(profile['views']['dashboard']['count'], 4)
+        self.assertEqual(set(profile['views']['dashboard']['wall_ms']), {'p50', 'p95', 'p99'})
+        self.assertEqual(percentiles(range(1, 101)), {'p50': 50, 'p95': 95, 'p99': 99})
+
+        self.client.force_login(User.objects.create_user(username='not-ops', password='pass'))
+        with self.assertLogs('management.instrumentation', 'INFO'):
+            self.assertEqual(self.client.get(reverse('request_profile')).status_code, 403)
+
+
+class TaskInstrumentationTests(TestCase):
+    def setUp(self):
+        self.vendor = Vendor.objects.create(name='Timed Vendor', contact_email='vendor@example.com')
+        create_certification(self.vendor, 30, approval_status='approved')
+        self.staff = User.objects.create_user(username='ops', password='pass', is_staff=True)
+
+    def test_daily_checks_record_phases_and_counters(self):
+        summary = run_daily_certification_checks()
+
+        run = TaskRun.objects.get(task='management.tasks.run_daily_certification_checks')
+        self.assertEqual((run.status, run.inline, run.error), ('succeeded', True, ''))
+        self.assertEqual(list(run.phases), ['notified_30_days', 'notified_15_days', 'notified_1_day', 'deliver_notices', 'inactivate_vendors'])
+        self.assertEqual(run.phases['notified_30_days']['rows_scanned'], 1)
+        self.assertEqual(run.phases['notified_30_days']['rows_updated'], 1)
+        self.assertEqual(run.phases['deliver_notices']['emails_sent'], summary['emails_sent'])
+        self.assertEqual(run.counters, {'rows_scanned': 1, 'rows_updated': 1, 'emails_sent': summary['emails_sent']})
+        # every query of the task runs inside one of its phases
+        self.assertEqual(run.queries, sum(phase['queries'] for phase in run.phases.values()))
+        self.assertGreaterEqual(run.duration_ms, sum(phase['duration_ms'] for phase in run.phases.values()))
+
+    def test_failed_runs_are_recorded_and_reraised(self):
+        with mock.patch('management.tasks.orphan_blob_ids', side_effect=RuntimeError('storage down')):
+            with self.assertRaises(RuntimeError):
+                collect_orphan_certificate_blobs()
+
+        run = TaskRun.objects.get()
+        self.assertEqual((run.task, run.status), ('management.tasks.collect_orphan_certificate_blobs', 'failed'))
+        self.assertEqual(run.error, 'RuntimeError: storage down')
+        self.assertEqual(list(run.phases), ['find_orphans'])
+
+    def test_phases_and_counters_are_no_ops_outside_tasks(self):
+        with task_phase('loose'):
+            task_count('rows_scanned')
+        with override_settings(TASK_INSTRUMENTATION=False):
+            run_daily_certification_checks()
+        self.assertFalse(TaskRun.objects.exists())
+
+    def test_metrics_expose_latest_run_per_task(self):
+        task = 'management.tasks.prune_change_log'
+        TaskRun.objects.create(task=task, status='failed', started_at=timezone.now() - timedelta(hours=1), duration_ms=9000)
+        TaskRun.objects.create(task=task, status='failed', started_at=timezone.now() - timedelta(days=2), duration_ms=9000)
+        TaskRun.objects.create(
+            task=task, status='succeeded', duration_ms=1500, queries=4,
+            phases={'delete': {'duration_ms': 1200, 'queries': 4, 'db_ms': 800, 'rows_deleted': 12}},
+        )
+        self.client.force_login(self.staff)
+
+        response = self.client.get(reverse('task_metrics'))
+
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        lines = response.content.decode().splitlines()
+        labels = f'{{task="{task}"}}'
+        self.assertIn('# TYPE management_task_last_duration_seconds gauge', lines)
+        self.assertIn(f'management_task_last_duration_seconds{labels} 1.5', lines)
+        self.assertIn(f'management_task_last_failed{labels} 0', lines)
+        self.assertIn(f'management_task_recent_runs{{task="{task}",status="failed"}} 1', lines)
+        self.assertIn(f'management_task_last_phase_queries{{task="{task}",phase="delete"}} 4', lines)
+        self.assertIn(f'management_task_last_phase_count{{task="{task}",phase="delete",counter="rows_deleted"}} 12', lines)
+
+    def test_metrics_cost_does_not_grow_with_history(self):
+        runs = [TaskRun(task='management.tasks.prune_change_log', status='succeeded', duration_ms=1) for _ in range(50)]
+        TaskRun.objects.bulk_create(runs)
+        # run counts, last successes and latest runs: each seeks per task instead of scanning the table
+        with self.assertNumQueries(3):
+            task_metrics()
+
+    @override_settings(METRICS_TOKEN='scrape-me')
+    def test_metrics_require_staff_or_token(self):
+        url = reverse('task_metrics')
+        self.assertEqual(self.client.get(url).status_code, 401)
+        self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION='Bearer wrong').status_code, 401)
+        self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION='Bearer scrape-me').status_code, 200)
+        self.client.force_login(User.objects.create_user(username='not-ops', password='pass'))
+        self.assertEqual(self.client.get(url).status_code, 401)
+
+    @override_settings(TASK_RUN_RETENTION_DAYS=30)
+    def test_old_runs_are_pruned(self):
+        TaskRun.objects.create(task='old', status='succeeded', started_at=timezone.now() - timedelta(days=31), duration_ms=1)
+        TaskRun.objects.create(task='recent', status='succeeded', duration_ms=1)
+
+        self.assertEqual(prune_task_runs(), 1)
+        self.assertEqual(
+            sorted(TaskRun.objects.values_list('task', flat=True)),
+            ['management.tasks.prune_task_runs', 'recent'],
+        )
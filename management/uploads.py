@@ -0,0 +1,111 @@
+import importlib.util
+import io
+import os
+import re
+import shutil
+import uuid
+
+from django.conf import settings
+
+SNIFF_BYTES = 16
+CONTENT_SIGNATURES = [
+    (b'%PDF-', 'application/pdf'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'II*\x00', 'image/tiff'),
+    (b'MM\x00*', 'image/tiff'),
+]
+PDF_PAGE_OBJECT = re.compile(rb'/Type\s*/Page(?![a-zA-Z])')
+SCAN_CHUNK_SIZE = 1024 * 1024
+
+
+class UnsupportedUpload(ValueError):
+    pass
+
+
+def spool_upload(upload):
+    """Park an uploaded file in the spool directory and return its path.
+
+    Uploads above ``FILE_UPLOAD_MAX_MEMORY_SIZE`` are already on disk, so they
+    are moved (a rename when the spool shares the filesystem) rather than copied.
+    """
+    os.makedirs(settings.CERT_UPLOAD_SPOOL_DIR, exist_ok=True)
+    _name, ext = os.path.splitext(upload.name)
+    path = os.path.join(settings.CERT_UPLOAD_SPOOL_DIR, f'{uuid.uuid4().hex}{ext.lower()}')
+    if hasattr(upload, 'temporary_file_path'):
+        shutil.move(upload.temporary_file_path(), path)
+    else:
+        with open(path, 'wb') as spooled:
+            for chunk in upload.chunks():
+                spooled.write(chunk)
+    return path
+
+
+def sniff_content_type(handle):
+    head = handle.read(SNIFF_BYTES)
+    handle.seek(0)
+    for signature, content_type in CONTENT_SIGNATURES:
+        if head.startswith(signature):
+            return content_type
+    raise UnsupportedUpload('Unsupported file type; upload a PDF or a scanned image.')
+
+
+def _scan_pdf_pages(handle):
+    # fallback without pypdf: count page objects, keeping an overlap so a match split across chunks is still seen
+    count = 0
+    tail = b''
+    while chunk := handle.read(SCAN_CHUNK_SIZE):
+        window = tail + chunk
+        count += len(PDF_PAGE_OBJECT.findall(window)) - len(PDF_PAGE_OBJECT.findall(tail))
+        tail = window[-32:]
+    return count or None
+
+
+def count_pages(handle, content_type):
+    if content_type != 'application/pdf':
+        return 1
+    try:
+        if importlib.util.find_spec('pypdf'):
+            from pypdf import PdfReader
+            from pypdf.errors import PdfReadError
+
+            try:
+                return len(PdfReader(handle).pages)
+            except PdfReadError as exc:
+                raise UnsupportedUpload('The PDF could not be read.') from exc
+        return _scan_pdf_pages(handle)
+    finally:
+        handle.seek(0)
+
+
+def render_thumbnail(handle, content_type):
+    """PNG bytes of the first page scaled to ``CERT_THUMBNAIL_SIZE``, or ``None`` without a renderer."""
+    size = settings.CERT_THUMBNAIL_SIZE
+    try:
+        if content_type == 'application/pdf':
+            if not importlib.util.find_spec('fitz'):
+                return None
+            import fitz
+
+            try:
+                with fitz.open(stream=handle.read(), filetype='pdf') as document:
+                    page = document[0]
+                    scale = size / max(page.rect.width, page.rect.height)
+                    return page.get_pixmap(matrix=fitz.Matrix(scale, scale)).tobytes('png')
+            except (RuntimeError, IndexError) as exc:
+                raise UnsupportedUpload('The PDF could not be read.') from exc
+
+        if not importlib.util.find_spec('PIL'):
+            return None
+        from PIL import Image, UnidentifiedImageError
+
+        try:
+            with Image.open(handle) as image:
+                image.thumbnail((size, size))
+                output = io.BytesIO()
+                image.convert('RGB').save(output, format='PNG')
+                return output.getvalue()
+        except (UnidentifiedImageError, OSError) as exc:
+            raise UnsupportedUpload('The image could not be read.') from exc
+    finally:
+        handle.seek(0)
@@ -3,8 +3,16 @@ from django.urls import path
 from .views import (
     ApprovalQueueView,
     ApproveCertificationView,
+    AuditExportView,
+    CertificationDirectUploadPutView,
+    CertificationDirectUploadView,
+    CertificationDocumentView,
+    CertificationFinalizeView,
     CertificationUploadView,
     DashboardView,
+    RequestProfileView,
+    ReviewCertificationsView,
+    TaskMetricsView,
     VendorAuditExportView,
     VendorCreateView,
     VendorDetailView,
@@ -20,8 +28,16 @@ urlpatterns = [
     path('vendors/<uuid:pk>/', VendorDetailView.as_view(), name='vendor_detail'),
     path('vendors/<uuid:pk>/edit/', VendorUpdateView.as_view(), name='vendor_update'),
     path('vendors/<uuid:pk>/audit-export/', VendorAuditExportView.as_view(), name='vendor_audit_export'),
+    path('vendors/audit-export/', AuditExportView.as_view(), name='audit_export'),
+    path('certifications/<int:pk>/document/', CertificationDocumentView.as_view(), name='cert_document'),
     path('compliance/queue/', ApprovalQueueView.as_view(), name='approval_queue'),
+    path('compliance/certifications/review/', ReviewCertificationsView.as_view(), name='review_certifications'),
     path('compliance/certifications/<int:pk>/approve/', ApproveCertificationView.as_view(), name='approve_certification'),
+    path('ops/request-profile/', RequestProfileView.as_view(), name='request_profile'),
+    path('ops/task-metrics/', TaskMetricsView.as_view(), name='task_metrics'),
     path('profile/', VendorProfileView.as_view(), name='vendor_profile'),
     path('profile/upload_cert/', CertificationUploadView.as_view(), name='cert_upload'),
+    path('profile/upload_cert/direct/', CertificationDirectUploadView.as_view(), name='cert_direct_upload'),
+    path('profile/upload_cert/direct/<str:token>/', CertificationDirectUploadPutView.as_view(), name='cert_direct_upload_put'),
+    path('profile/upload_cert/finalize/', CertificationFinalizeView.as_view(), name='cert_upload_finalize'),
 ]
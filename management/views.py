@@ -1,18 +1,45 @@
 import csv
-from datetime import timedelta
+from functools import partial
 
+from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
-from django.db.models import Q, Sum
-from django.http import Http404, HttpResponse
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Max
+from django.http import Http404, HttpResponse, HttpResponseForbidden, JsonResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, redirect
-from django.urls import reverse_lazy
+from django.template.defaultfilters import pluralize
+from django.urls import reverse, reverse_lazy
 from django.utils import timezone
+from django.utils.cache import patch_cache_control, quote_etag
+from django.utils.crypto import constant_time_compare
+from django.utils.decorators import method_decorator
+from django.views.decorators.csrf import csrf_exempt
 from django.views import View
 from django.views.generic import CreateView, DetailView, ListView, TemplateView, UpdateView
 
-from .forms import CertificationForm, VendorForm, VendorProfileForm
-from .models import Certification, Contract, Product, Vendor, VendorHistory
+from .conditional import ConditionalGetMixin, conditional_response, latest
+from .dashboard import cached_dashboard_metrics, dashboard_cache_metrics
+from .direct_uploads import InvalidUploadToken, presign_upload, read_upload_token
+from .documents import cached_file_url, file_response
+from .forms import (
+    ApprovalQueueFilterForm,
+    CertificationFinalizeForm,
+    CertificationForm,
+    CertificationReviewForm,
+    DirectUploadRequestForm,
+    VendorForm,
+    VendorProfileForm,
+)
+from .instrumentation import request_samples, task_metrics
+from .models import Certification, Vendor, VendorHistory
+from .pagination import InvalidCursor, KeysetPaginator
+from .reviews import review_certifications
+from .search import search_vendors
+from .tasks import enqueue_certification_upload
+from .uploads import spool_upload
 
 
 class ScopedQuerysetMixin:
@@ -22,67 +49,85 @@ class ScopedQuerysetMixin:
         return self.model.objects.for_user(self.request.user)
 
 
+class KeysetPaginationMixin:
+    keyset_ordering = ()
+
+    def paginate_queryset(self, queryset, page_size):
+        paginator = KeysetPaginator(self.keyset_ordering, page_size)
+        try:
+            page = paginator.paginate(queryset, self.request.GET.get('cursor'))
+        except InvalidCursor as exc:
+            raise Http404('Invalid page cursor.') from exc
+        return paginator, page, page.object_list, page.has_other_pages()
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        # lets "next page" links keep the current filters
+        query = self.request.GET.copy()
+        query.pop('cursor', None)
+        context['filter_query'] = query.urlencode()
+        return context
+
+
 class DashboardView(LoginRequiredMixin, TemplateView):
     template_name = 'management/dashboard.html'
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        vendor_scope = Vendor.objects.for_user(self.request.user)
-
-        context['total_vendors'] = vendor_scope.count()
-        context['verified_vendors'] = vendor_scope.filter(status='verified').count()
-
-        thirty_days_future = timezone.now().date() + timedelta(days=30)
-        context['expiring_certs'] = Certification.objects.for_user(self.request.user).filter(
-            expiry_date__lte=thirty_days_future,
-            expiry_date__gte=timezone.now().date(),
-        ).count()
-
-        context['total_products'] = Product.objects.for_user(self.request.user).count()
-
-        today = timezone.now().date()
-        active_contracts = Contract.objects.for_user(self.request.user).active(on_date=today)
-        context['total_spend'] = active_contracts.aggregate(total=Sum('total_value'))['total'] or 0
-
-        spend_by_risk = active_contracts.values('vendor__risk_tier').annotate(total=Sum('total_value'))
-        spend_map = {row['vendor__risk_tier']: row['total'] for row in spend_by_risk}
-        context['risk_labels'] = ['Low', 'Medium', 'High']
-        context['risk_spend_data'] = [
-            float(spend_map.get('Low', 0) or 0),
-            float(spend_map.get('Medium', 0) or 0),
-            float(spend_map.get('High', 0) or 0),
-        ]
-
-        context['chart_labels'] = ['Verified', 'Pending', 'Under Review', 'Inactive']
-        context['chart_data'] = [
-            context['verified_vendors'],
-            vendor_scope.filter(status='pending').count(),
-            vendor_scope.filter(status='under_review').count(),
-            vendor_scope.filter(status='inactive').count(),
-        ]
+        context.update(cached_dashboard_metrics(self.request.user))
         return context
 
 
-class VendorListView(LoginRequiredMixin, ScopedQuerysetMixin, ListView):
+class VendorListView(LoginRequiredMixin, ScopedQuerysetMixin, ConditionalGetMixin, KeysetPaginationMixin, ListView):
     model = Vendor
     template_name = 'management/vendor_list.html'
     context_object_name = 'vendors'
 
+    paginate_by = 50
+    keyset_ordering = ('-created_at', '-id')
+
     def get_queryset(self):
-        today = timezone.now().date()
-        return super().get_queryset().annotate(
-            active_contract_value=Sum(
-                'contracts__total_value',
-                filter=Q(contracts__start_date__lte=today, contracts__end_date__gte=today),
-            )
-        ).order_by('-created_at')
+        queryset = super().get_queryset()
+        self.search_query = self.request.GET.get('q', '').strip()
+        if self.search_query:
+            queryset = search_vendors(queryset, self.search_query)
+        return queryset.annotate(
+            active_contract_value=F('rollup__active_contract_value'),
+        )
+
+    def get_paginate_by(self, queryset):
+        # search results are a single ranked page capped at SEARCH_RESULT_LIMIT
+        return None if self.search_query else self.paginate_by
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['search_query'] = self.search_query
+        return context
+
+    def get_version_stamp(self):
+        # the row count catches deletions, which leave no timestamp behind; with
+        # nothing to date them by, lists only get an ETag
+        stamp = super().get_queryset().aggregate(
+            count=Count('pk'), vendors=Max('updated_at'), rollups=Max('rollup__updated_at')
+        )
+        return (stamp['count'], stamp['vendors'], stamp['rollups']), None
 
 
-class VendorDetailView(LoginRequiredMixin, ScopedQuerysetMixin, DetailView):
+class VendorDetailView(LoginRequiredMixin, ScopedQuerysetMixin, ConditionalGetMixin, DetailView):
     model = Vendor
     template_name = 'management/vendor_detail.html'
     context_object_name = 'vendor'
 
+    def get_queryset(self):
+        return super().get_queryset().select_related('rollup', 'internal_rep')
+
+    def get_version_stamp(self):
+        # every cert, contract and product write (deletes included) refreshes the rollup
+        stamp = super().get_queryset().filter(pk=self.kwargs['pk']).values_list('updated_at', 'rollup__updated_at').first()
+        if stamp is None:
+            return None
+        return stamp, latest(*stamp)
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['certs'] = self.object.certs.all()
@@ -107,6 +152,13 @@ class VendorUpdateView(LoginRequiredMixin, ScopedQuerysetMixin, UpdateView):
     success_url = reverse_lazy('vendor_list')
 
 
+def _vendor_profile(user):
+    try:
+        return user.vendor_profile
+    except Vendor.DoesNotExist as exc:
+        raise Http404('Vendor profile not found for this user.') from exc
+
+
 class VendorProfileView(LoginRequiredMixin, UpdateView):
     model = Vendor
     form_class = VendorProfileForm
@@ -114,10 +166,7 @@ class VendorProfileView(LoginRequiredMixin, UpdateView):
     success_url = reverse_lazy('vendor_profile')
 
     def get_object(self, queryset=None):
-        try:
-            return self.request.user.vendor_profile
-        except Vendor.DoesNotExist as exc:
-            raise Http404('Vendor profile not found for this user.') from exc
+        return _vendor_profile(self.request.user)
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -125,6 +174,7 @@ class VendorProfileView(LoginRequiredMixin, UpdateView):
         context['products'] = self.object.products.all()
         context['contracts'] = self.object.contracts.with_is_active()
         context['cert_form'] = CertificationForm()
+        context['direct_uploads'] = settings.CERT_DIRECT_UPLOADS
         return context
 
 
@@ -137,19 +187,157 @@ class CertificationUploadView(LoginRequiredMixin, CreateView):
     def form_valid(self, form):
         form.instance.vendor = self.request.user.vendor_profile
         form.instance.approval_status = 'pending'
-        return super().form_valid(form)
+        # the file is stored by a background task, so the request never waits on the storage backend
+        form.instance.upload_spool_path = spool_upload(form.cleaned_data['file'])
+        form.instance.file = ''
+        form.instance.processing_status = 'pending'
+        response = super().form_valid(form)
+        transaction.on_commit(partial(enqueue_certification_upload, self.object.pk))
+        messages.success(self.request, 'Certification received; the document is being processed.')
+        return response
+
+
+class CertificationDirectUploadView(LoginRequiredMixin, View):
+    """Issue a presigned target so the browser uploads the certificate straight to storage."""
+
+    def post(self, request):
+        vendor = _vendor_profile(request.user)
+        form = DirectUploadRequestForm(request.POST)
+        if not form.is_valid():
+            return JsonResponse({'errors': form.errors}, status=400)
+        return JsonResponse(presign_upload(vendor, form.cleaned_data['filename'], form.cleaned_data['content_type']))
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class CertificationDirectUploadPutView(View):
+    """Filesystem stand-in for a presigned bucket URL; the signed token is the only credential."""
+
+    def put(self, request, token):
+        if settings.STORAGE_BACKEND in {'s3', 'gcs'}:
+            raise Http404('Uploads go straight to the bucket.')
+        try:
+            key = read_upload_token(token)
+        except InvalidUploadToken:
+            return HttpResponseForbidden()
+        length = int(request.META.get('CONTENT_LENGTH') or 0)
+        if not 0 < length <= settings.CERT_UPLOAD_MAX_BYTES:
+            return HttpResponse(status=413)
+        if default_storage.exists(key) or Certification.objects.filter(direct_upload_key=key).exists():
+            return HttpResponse(status=409)
+        default_storage.save(key, File(request, name=key))
+        return HttpResponse()
+
+
+class CertificationFinalizeView(LoginRequiredMixin, View):
+    """Create the Certification for a direct upload once its object is in storage."""
+
+    def post(self, request):
+        vendor = _vendor_profile(request.user)
+        form = CertificationFinalizeForm(request.POST)
+        if not form.is_valid():
+            return JsonResponse({'errors': form.errors}, status=400)
+        try:
+            key = read_upload_token(form.cleaned_data['token'], vendor)
+        except InvalidUploadToken as exc:
+            return JsonResponse({'errors': {'token': [str(exc)]}}, status=400)
+
+        # only object metadata is read here; the bytes are inspected by the background task
+        already_submitted = JsonResponse({'errors': {'token': ['This upload has already been submitted.']}}, status=400)
+        if Certification.objects.filter(direct_upload_key=key).exists():
+            return already_submitted
+        if not default_storage.exists(key):
+            return JsonResponse({'errors': {'token': ['The file has not been uploaded yet.']}}, status=400)
+        if default_storage.size(key) > settings.CERT_UPLOAD_MAX_BYTES:
+            default_storage.delete(key)
+            return JsonResponse({'errors': {'token': ['The file is too large.']}}, status=400)
+
+        cert = form.save(commit=False)
+        cert.vendor = vendor
+        cert.approval_status = 'pending'
+        cert.processing_status = 'pending'
+        cert.file = key
+        cert.direct_upload_key = key
+        try:
+            with transaction.atomic():
+                cert.save()
+        except IntegrityError:
+            # a concurrent finalize of the same token won
+            return already_submitted
+        transaction.on_commit(partial(enqueue_certification_upload, cert.pk))
+        return JsonResponse({'id': cert.pk, 'processing_status': cert.processing_status}, status=201)
+
+
+class CertificationDocumentView(LoginRequiredMixin, View):
+    """Serve a certificate document to anyone who can see its vendor, internal reps included.
 
+    Bucket backends redirect to a cached signed URL; local files are streamed
+    with Range support or offloaded to the web server.
+    """
 
-class ApprovalQueueView(LoginRequiredMixin, UserPassesTestMixin, ListView):
+    def get(self, request, pk):
+        # the vendor scope, not CertificationQuerySet.for_user, so reps can open the PDFs the vendor page links to
+        certifications = Certification.objects.filter(vendor__in=Vendor.objects.for_user(request.user).values('pk'))
+        cert = get_object_or_404(certifications.select_related('blob'), pk=pk)
+        if not cert.file:
+            raise Http404('The document is still being processed.')
+
+        if settings.STORAGE_BACKEND in {'s3', 'gcs'}:
+            response = redirect(cached_file_url(cert.file.name))
+        else:
+            # blob names are content addresses, so the digest is a strong validator
+            etag = quote_etag(cert.blob.sha256) if cert.blob else None
+            response = conditional_response(request, etag) if etag else None
+            if response is None:
+                response = file_response(request, cert.file.name, cert.content_type, etag=etag)
+        patch_cache_control(response, private=True)
+        return response
+
+
+class ApprovalQueueView(LoginRequiredMixin, UserPassesTestMixin, KeysetPaginationMixin, ListView):
     model = Certification
     template_name = 'management/approval_queue.html'
     context_object_name = 'certifications'
 
+    paginate_by = 50
+    keyset_ordering = ('expiry_date', 'id')
+
     def test_func(self):
         return self.request.user.is_staff or self.request.user.is_superuser
 
     def get_queryset(self):
-        return Certification.objects.filter(approval_status='pending').select_related('vendor')
+        self.filter_form = ApprovalQueueFilterForm(self.request.GET)
+        queryset = Certification.objects.filter(approval_status='pending').select_related('vendor')
+        return self.filter_form.filter(queryset)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['filter_form'] = self.filter_form
+        return context
+
+
+class ReviewCertificationsView(LoginRequiredMixin, UserPassesTestMixin, View):
+    """Approve or reject the selected queue items in one statement."""
+
+    def test_func(self):
+        return self.request.user.is_staff or self.request.user.is_superuser
+
+    def post(self, request):
+        form = CertificationReviewForm(request.POST)
+        if not form.is_valid():
+            messages.error(request, 'Select at least one certification and a decision.')
+            return redirect('approval_queue')
+
+        decision = form.cleaned_data['decision']
+        selected = form.cleaned_data['certifications']
+        reviewed = review_certifications(selected, decision, request.user)
+        verb = 'approved' if decision == 'approve' else 'rejected'
+        messages.success(request, f'{reviewed} certification{pluralize(reviewed)} {verb}.')
+        if reviewed < len(selected):
+            skipped = len(selected) - reviewed
+            messages.warning(request, f'{skipped} skipped: already reviewed or still processing.')
+        queue_url = reverse('approval_queue')
+        filter_query = request.POST.get('filter_query')
+        return redirect(f'{queue_url}?{filter_query}' if filter_query else queue_url)
 
 
 class ApproveCertificationView(LoginRequiredMixin, UserPassesTestMixin, View):
@@ -158,28 +346,85 @@ class ApproveCertificationView(LoginRequiredMixin, UserPassesTestMixin, View):
 
     def post(self, request, pk):
         cert = get_object_or_404(Certification, pk=pk)
+        if cert.processing_status != 'ready':
+            messages.error(request, 'This certification document has not finished processing.')
+            return redirect('approval_queue')
         cert.approval_status = 'approved'
         cert.reviewed_by = request.user
         cert.reviewed_at = timezone.now()
-        cert.save(update_fields=['approval_status', 'reviewed_by', 'reviewed_at'])
+        cert.save(update_fields=['approval_status', 'reviewed_by', 'reviewed_at', 'updated_at'])
         messages.success(request, 'Certification approved.')
         return redirect('approval_queue')
 
 
+class RequestProfileView(LoginRequiredMixin, UserPassesTestMixin, View):
+    """p50/p95/p99 per URL name over the requests in the instrumentation ring buffer."""
+
+    def test_func(self):
+        return self.request.user.is_staff or self.request.user.is_superuser
+
+    def get(self, request):
+        return JsonResponse({
+            'enabled': settings.REQUEST_INSTRUMENTATION,
+            'sample_rate': settings.REQUEST_INSTRUMENTATION_SAMPLE_RATE,
+            'views': request_samples.summary(),
+        })
+
+
+class TaskMetricsView(View):
+    """Task runs and dashboard cache counters as Prometheus text, for staff or a scraper holding ``METRICS_TOKEN``."""
+
+    def get(self, request):
+        token = settings.METRICS_TOKEN
+        scraper = bool(token) and constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}')
+        if not (scraper or request.user.is_staff or request.user.is_superuser):
+            return HttpResponse('Unauthorized', status=401, headers={'WWW-Authenticate': 'Bearer'})
+        metrics = task_metrics() + dashboard_cache_metrics()
+        return HttpResponse(metrics, content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+class _Echo:
+    def write(self, value):
+        return value
+
+
+def _history_csv_rows(rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(['vendor', 'status', 'changed_by', 'timestamp'])
+    for vendor_name, status, changed_by, timestamp in rows:
+        yield writer.writerow([vendor_name, status, changed_by or '', timestamp.isoformat()])
+
+
+def _history_csv_response(rows, filename):
+    response = StreamingHttpResponse(_history_csv_rows(rows), content_type='text/csv')
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
 class VendorAuditExportView(LoginRequiredMixin, ScopedQuerysetMixin, View):
     model = Vendor
 
     def get(self, request, pk):
         vendor = get_object_or_404(self.get_queryset(), pk=pk)
-        response = HttpResponse(content_type='text/csv')
-        response['Content-Disposition'] = f'attachment; filename="vendor_audit_{vendor.id}.csv"'
-        writer = csv.writer(response)
-        writer.writerow(['vendor', 'status', 'changed_by', 'timestamp'])
-        for record in VendorHistory.objects.filter(vendor=vendor).select_related('changed_by').order_by('timestamp'):
-            writer.writerow([
-                vendor.name,
-                record.status,
-                record.changed_by.username if record.changed_by else '',
-                record.timestamp.isoformat(),
-            ])
-        return response
+        rows = (
+            VendorHistory.objects.filter(vendor=vendor)
+            .order_by('timestamp', 'pk')
+            .values_list('status', 'changed_by__username', 'timestamp')
+            .iterator(chunk_size=settings.AUDIT_EXPORT_CHUNK_SIZE)
+        )
+        return _history_csv_response(
+            ((vendor.name, *row) for row in rows),
+            f'vendor_audit_{vendor.id}.csv',
+        )
+
+
+class AuditExportView(LoginRequiredMixin, View):
+    def get(self, request):
+        # insertion (pk) order lets the database stream rows without sorting the whole table
+        rows = (
+            VendorHistory.objects.filter(vendor__in=Vendor.objects.for_user(request.user).values('pk'))
+            .order_by('pk')
+            .values_list('vendor__name', 'status', 'changed_by__username', 'timestamp')
+            .iterator(chunk_size=settings.AUDIT_EXPORT_CHUNK_SIZE)
+        )
+        return _history_csv_response(rows, f'vendor_audit_{timezone.now().date().isoformat()}.csv')